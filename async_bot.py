@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+import asyncio
+import inspect
+import argparse
+
+from transport import Sequencer, Reassembler
+from delta import DeltaLost
+
+
+class EndpointProtocol(asyncio.DatagramProtocol):
+    def __init__(self, queue):
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+    def error_received(self, exc):
+        # e.g. the game isn't listening yet, we'll resubscribe on the next timeout
+        print(exc)
+
+
+class AsyncBot:
+    # Drives many game instances from one event loop. Every instance is a
+    # regular Bot (or LLMBot, ...) with its own strategy callbacks, self.G and
+    # self.state, talking to its own (host, port) in push mode.
+    #
+    # Strategy hooks can be coroutines, in which case they're awaited. Plain
+    # hooks are run in a worker thread when threaded_hooks is set, so a slow
+    # blocking call (like LLMBot._query_llm) doesn't hold up the other games.
+    def __init__(self, timeout: float = 5, threaded_hooks: bool = True):
+        self.timeout = timeout
+        self.threaded_hooks = threaded_hooks
+        self.bots = []
+
+    def add_bot(self, bot):
+        self.bots.append(bot)
+        return bot
+
+    async def chooseaction(self, bot):
+        if self.threaded_hooks:
+            action = await asyncio.to_thread(bot.chooseaction)
+        else:
+            action = bot.chooseaction()
+
+        if inspect.isawaitable(action):
+            action = await action
+        return action
+
+    async def run_bot(self, bot):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: EndpointProtocol(queue), remote_addr=bot.addr
+        )
+
+        bot.push = True
+        hello = bytes(bot.hellocmd(), "utf-8")
+        bot.session = Sequencer()
+        reassembler = Reassembler()
+        bot.running = True
+        try:
+            transport.sendto(hello)
+            while bot.running:
+                if reassembler.expired():
+                    # A chunk of the state we were putting together was lost
+                    bot.session.expire()
+                    transport.sendto(hello)
+
+                resend = bot.session.retransmit()
+                if resend is not None:
+                    transport.sendto(bytes(resend, "utf-8"))
+
+                timeout = self.timeout
+                if reassembler.pending:
+                    timeout = min(timeout, reassembler.remaining())
+                if bot.session.unacked is not None:
+                    timeout = min(timeout, bot.session.until_retransmit())
+                try:
+                    data = await asyncio.wait_for(queue.get(), max(timeout, 0.001))
+                except asyncio.TimeoutError:
+                    if reassembler.pending or bot.session.unacked is not None:
+                        continue
+                    # Nothing pushed, the game may have restarted and forgotten
+                    # us, or our last action was never acknowledged
+                    bot.session.expire()
+                    transport.sendto(hello)
+                    continue
+
+                if bot.session.isack(data):
+                    bot.session.acked(data)
+                    continue
+                if reassembler.ischunk(data):
+                    data = reassembler.add(data)
+                    if data is None:
+                        continue
+
+                try:
+                    if not bot.updatestate(data):
+                        continue
+                except DeltaLost:
+                    transport.sendto(hello)
+                    continue
+
+                action = await self.chooseaction(bot)
+                if action == None:
+                    raise ValueError("All actions must return a value!")
+
+                bot.decisions += 1
+                transport.sendto(bytes(bot.session.tag(bot.actionToCmd(action)), "utf-8"))
+        finally:
+            transport.close()
+            bot.session = None
+
+    async def run(self):
+        await asyncio.gather(*(self.run_bot(bot) for bot in self.bots))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an LLM bot against several Balatro instances")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--ports", type=int, nargs="+", default=[12347], help="One port per Balatro instance")
+    args = parser.parse_args()
+
+    from llm_strategy import LLMBot
+
+    runner = AsyncBot()
+    for port in args.ports:
+        runner.add_bot(
+            LLMBot(deck="Blue Deck", stake=1, seed=None, challenge=None, bot_port=port, push=True, bot_host=args.host)
+        )
+
+    print("Starting {} bots...".format(len(runner.bots)))
+    asyncio.run(runner.run())
@@ -1,7 +1,8 @@
 import heapq
 from enum import Enum, IntEnum
-from collections import Counter
-from itertools import combinations
+from functools import cached_property
+from array import array
+from collections import OrderedDict, namedtuple
 
 class Hand:
     def __init__(self, cards, preferred_suit=None):
@@ -11,32 +12,32 @@ class Hand:
     def __str__(self):
         return f'The hand contains {len(self.cards)} cards, with values {[card.card_key for card in self.cards]}'
 
+    @cached_property
+    def analysis(self):
+        return HandAnalysis(self.cards)
+
     def suit_check(self, include_debuffed_cards=False):
-        # I know I should just be using the Counter object, sue me!
         if include_debuffed_cards:
-            counter = Counter(card.suit for card in self.cards)
+            counter = dict(self.analysis.suit_counts)
         else:
-            counter = Counter(card.suit for card in self.cards if not card.debuff)
+            counter = dict(self.analysis.live_suit_counts)
         # Always ensure our counter has all 4 suits.
         for suit in CardSuits:
             counter.setdefault(suit.value, 0)
-        return dict(counter)
+        return counter
     
     def value_check(self, include_debuffed_cards=True):
-        # I know I should just be using the Counter object, sue me again!
         if include_debuffed_cards:
-            return dict(Counter(card.value for card in self.cards))
-        return dict(Counter(card.value for card in self.cards if not card.debuff))
+            return dict(self.analysis.value_counts)
+        return dict(self.analysis.live_value_counts)
 
     def get_cards_in_suit(self, suit=None):
         # will always return highest values first
-        filtered_cards = [card for card in self.cards if card.suit == suit]
-        return sorted(filtered_cards, key=lambda card: card.get_card_ranking(), reverse=True)
+        return list(self.analysis.cards_by_suit.get(suit, []))
 
     def get_cards_with_value(self, value=None):
-        filtered_cards = [card for card in self.cards if card.value == value]
         # TODO: How do we sort based on the best value modification approach?
-        return sorted(filtered_cards, key=lambda card: card.get_card_ranking(), reverse=True)
+        return list(self.analysis.cards_by_value.get(value, []))
     
     def get_most_common_cards(self, value_count={}):
         # By calling this, we're assuming there is one card value that
@@ -50,28 +51,50 @@ class Hand:
             cards.extend(self.get_cards_with_value(value=value))
         return cards
 
+    def get_straight_cards(self, top, first_by_rank):
+        # The cards making up the straight ending at `top`, in hand order
+        ranks = [CardRankings.ACE if rank == CardRankings.ONE else rank for rank in range(top - 4, top + 1)]
+        return [card for _, card in sorted(first_by_rank[rank] for rank in ranks)]
+
+    def get_straight_flush_cards(self):
+        # Highest straight flush over all suits, ties going to the suit seen first
+        best_top, best_cards = None, []
+        for suit, mask in self.analysis.suit_rank_masks.items():
+            top = highest_straight(mask)
+            if top is not None and (best_top is None or top > best_top):
+                best_top, best_cards = top, self.get_straight_cards(top, self.analysis.first_by_suit_rank[suit])
+        return best_top, best_cards
+
+    def update(self, removed, added):
+        # This hand after `removed` are discarded or played and `added` are
+        # drawn, carrying the analysis over if it's been worked out already
+        if "analysis" in self.__dict__:
+            self.cards = self.analysis.update(removed, added).cards
+        else:
+            gone = {id(card) for card in removed}
+            self.cards = [card for card in self.cards if id(card) not in gone] + list(added)
+        return self
+
+    def classify(self, cache=None):
+        # Every detector's pick at once, through an LRU cache so a hand we've
+        # seen before (in any order) isn't worked out again
+        return (cache or HAND_CACHE).classify(self)
+
     # Are hands playable (in order of their poker ranking)
     def get_royal_flush(self):
-        ROYAL_VALUES = [CardRankings.TEN, CardRankings.JACK, CardRankings.QUEEN, CardRankings.KING, CardRankings.ACE]
-        for five_cards in combinations(self.cards, 5):
-            suits = {card.suit for card in five_cards}
-            values = sorted(card.get_card_ranking() for card in five_cards)
-            if len(suits) == 1 and values == ROYAL_VALUES:
-                # By golly, we've actually got one!
-                # Fun fact, the odds of getting a royal flush are 1 in 649,739 (with a standard 52 card deck)
-                print("I can play a Royal Flush!")
-                return [card.index for card in five_cards]
+        top, cards = self.get_straight_flush_cards()
+        if top == CardRankings.ACE:
+            # By golly, we've actually got one!
+            # Fun fact, the odds of getting a royal flush are 1 in 649,739 (with a standard 52 card deck)
+            print("I can play a Royal Flush!")
+            return [card.index for card in cards]
         return []
 
     def get_straight_flush(self):
-        # TODO: How to return the top straight flush?
-        for five_cards in combinations(self.cards, 5):
-            suits = {card.suit for card in five_cards}
-            values = sorted(card.get_card_ranking() for card in five_cards)
-            alt_values = sorted([CardRankings.ONE if v == CardRankings.ACE else v for v in values])
-            if len(suits) == 1 and (all(values[i] == values[i - 1] + 1 for i in range(1, 5)) or all(alt_values[i] == alt_values[i - 1] + 1 for i in range(1, 5))):
-                print("I can play a Straight Flush!")
-                return [card.index for card in five_cards]
+        _, cards = self.get_straight_flush_cards()
+        if cards:
+            print("I can play a Straight Flush!")
+            return [card.index for card in cards]
         return []
 
     def get_four_of_a_kind(self):
@@ -125,14 +148,10 @@ class Hand:
         return []
 
     def get_straight(self):
-        # TODO: Determine what the highest straight would be, rather than just returning
-        # a response the first time we find something that matches our conditional.
-        for five_cards in combinations(self.cards, 5):
-            values = sorted(card.get_card_ranking() for card in five_cards)
-            alt_values = sorted([CardRankings.ONE if v == CardRankings.ACE else v for v in values])
-            if all(values[i] == values[i - 1] + 1 for i in range(1, 5)) or all(alt_values[i] == alt_values[i - 1] + 1 for i in range(1, 5)):
-                print("I can play a Straight!")
-                return [card.index for card in five_cards]
+        top = highest_straight(self.analysis.rank_mask)
+        if top is not None:
+            print("I can play a Straight!")
+            return [card.index for card in self.get_straight_cards(top, self.analysis.first_by_rank)]
         return []
     
     def get_three_of_a_kind(self):
@@ -160,7 +179,276 @@ class Hand:
         return []
 
 
+# Hand.get_<category> detectors, best first
+CATEGORIES = (
+    "royal_flush",
+    "straight_flush",
+    "four_of_a_kind",
+    "full_house",
+    "flush",
+    "straight",
+    "three_of_a_kind",
+    "two_pair",
+    "pair",
+)
+
+
+class HandCache:
+    # Bounded LRU cache of hand classifications. Hands are keyed by their
+    # canonical_form, so the same cards in a different order, at different
+    # indexes, or with the suits swapped around share an entry (the
+    # detectors only ever compare suits). Results are worked out on the
+    # canonical hand and mapped back to the hand asked about, so where
+    # several cards would do equally well (two Kings for a pair) the one
+    # picked can differ from calling Hand.get_* directly.
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        self.entries.clear()
+
+    def classify(self, hand):
+        # {category: card indexes in hand order, [] if the hand doesn't have it}
+        canonical = canonical_form(hand.cards)
+        key, order = canonical.key, canonical.order
+
+        positions = self.entries.get(key)
+        if positions is None:
+            self.misses += 1
+            positions = self.entries[key] = self.compute(hand, canonical)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return {
+            category: [hand.cards[i].index for i in sorted(order[position] for position in picked)]
+            for category, picked in positions.items()
+        }
+
+    def compute(self, hand, canonical):
+        # Detect on the canonical hand, in key order with its suits
+        # relabelled, each card's index being its position in that order
+        suits = canonical.suits
+        relabelled = Hand(
+            [
+                Card(suits[card.suit], card.label, card.value, card.name, card.debuff, suits[card.suit][0] + card.card_key[1:], position)
+                for position, card in enumerate(hand.cards[i] for i in canonical.order)
+            ],
+            preferred_suit=suits.get(hand.preferred_suit),
+        )
+        return {category: tuple(getattr(relabelled, "get_" + category)()) for category in CATEGORIES}
+
+
+HAND_CACHE = HandCache()
+
+
+class HandAnalysis:
+    # Everything the Hand.get_* detectors look at, worked out in one pass over
+    # the cards. The live_ variants leave out debuffed cards. Counts are in the
+    # order values/suits first appear in the hand, card lists highest first.
+    # update() carries it over a discard or play and the draw after it.
+    def __init__(self, cards):
+        self.cards = cards
+        self.rankings = [card.rank for card in cards]
+        self.positions = {id(card): position for position, card in enumerate(cards)}
+        self.next_position = len(cards)
+
+        self.suit_counts = {}
+        self.live_suit_counts = {}
+        self.value_counts = {}
+        self.live_value_counts = {}
+        self.cards_by_suit = {}
+        self.live_cards_by_suit = {}
+        self.cards_by_value = {}
+        self.live_cards_by_value = {}
+
+        # Rank bitmasks for highest_straight, and the (position, card) of the
+        # first card of each ranking, for the whole hand and for each suit
+        self.live_cards = [card for card in cards if not card.debuff]
+        self.rank_mask = 0
+        self.suit_rank_masks = {}
+        self.first_by_rank = {}
+        self.first_by_suit_rank = {}
+
+        for position, (card, ranking) in enumerate(zip(cards, self.rankings)):
+            self.suit_counts[card.suit] = self.suit_counts.get(card.suit, 0) + 1
+            self.value_counts[card.value] = self.value_counts.get(card.value, 0) + 1
+            if not card.debuff:
+                self.live_suit_counts[card.suit] = self.live_suit_counts.get(card.suit, 0) + 1
+                self.live_value_counts[card.value] = self.live_value_counts.get(card.value, 0) + 1
+
+            bit = 1 << ranking
+            if ranking == CardRankings.ACE:
+                bit |= 1 << CardRankings.ONE
+            self.rank_mask |= bit
+            self.suit_rank_masks[card.suit] = self.suit_rank_masks.get(card.suit, 0) | bit
+            self.first_by_rank.setdefault(ranking, (position, card))
+            self.first_by_suit_rank.setdefault(card.suit, {}).setdefault(ranking, (position, card))
+
+        # Stable, so cards of the same ranking stay in hand order
+        self.descending = [cards[i] for i in sorted(range(len(cards)), key=self.rankings.__getitem__, reverse=True)]
+        self.ascending = [cards[i] for i in sorted(range(len(cards)), key=self.rankings.__getitem__)]
+        for card in self.descending:
+            self.cards_by_suit.setdefault(card.suit, []).append(card)
+            self.cards_by_value.setdefault(card.value, []).append(card)
+            if not card.debuff:
+                self.live_cards_by_suit.setdefault(card.suit, []).append(card)
+                self.live_cards_by_value.setdefault(card.value, []).append(card)
+
+    def update(self, removed, added):
+        # The analysis of this hand once `removed` have left it and `added`
+        # have been dealt on the end, adjusting the counts, masks and card
+        # lists in place rather than starting over. Positions in first_by_*
+        # become the order cards joined the hand, which sorts the same way.
+        # Each card moved costs about a third of analysing the whole hand,
+        # so past a quarter of the hand it's analysed again instead.
+        if len(removed) * 4 > len(self.cards):
+            gone = {id(card) for card in removed}
+            self.__init__([card for card in self.cards if id(card) not in gone] + list(added))
+            return self
+        reorder = False
+        for card in removed:
+            reorder |= self._remove(card)
+        gone = {id(card) for card in removed}
+        self.cards = [card for card in self.cards if id(card) not in gone]
+        for card in added:
+            self._add(card)
+        self.cards.extend(added)
+        self.rankings = [card.rank for card in self.cards]
+        if reorder:
+            self._reorder()
+        return self
+
+    def _remove(self, card):
+        # Whether the card might have been the first of its suit or value,
+        # which can move those in the counts' order
+        position = self.positions.pop(id(card))
+        ranking, suit, value = card.rank, card.suit, card.value
+        by_suit = self.first_by_suit_rank[suit]
+        first = (
+            self.first_by_rank[ranking][1] is card
+            or position == min(first for first, _ in by_suit.values())
+            or len(self.descending) != len(self.live_cards)
+        )
+
+        _discount(self.suit_counts, self.cards_by_suit, suit, card)
+        _discount(self.value_counts, self.cards_by_value, value, card)
+        if not card.debuff:
+            _discount(self.live_suit_counts, self.live_cards_by_suit, suit, card)
+            _discount(self.live_value_counts, self.live_cards_by_value, value, card)
+            self.live_cards.remove(card)
+        self.descending.remove(card)
+        self.ascending.remove(card)
+
+        # The next card of the same ranking takes over as the first one, or
+        # its bit goes from the masks
+        if self.first_by_rank[ranking][1] is card:
+            rest = self.cards_by_value.get(value)
+            if rest:
+                self.first_by_rank[ranking] = (self.positions[id(rest[0])], rest[0])
+            else:
+                del self.first_by_rank[ranking]
+                self.rank_mask &= ~RANK_BITS[ranking]
+        if by_suit[ranking][1] is card:
+            for other in self.cards_by_suit.get(suit, ()):
+                if other.rank == ranking:
+                    by_suit[ranking] = (self.positions[id(other)], other)
+                    break
+            else:
+                del by_suit[ranking]
+                self.suit_rank_masks[suit] &= ~RANK_BITS[ranking]
+                if not by_suit:
+                    del self.first_by_suit_rank[suit], self.suit_rank_masks[suit]
+        return first
+
+    def _add(self, card):
+        position = self.positions[id(card)] = self.next_position
+        self.next_position += 1
+        ranking, suit, value = card.rank, card.suit, card.value
+
+        _count(self.suit_counts, self.cards_by_suit, suit, card)
+        _count(self.value_counts, self.cards_by_value, value, card)
+        if not card.debuff:
+            _count(self.live_suit_counts, self.live_cards_by_suit, suit, card)
+            _count(self.live_value_counts, self.live_cards_by_value, value, card)
+            self.live_cards.append(card)
+        _insert_descending(self.descending, card)
+        # Ascending, after the cards ranked the same
+        ascending = self.ascending
+        i = len(ascending)
+        while i and ascending[i - 1].rank > ranking:
+            i -= 1
+        ascending.insert(i, card)
+
+        bit = RANK_BITS[ranking]
+        self.rank_mask |= bit
+        self.suit_rank_masks[suit] = self.suit_rank_masks.get(suit, 0) | bit
+        self.first_by_rank.setdefault(ranking, (position, card))
+        self.first_by_suit_rank.setdefault(suit, {}).setdefault(ranking, (position, card))
+
+    def _reorder(self):
+        # Back into the order values/suits first appear in the hand
+        suits, values, live_suits, live_values = {}, {}, {}, {}
+        for card in self.cards:
+            suits[card.suit] = self.suit_counts[card.suit]
+            values[card.value] = self.value_counts[card.value]
+            if not card.debuff:
+                live_suits[card.suit] = self.live_suit_counts[card.suit]
+                live_values[card.value] = self.live_value_counts[card.value]
+        self.suit_counts, self.value_counts = suits, values
+        self.live_suit_counts, self.live_value_counts = live_suits, live_values
+        self.suit_rank_masks = {suit: self.suit_rank_masks[suit] for suit in suits}
+
+
+def _count(counts, by_key, key, card):
+    counts[key] = counts.get(key, 0) + 1
+    _insert_descending(by_key.setdefault(key, []), card)
+
+
+def _discount(counts, by_key, key, card):
+    counts[key] -= 1
+    by_key[key].remove(card)
+    if not counts[key]:
+        del counts[key], by_key[key]
+
+
+def _insert_descending(cards, card):
+    # After the cards ranked the same, which are earlier in the hand. Hands
+    # are short enough that walking back beats a bisect.
+    i = len(cards)
+    while i and cards[i - 1].rank < card.rank:
+        i -= 1
+    cards.insert(i, card)
+
+
+def highest_straight(mask):
+    # Ranking of the top card of the highest run of 5 in a rank bitmask (bit n
+    # set for a card of ranking n, aces setting both 14 and 1), or None
+    runs = mask & (mask >> 1) & (mask >> 2) & (mask >> 3) & (mask >> 4)
+    if not runs:
+        return None
+    return runs.bit_length() - 1 + 4
+
+
 class Card:
+    __slots__ = ("suit", "label", "value", "name", "debuff", "card_key", "index", "rank", "suit_id", "code")
+
     def __init__(self, suit, label, value, name, debuff, card_key, index):
         # Balatro game specific
         self.suit = suit
@@ -172,6 +460,16 @@ class Card:
         # Custom
         # Represents index in current hand
         self.index = index
+        # Ranking as a plain int (2-14, aces high), suit as 0-3 (CardSuits
+        # order) and rank * 4 + suit_id, one number per rank and suit
+        self.rank = VALUE_RANKS[value]
+        self.suit_id = SUIT_IDS[suit]
+        self.code = self.rank * 4 + self.suit_id
+
+    @classmethod
+    def from_dict(cls, card, index):
+        # A card from G["hand"], G["deck"], ...
+        return cls(card['suit'], card['label'], card['value'], card['name'], card['debuff'], card['card_key'], index)
 
     def __str__(self):
         return f'This card is the {self.name}. It is in position {self.index} within the hand.'
@@ -180,23 +478,7 @@ class Card:
         return f'Card(\'{self.suit}\', {self.label}, {self.value}, {self.name}, {self.card_key}, {self.index})'
 
     def get_card_ranking(self):
-        if len(self.value) > 2:
-            # This is just a named card
-            return CardRankings[self.value.upper()]
-        else:
-            mapping = {
-                '10': CardRankings.TEN,
-                '9': CardRankings.NINE,
-                '8': CardRankings.EIGHT,
-                '7': CardRankings.SEVEN,
-                '6': CardRankings.SIX,
-                '5': CardRankings.FIVE,
-                '4': CardRankings.FOUR,
-                '3': CardRankings.THREE,
-                '2': CardRankings.TWO,
-                '1': CardRankings.ONE
-            }
-            return mapping[self.value]
+        return RANKINGS[self.rank]
 
 class CardRankings(IntEnum):
     ACE = 14
@@ -219,3 +501,65 @@ class CardSuits(Enum):
     SPADES = "Spades"
     HEARTS = "Hearts"
     DIAMONDS = "Diamonds"
+
+
+# Card.value to ranking, the game uses digits up to 10 but named values work too
+VALUE_RANKS = {ranking.name.capitalize(): int(ranking) for ranking in CardRankings}
+VALUE_RANKS.update({str(int(ranking)): int(ranking) for ranking in CardRankings if ranking <= CardRankings.TEN})
+KEY_RANKS = {'T': 10, 'J': 11, 'Q': 12, 'K': 13, 'A': 14}
+KEY_RANKS.update({str(rank): rank for rank in range(1, 10)})
+RANKINGS = {int(ranking): ranking for ranking in CardRankings}
+# A card's bits in HandAnalysis rank masks, aces setting both 14 and 1
+RANK_BITS = {int(ranking): 1 << ranking for ranking in CardRankings}
+RANK_BITS[CardRankings.ACE] |= 1 << CardRankings.ONE
+SUIT_IDS = {suit.value: suit_id for suit_id, suit in enumerate(CardSuits)}
+KEY_SUITS = {suit.value[0]: suit.value for suit in CardSuits}
+
+# What a card_key says about a card, shared by every card with that key
+CardFace = namedtuple('CardFace', ['card_key', 'suit', 'rank', 'suit_id', 'code'])
+CARD_FACES = {}
+
+
+def intern_card(card_key):
+    face = CARD_FACES.get(card_key)
+    if face is None:
+        # card_keys are <suit letter>_<value letter>, e.g. H_T, S_A
+        suit = KEY_SUITS[card_key[0]]
+        rank = KEY_RANKS[card_key[2:]]
+        face = CARD_FACES[card_key] = CardFace(card_key, suit, rank, SUIT_IDS[suit], rank * 4 + SUIT_IDS[suit])
+    return face
+
+
+def card_codes(cards):
+    # Card.code of every card in a list like G["hand"], as an array of bytes
+    return array('B', [intern_card(card['card_key']).code for card in cards])
+
+
+# A hand with its suits relabelled. key is the same for every hand that only
+# differs from this one by which suit is which (and where its cards are),
+# order the hand positions in key order, suits {suit: suit it's relabelled
+# as}. Something worked out on the relabelled hand at position p applies to
+# cards[order[p]].
+Canonical = namedtuple('Canonical', ['key', 'order', 'suits'])
+
+
+def canonical_form(cards, hist=None):
+    # Suits are ranked by their cards (highest first, debuffs included) and
+    # then by their row of the deck histogram (outs.histogram) if there is
+    # one, and relabelled in CardSuits order. Suits that rank the same look
+    # the same, so it doesn't matter which gets which label.
+    by_suit = {suit.value: [] for suit in CardSuits}
+    for card in cards:
+        by_suit[card.suit].append((card.rank, bool(card.debuff)))
+
+    def signature(suit):
+        return sorted(by_suit[suit], reverse=True), hist[SUIT_IDS[suit]] if hist else ()
+
+    ranked = sorted(by_suit, key=signature, reverse=True)
+    suits = {suit: canonical.value for suit, canonical in zip(ranked, CardSuits)}
+    keys = [(suits[card.suit][0] + card.card_key[1:], bool(card.debuff)) for card in cards]
+    order = sorted(range(len(cards)), key=keys.__getitem__)
+    key = tuple(keys[i] for i in order)
+    if hist:
+        key = (key, tuple(hist[SUIT_IDS[suit]] for suit in ranked))
+    return Canonical(key, order, suits)
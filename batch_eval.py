@@ -0,0 +1,228 @@
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from balatro_objects import CATEGORIES as DETECTED
+from hand_table import CATEGORIES
+from scoring import CARD_CHIPS, base_scoring
+
+# Best poker hand of many hands at once. Hands are (N, k) arrays of ranks
+# (2-14, 0 for an empty slot) and suit ids (0-3, -1 for an empty slot), as
+# scoring.play_arrays builds them. Every category present in a hand is scored
+# as base chips plus the chips of its highest scoring cards, times mult, and
+# the best of those is the hand's best play.
+#
+# classify_batch answers what Hand.get_* would instead, from Card.code
+# arrays, for going over every hand seen or every sampled draw at once.
+
+BatchResult = namedtuple("BatchResult", ["category", "score", "present"])
+Classification = namedtuple("Classification", ["category", "best", "score", "picks"])
+
+_C = {category: i for i, category in enumerate(CATEGORIES)}
+_RANKS = np.arange(15)
+
+# The Hand.get_* detectors, best first, then High Card for hands with none
+DETECTORS = DETECTED + ("high_card",)
+_D = {detector: i for i, detector in enumerate(DETECTORS)}
+_SCORED_AS = np.array([[_C[c] for c in CATEGORIES if c.lower().replace(" ", "_") == d][0] for d in DETECTORS])
+
+# Chips of the five cards of the straight topped by each rank (aces low in 5-high)
+STRAIGHT_CHIPS = np.zeros(15)
+for _top in range(5, 15):
+    STRAIGHT_CHIPS[_top] = sum(CARD_CHIPS[14 if rank == 1 else rank] for rank in range(_top - 4, _top + 1))
+
+
+def _best_run(present):
+    # Chips of the best run of 5 in (..., 15) rank presence (ace copied down
+    # to 1), 0 where there isn't one. A 5-high straight beats a 6-high one,
+    # the ace is worth 11.
+    runs = sliding_window_view(present, 5, axis=-1).all(axis=-1)[..., 1:]
+    return np.where(runs, STRAIGHT_CHIPS[5:], 0).max(axis=-1)
+
+
+def _highest(counts, at_least, exclude=None):
+    # Highest rank with at least that many cards (along the last axis), 0 if none
+    ok = counts >= at_least
+    if exclude is not None:
+        ok &= _RANKS != exclude[..., None]
+    return np.where(ok, _RANKS, 0).max(axis=-1)
+
+
+def evaluate_batch(ranks, suits, levels=None):
+    n = len(ranks)
+    rank_hot = ranks[:, :, None] == _RANKS
+    suit_hot = suits[:, :, None] == np.arange(4)
+    rank_hot[:, :, 0] = False
+    counts = rank_hot.sum(axis=1)
+    suit_counts = suit_hot.sum(axis=1)
+    # (N, 4, 15) cards of each suit and rank
+    suit_rank_counts = np.einsum("nks,nkr->nsr", suit_hot.astype(np.int16), rank_hot.astype(np.int16))
+
+    chips = CARD_CHIPS
+    card_chips = np.zeros((n, len(CATEGORIES)))
+    present = np.zeros((n, len(CATEGORIES)), dtype=bool)
+
+    def found(category, has, value):
+        present[:, _C[category]] = has
+        card_chips[:, _C[category]] = np.where(has, value, 0)
+
+    # Of a kind, over all cards and then within each suit
+    five = _highest(counts, 5)
+    four = _highest(counts, 4)
+    three = _highest(counts, 3)
+    pair = _highest(counts, 2)
+    house_pair = _highest(counts, 2, exclude=three)
+    second_pair = _highest(counts, 2, exclude=pair)
+    high = ranks.max(axis=1)
+    found("Five of a Kind", five > 0, 5 * chips[five])
+    found("Four of a Kind", four > 0, 4 * chips[four])
+    found("Full House", (three > 0) & (house_pair > 0), 3 * chips[three] + 2 * chips[house_pair])
+    found("Three of a Kind", three > 0, 3 * chips[three])
+    found("Two Pair", (pair > 0) & (second_pair > 0), 2 * chips[pair] + 2 * chips[second_pair])
+    found("Pair", pair > 0, 2 * chips[pair])
+    found("High Card", high > 0, chips[high])
+
+    suited_five = _highest(suit_rank_counts, 5)
+    found("Flush Five", (suited_five > 0).any(axis=1), (5 * chips[suited_five]).max(axis=1))
+    suited_three = _highest(suit_rank_counts, 3)
+    suited_pair = _highest(suit_rank_counts, 2, exclude=suited_three)
+    suited_house = (suited_three > 0) & (suited_pair > 0)
+    found("Flush House", suited_house.any(axis=1), np.where(suited_house, 3 * chips[suited_three] + 2 * chips[suited_pair], 0).max(axis=1))
+
+    # Straights, over all cards and then within each suit
+    rank_present = counts > 0
+    rank_present[:, 1] = rank_present[:, 14]
+    straight = _best_run(rank_present)
+    found("Straight", straight > 0, straight)
+
+    suit_rank_present = suit_rank_counts > 0
+    suit_rank_present[:, :, 1] = suit_rank_present[:, :, 14]
+    straight_flush = _best_run(suit_rank_present).max(axis=1)
+    royal = suit_rank_present[:, :, 10:15].all(axis=2).any(axis=1)
+    found("Royal Flush", royal, STRAIGHT_CHIPS[14])
+    found("Straight Flush", (straight_flush > 0) & ~royal, straight_flush)
+
+    # Flush: the five highest cards of the best suit with five or more
+    suited_chips = np.where(suit_hot, chips[ranks][:, :, None], 0)
+    top_five = -np.sort(-suited_chips, axis=1)[:, :5].sum(axis=1)
+    has_flush = suit_counts >= 5
+    found("Flush", has_flush.any(axis=1), np.where(has_flush, top_five, 0).max(axis=1))
+
+    base_chips, base_mult = base_scoring(levels)
+    scores = np.where(present, (base_chips + card_chips) * base_mult, -1)
+    category = scores.argmax(axis=1)
+    return BatchResult(category, scores[np.arange(n), category], present)
+
+
+def flush_or_better(present):
+    # (N,) whether a Flush or anything ranked above it is present
+    return present[:, : _C["Flush"] + 1].any(axis=1)
+
+
+def _first(hot):
+    # Position of the first True along axis 1, or its length if there's none
+    return np.where(hot.any(axis=1), hot.argmax(axis=1), hot.shape[1])
+
+
+def _smallest(key, member, count):
+    # Which members have one of the `count` smallest keys (keys are distinct)
+    key = np.where(member, key, np.iinfo(np.int64).max)
+    order = np.argsort(np.argsort(key, axis=1), axis=1)
+    return member & (order < count)
+
+
+def _top(mask):
+    # Top rank of the highest run of 5 in rank bitmasks (as highest_straight
+    # takes them), 0 if none
+    runs = mask & (mask >> 1) & (mask >> 2) & (mask >> 3) & (mask >> 4)
+    return np.where(runs > 0, np.frexp(runs)[1] - 1 + 4, 0)
+
+
+def _in_run(ranks, top):
+    top = top[:, None]
+    return ((ranks >= top - 4) & (ranks <= top)) | ((ranks == 14) & (top == 5))
+
+
+def classify_batch(codes, levels=None):
+    # The Hand.get_* detectors over many hands at once. codes is (N, k)
+    # Card.code (rank * 4 + suit id) in hand order, anything below 8 being an
+    # empty slot. Returns, for each hand, the best detector that fires (index
+    # into DETECTORS), the (k,) mask of the cards it picks, their base score
+    # (base chips plus card chips, times mult, at `levels`), and the picks of
+    # every detector as (N, len(DETECTORS), k). Picks are the cards
+    # Hand.get_* returns for the same cards, ties and all, so like them they
+    # can hold more than five cards (two sets of three, say). Debuffs aren't
+    # in the codes, so hands are taken as having none.
+    codes = np.asarray(codes)
+    n, k = codes.shape
+    valid = codes >= 8
+    ranks = np.where(valid, codes // 4, 0)
+    suits = np.where(valid, codes % 4, -1)
+    positions = np.arange(k)
+    picks = np.zeros((n, len(DETECTORS), k), dtype=bool)
+    fires = np.zeros((n, len(DETECTORS)), dtype=bool)
+
+    def pick(detector, has, mask):
+        fires[:, _D[detector]] = has
+        picks[:, _D[detector]] = has[:, None] & mask
+
+    counts = ((ranks[:, :, None] == _RANKS) & valid[:, :, None]).sum(axis=1)
+    suit_hot = suits[:, :, None] == np.arange(4)
+    suit_counts = suit_hot.sum(axis=1)
+    first_by_suit = _first(suit_hot)
+    # Position of the first card of each card's rank, and of its rank and suit
+    same_rank = ranks[:, :, None] == ranks[:, None, :]
+    card_first = same_rank.argmax(axis=2)
+    suit_first = (same_rank & (suits[:, :, None] == suits[:, None, :])).argmax(axis=2)
+
+    # Of a kind: every card of the most common values
+    most = counts.max(axis=1)
+    most_common = valid & (np.take_along_axis(counts, ranks, axis=1) == most[:, None])
+    threes = (counts >= 3).sum(axis=1)
+    twos = (counts >= 2).sum(axis=1)
+    pick("four_of_a_kind", most >= 4, most_common)
+    pick("three_of_a_kind", most >= 3, most_common)
+    pick("two_pair", twos >= 2, most_common)
+    pick("pair", most >= 2, most_common)
+
+    # Full house: with two sets of three, the first five cards of them, a
+    # value at a time in the order they first appear. Otherwise the set and
+    # the highest pair.
+    sets = _smallest(card_first * k + positions, most_common, 5)
+    best_pair = _highest(np.where(counts == 2, counts, 0), 2)
+    with_pair = most_common | (valid & (ranks == best_pair[:, None]))
+    pick("full_house", (threes >= 1) & (twos >= 2), np.where((threes >= 2)[:, None], sets, with_pair))
+
+    # Flush: the five highest of the most common suit, ties going to the
+    # suit seen first
+    suit = (suit_counts * (k + 1) - first_by_suit).argmax(axis=1)
+    in_suit = suits == suit[:, None]
+    pick("flush", suit_counts.max(axis=1) >= 5, _smallest((15 - ranks) * k + positions, in_suit, 5))
+
+    # Straights: the first card of each rank in the highest run, over rank
+    # bitmasks like HandAnalysis.rank_mask
+    bits = np.where(valid, 1 << ranks, 0)
+    bits |= (bits >> 14) << 1
+    top = _top(np.bitwise_or.reduce(bits, axis=1))
+    pick("straight", top > 0, valid & (card_first == positions) & _in_run(ranks, top))
+
+    # Straight flush: the highest over the suits, ties going to the suit seen
+    # first, and the first card of each rank in that suit
+    suit_tops = _top(np.bitwise_or.reduce(np.where(suit_hot, bits[:, :, None], 0), axis=1))
+    suit = (suit_tops * (k + 1) - first_by_suit).argmax(axis=1)
+    straight_top = suit_tops.max(axis=1)
+    straight_flush = (suits == suit[:, None]) & (suit_first == positions) & _in_run(ranks, straight_top)
+    pick("straight_flush", straight_top > 0, straight_flush)
+    pick("royal_flush", straight_top == 14, straight_flush)
+
+    # High card: the first of the highest cards
+    high = ranks.max(axis=1)
+    pick("high_card", np.ones(n, dtype=bool), valid & (ranks == high[:, None]) & (card_first == positions))
+
+    category = fires.argmax(axis=1)
+    best = picks[np.arange(n), category]
+    base_chips, base_mult = base_scoring(levels)
+    scored_as = _SCORED_AS[category]
+    score = (base_chips[scored_as] + (CARD_CHIPS[ranks] * best).sum(axis=1)) * base_mult[scored_as]
+    return Classification(category, best, score, picks)
@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import random
+import argparse
+import asyncio
+import threading
+
+from bot import Bot, Actions, State, FIELDS
+from async_bot import AsyncBot
+import bitser
+
+SUITS = {"Hearts": "H", "Clubs": "C", "Diamonds": "D", "Spades": "S"}
+VALUES = {
+    "2": "2",
+    "3": "3",
+    "4": "4",
+    "5": "5",
+    "6": "6",
+    "7": "7",
+    "8": "8",
+    "9": "9",
+    "10": "T",
+    "Jack": "J",
+    "Queen": "Q",
+    "King": "K",
+    "Ace": "A",
+}
+
+
+def make_card(suit, value):
+    return {
+        "label": "Base Card",
+        "cost": 1,
+        "debuff": False,
+        "name": f"{value} of {suit}",
+        "suit": suit,
+        "value": value,
+        "card_key": f"{SUITS[suit]}_{VALUES[value]}",
+        # Utils.getAbilityData() copy of a plain playing card's ability
+        "ability": {
+            "name": "Default Base",
+            "set": "Default",
+            "effect": "Base",
+            "order": 0,
+            "bonus": 0,
+            "mult": 0,
+            "h_mult": 0,
+            "h_x_mult": 0,
+            "x_mult": 1,
+            "t_mult": 0,
+            "t_chips": 0,
+            "p_dollars": 0,
+            "h_dollars": 0,
+            "perma_bonus": 0,
+            "extra_value": 0,
+            "played_this_ante": False,
+            "hands_played_at_create": 0,
+            "type": "",
+            "extra": [],
+        },
+    }
+
+
+def make_gamestate(rng, hand_size=8):
+    # Same shape as Utils.getGamestate() in src/utils.lua
+    deck = [make_card(suit, value) for suit in SUITS for value in VALUES]
+    rng.shuffle(deck)
+    hand, deck = deck[:hand_size], deck[hand_size:]
+    for card in deck:
+        # Utils.getDeckData() doesn't send cost or debuff
+        del card["cost"], card["debuff"]
+
+    return {
+        "state": State.SELECTING_HAND.value,
+        "num_hands_played": 0,
+        "num_skips": 0,
+        "round": 1,
+        "discount_percent": 0,
+        "interest_cap": 25,
+        "inflation": 0,
+        "dollars": 4,
+        "bankrupt_at": 0,
+        "deck": deck,
+        "hand": hand,
+        "jokers": [],
+        "consumables": [],
+        "ante": {"blinds": {"ondeck": "Small", "skip_tag": {}}},
+        "shop": {},
+        "tags": [],
+        "current_round": {"discards_left": 3, "hands_left": 4},
+        "pack_cards": [],
+        "waitingFor": "select_cards_from_hand",
+        "waitingForAction": True,
+    }
+
+
+class StandInServer(threading.Thread):
+    # Speaks the same UDP protocol as src/api.lua so the bot's transport can be
+    # measured without the game. After every action the "game" spends
+    # `animation` seconds not waiting for anything, then hits a new breakpoint.
+    def __init__(self, port, animation=0.05, seed=0, decisions_per_run=None, loss=0.0, chunk_losses=0):
+        super().__init__(daemon=True)
+        self.addr = ("localhost", port)
+        self.animation = animation
+        # Fraction of action datagrams that never arrive
+        self.loss = loss
+        # The first this many chunked gamestates lose their second chunk
+        self.chunk_losses = chunk_losses
+        # Go back to the menu (waiting on start_run) after this many actions
+        self.decisions_per_run = decisions_per_run
+        self.rng = random.Random(seed)
+        # Like BalatrobotAPI.epoch, when the game started
+        self.epoch = int(time.time())
+        self.seq = 1
+        self.G = make_gamestate(self.rng)
+        self.G["seq"] = self.seq
+        self.G["epoch"] = self.epoch
+        self.subscriber = None
+        self.chunk = None
+        self.encoding = "json"
+        self.fields = {}
+        self.ack = False
+        self.msgid = 0
+        self.next_decision_at = None
+        self.actions = 0
+        # (seq or None, [action, ...]) of every action or batch taken
+        self.received = []
+        self.hellos = 0
+        self.stopped = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(self.addr)
+        self.sock.settimeout(0.001)
+
+    def stop(self):
+        self.stopped.set()
+
+    def restart(self):
+        # The game crashed and was started again: decisions count from 1,
+        # and it's forgotten its subscriber
+        self.epoch += 1
+        self.seq = 1
+        self.G = make_gamestate(self.rng)
+        self.G["seq"] = self.seq
+        self.G["epoch"] = self.epoch
+        self.subscriber = None
+        self.next_decision_at = None
+
+    def notifyapiclient(self, addr):
+        # Same as Utils.getGamestate(fields), only the sections asked for
+        fields = self.fields.get(self.G["waitingFor"], self.fields.get("default"))
+        G = self.G if fields is None else {k: v for k, v in self.G.items() if k not in FIELDS or k in fields}
+
+        if self.encoding == "bitser":
+            self.sendpayload(bitser.dumps(G), addr)
+        else:
+            self.sendpayload(json.dumps(G).encode("utf-8"), addr)
+
+    def sendpayload(self, payload, addr):
+        # Same framing as BalatrobotAPI.sendpayload
+        if not self.chunk or len(payload) <= self.chunk:
+            self.sock.sendto(payload, addr)
+            return
+
+        self.msgid += 1
+        count = -(-len(payload) // self.chunk)
+        for i in range(count):
+            if i == 1 and self.chunk_losses:
+                self.chunk_losses -= 1
+                continue
+            header = f"CHUNK|{self.msgid}|{i + 1}|{count}|".encode("utf-8")
+            self.sock.sendto(header + payload[i * self.chunk : (i + 1) * self.chunk], addr)
+
+    def respond(self, response, addr):
+        self.sock.sendto(json.dumps({"response": response, "seq": self.seq, "epoch": self.epoch}).encode("utf-8"), addr)
+
+    def sendack(self, seq, addr):
+        if self.ack and seq is not None:
+            self.sock.sendto(json.dumps({"ack": int(seq)}, separators=(",", ":")).encode("utf-8"), addr)
+
+    def handle(self, data, addr):
+        seq, sep, action = data.partition(b":")
+        if not sep or not seq.isdigit():
+            seq, action = None, data
+
+        if data.startswith(b"HELLO"):
+            self.hellos += 1
+            options = data.split(b"|")[1:]
+            if b"push" in options:
+                self.subscriber = addr
+            self.chunk = None
+            self.encoding = "json"
+            self.fields = {}
+            self.ack = b"ack" in options
+            for option in options:
+                key, _, value = option.decode("utf-8").partition("=")
+                if key == "chunk":
+                    self.chunk = int(value)
+                elif key == "encoding":
+                    self.encoding = value
+                elif key == "fields" or key.startswith("fields."):
+                    self.fields[key.partition(".")[2] or "default"] = set(filter(None, value.split(",")))
+            self.notifyapiclient(addr)
+        elif self.rng.random() < self.loss:
+            pass
+        elif seq is not None and int(seq) != self.seq:
+            self.respond("Error: Stale action for decision " + seq.decode(), addr)
+        elif seq is not None and not self.G["waitingForAction"]:
+            # Duplicate of the action we've already taken for this decision
+            self.sendack(seq, addr)
+        elif self.G["waitingForAction"]:
+            self.sendack(seq, addr)
+            self.actions += 1
+            # A batch is several actions, see Utils.parsebatch
+            self.received.append((int(seq) if seq is not None else None, action.split(b";")))
+            self.G["waitingForAction"] = False
+            self.next_decision_at = time.monotonic() + self.animation
+        else:
+            self.respond("Error: Action invalid for action " + action.decode(), addr)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, addr = self.sock.recvfrom(65536)
+                self.handle(data, addr)
+            except socket.timeout:
+                pass
+
+            if self.next_decision_at is not None and time.monotonic() >= self.next_decision_at:
+                self.next_decision_at = None
+                self.seq += 1
+                self.G = make_gamestate(self.rng)
+                self.G["seq"] = self.seq
+                self.G["epoch"] = self.epoch
+                if self.decisions_per_run and self.actions % self.decisions_per_run == 0:
+                    self.G["state"] = State.MENU.value
+                    self.G["waitingFor"] = "start_run"
+                if self.subscriber is not None:
+                    self.notifyapiclient(self.subscriber)
+        self.sock.close()
+
+
+class BenchBot(Bot):
+    def __init__(self, decisions, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.remaining = decisions
+        self.cache_states = False
+        self.think = 0
+
+    def select_cards_from_hand(self):
+        if self.think:
+            time.sleep(self.think)
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.running = False
+        return [Actions.PLAY_HAND, [1]]
+
+
+def measure(push, decisions, port, animation, loss=0.0):
+    server = StandInServer(port, animation=animation, loss=loss)
+    server.start()
+
+    bot = BenchBot(decisions, deck="Blue Deck", bot_port=port, push=push)
+    start = time.perf_counter()
+    bot.run()
+    elapsed = time.perf_counter() - start
+
+    server.stop()
+    server.join()
+    return decisions / elapsed
+
+
+def measure_async(instances, decisions, port, animation, think):
+    servers = [StandInServer(port + i, animation=animation, seed=i) for i in range(instances)]
+    for server in servers:
+        server.start()
+
+    runner = AsyncBot()
+    for server in servers:
+        bot = runner.add_bot(BenchBot(decisions, deck="Blue Deck", bot_port=server.addr[1], push=True))
+        # Stand in for a slow blocking strategy, e.g. an LLM call
+        bot.think = think
+
+    start = time.perf_counter()
+    asyncio.run(runner.run())
+    elapsed = time.perf_counter() - start
+
+    for server in servers:
+        server.stop()
+        server.join()
+    return instances * decisions / elapsed
+
+
+def load_states(path):
+    # Gamestates the bots have cached while playing, or made up ones if there
+    # aren't any yet
+    states = []
+    for filename in sorted(glob.glob(os.path.join(path, "*", "*.json"))):
+        with open(filename) as f:
+            states.append(json.load(f))
+    if not states:
+        rng = random.Random(0)
+        states = [make_gamestate(rng) for _ in range(100)]
+    return states
+
+
+def measure_encodings(states, repeat=20):
+    # Encoded size and decode time of each wire encoding, summed over `states`
+    results = {}
+    for name, dumps, loads in (
+        ("json", lambda G: json.dumps(G).encode("utf-8"), json.loads),
+        ("bitser", bitser.dumps, bitser.loads),
+    ):
+        payloads = [dumps(G) for G in states]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for payload in payloads:
+                loads(payload)
+        elapsed = (time.perf_counter() - start) / repeat
+        results[name] = (sum(len(payload) for payload in payloads), elapsed)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure bot decisions per second against a stand-in server")
+    parser.add_argument("--decisions", type=int, default=50, help="Decisions to make in push mode")
+    parser.add_argument("--poll-decisions", type=int, default=5, help="Decisions to make in polling mode")
+    parser.add_argument("--animation", type=float, default=0.05, help="Seconds the stand-in game takes to reach the next decision")
+    parser.add_argument("--instances", type=int, default=4, help="Stand-in games to drive from one AsyncBot")
+    parser.add_argument("--think", type=float, default=0.1, help="Seconds each AsyncBot strategy call blocks for")
+    parser.add_argument("--port", type=int, default=12399)
+    parser.add_argument("--loss", type=float, default=0.1, help="Fraction of actions the stand-in game loses")
+    parser.add_argument("--states", default="gamestate_cache", help="Cached gamestates to compare encodings on")
+    args = parser.parse_args()
+
+    states = load_states(args.states)
+    for name, (size, elapsed) in measure_encodings(states).items():
+        print(f"{name + ':':<27}{size / len(states):.0f} bytes, {elapsed / len(states) * 1e3:.3f} ms to decode per state")
+
+    poll_rate = measure(False, args.poll_decisions, args.port, args.animation)
+    print(f"poll (HELLO + 1.5s sleep): {poll_rate:.2f} decisions/s")
+    push_rate = measure(True, args.decisions, args.port + 1, args.animation)
+    print(f"push:                      {push_rate:.2f} decisions/s")
+    lossy_rate = measure(True, args.decisions, args.port + 3, args.animation, args.loss)
+    print(f"push, {args.loss:.0%} of actions lost:  {lossy_rate:.2f} decisions/s")
+    async_rate = measure_async(args.instances, args.decisions, args.port + 2, args.animation, args.think)
+    print(f"async x{args.instances} ({args.think}s hooks): {async_rate:.2f} decisions/s")
+    sys.exit(0)
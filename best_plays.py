@@ -0,0 +1,60 @@
+import heapq
+from itertools import combinations
+from collections import namedtuple
+
+from hand_table import HAND_TABLE, BASE_SCORING
+
+# Ranks every play (1-5 cards) a hand allows by the score it would make from
+# base chips and mult plus the chips of the scoring cards. Jokers, hand
+# levels, enhancements and editions aren't taken into account.
+
+Play = namedtuple("Play", ["score", "category", "chips", "mult", "indices"])
+
+# Chips a scoring card adds, by rank
+CARD_CHIPS = {rank: min(rank, 10) for rank in range(2, 14)}
+CARD_CHIPS[14] = 11
+
+# How many cards of a play score for each category. A play with more cards
+# than this has cards that don't score, so it's no better than the same play
+# without them and is skipped.
+SCORING_CARDS = {
+    "High Card": 1,
+    "Pair": 2,
+    "Two Pair": 4,
+    "Three of a Kind": 3,
+    "Four of a Kind": 4,
+}
+
+
+def best_plays(cards, k=5, table=HAND_TABLE):
+    # The k highest scoring plays of balatro_objects.Cards, best first
+    plays = []
+    seen = set()
+    # Every card of a 2-4 card play that scores shares its rank with another
+    rank_counts = {}
+    for card in cards:
+        rank_counts[card.rank] = rank_counts.get(card.rank, 0) + 1
+    paired = [card for card in cards if rank_counts[card.rank] > 1]
+
+    for size in range(1, 6):
+        for subset in combinations(paired if 1 < size < 5 else cards, size):
+            ranks = [card.rank for card in subset]
+            flush = size == 5 and len({card.suit_id for card in subset}) == 1
+            if size == 5 and not flush and len(set(ranks)) not in (1, 2, 5):
+                # Can't be a straight, full house or five of a kind
+                continue
+
+            # Plays of the same ranks and suits score the same
+            codes = tuple(sorted(card.code for card in subset))
+            if codes in seen:
+                continue
+            seen.add(codes)
+
+            category = table.category(ranks, flush)
+            if SCORING_CARDS.get(category, 5) != size:
+                continue
+
+            chips, mult = BASE_SCORING[category]
+            chips += sum(CARD_CHIPS[card.rank] for card in subset if not card.debuff)
+            plays.append(Play(chips * mult, category, chips, mult, sorted(card.index for card in subset)))
+    return heapq.nlargest(k, plays, key=lambda play: play.score)
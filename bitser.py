@@ -0,0 +1,185 @@
+import struct
+
+# Pure-Python reader and writer for the wire format of lib/bitser.lua, which
+# the game uses when HELLO asks for encoding=bitser. Only the plain data types
+# a gamestate is made of are supported, not bitser's resources or classes.
+#
+# Every value starts with a tag byte:
+#   0-127    small int, tag - 27
+#   128-191  reference to the (tag - 128)th string or table seen so far
+#   192-223  string of tag - 192 bytes
+#   240      table: array length, array values, hash length, key/value pairs
+#   243      reference, index follows as a number
+#   244      long string, length follows as a number
+#   245      int32, 246 double, 250 int16 (little endian)
+#   247      nil, 248 false, 249 true
+
+TABLE = 0xF0
+
+_int16 = struct.Struct("<h")
+_int32 = struct.Struct("<i")
+_double = struct.Struct("<d")
+
+
+class BitserError(ValueError):
+    pass
+
+
+def isbitser(data):
+    # A gamestate is always a table, JSON always starts with "{" or "["
+    return data[:1] == bytes([TABLE])
+
+
+def loads(data):
+    value, pos = _read(bytes(data), 0, [])
+    if pos != len(data):
+        raise BitserError("{} trailing bytes after value".format(len(data) - pos))
+    return value
+
+
+def _read(data, pos, seen):
+    try:
+        tag = data[pos]
+    except IndexError:
+        raise BitserError("malformed serialized data") from None
+    pos += 1
+
+    if tag < 128:
+        return tag - 27, pos
+    if tag < 192:
+        return _ref(seen, tag - 128), pos
+    if tag < 224:
+        end = pos + tag - 192
+        return _string(data, pos, end, seen), end
+    if tag == 240:
+        # Tables with only an array part come back as lists, like json.loads
+        # would give for the same table encoded by lib/json.lua
+        table = []
+        seen.append(table)
+        length, pos = _read(data, pos, seen)
+        for _ in range(length):
+            value, pos = _read(data, pos, seen)
+            table.append(value)
+
+        length, pos = _read(data, pos, seen)
+        if length:
+            table = _promote(table, seen)
+            for _ in range(length):
+                key, pos = _read(data, pos, seen)
+                table[key], pos = _read(data, pos, seen)
+        return table, pos
+    if tag == 243:
+        ref, pos = _read(data, pos, seen)
+        return _ref(seen, ref), pos
+    if tag == 244:
+        length, pos = _read(data, pos, seen)
+        end = pos + length
+        return _string(data, pos, end, seen), end
+    if tag == 245:
+        return _int32.unpack_from(data, pos)[0], pos + 4
+    if tag == 246:
+        value = _double.unpack_from(data, pos)[0]
+        return value, pos + 8
+    if tag == 247:
+        return None, pos
+    if tag == 248:
+        return False, pos
+    if tag == 249:
+        return True, pos
+    if tag == 250:
+        return _int16.unpack_from(data, pos)[0], pos + 2
+    raise BitserError("unsupported serialized type {}".format(tag))
+
+
+def _ref(seen, ref):
+    if not 0 <= ref < len(seen):
+        raise BitserError("reference to value {} of {}".format(ref, len(seen)))
+    return seen[ref]
+
+
+def _string(data, pos, end, seen):
+    if end > len(data):
+        raise BitserError("malformed serialized data")
+    value = data[pos:end].decode("utf-8")
+    seen.append(value)
+    return value
+
+
+def _promote(table, seen):
+    # The table has a hash part after all, swap the list we handed out to
+    # `seen` for a dict keyed the way Lua had it
+    promoted = {i: value for i, value in enumerate(table, 1)}
+    for i in range(len(seen) - 1, -1, -1):
+        if seen[i] is table:
+            seen[i] = promoted
+            break
+    return promoted
+
+
+def dumps(value):
+    # Same output as bitser.dumps in Lua for plain data, up to key order
+    out = bytearray()
+    _write(value, out, {})
+    return bytes(out)
+
+
+def _write(value, out, seen):
+    if value is None:
+        out.append(247)
+    elif value is True:
+        out.append(249)
+    elif value is False:
+        out.append(248)
+    elif isinstance(value, (int, float)):
+        _write_number(value, out)
+    else:
+        key = value if isinstance(value, str) else id(value)
+        ref = seen.get(key)
+        if ref is not None:
+            if ref < 64:
+                out.append(128 + ref)
+            else:
+                out.append(243)
+                _write_number(ref, out)
+            return
+        seen[key] = len(seen)
+
+        if isinstance(value, str):
+            encoded = value.encode("utf-8")
+            if len(encoded) < 32:
+                out.append(192 + len(encoded))
+            else:
+                out.append(244)
+                _write_number(len(encoded), out)
+            out += encoded
+        elif isinstance(value, (list, tuple)):
+            out.append(TABLE)
+            _write_number(len(value), out)
+            for item in value:
+                _write(item, out, seen)
+            out.append(27)
+        elif isinstance(value, dict):
+            out.append(TABLE)
+            out.append(27)
+            _write_number(len(value), out)
+            for k, v in value.items():
+                _write(k, out, seen)
+                _write(v, out, seen)
+        else:
+            raise BitserError("cannot serialize type {}".format(type(value).__name__))
+
+
+def _write_number(value, out):
+    if (isinstance(value, int) or value.is_integer()) and -2147483648 <= value <= 2147483647:
+        value = int(value)
+        if -27 <= value <= 100:
+            out.append(value + 27)
+        elif -32768 <= value <= 32767:
+            out.append(250)
+            out += _int16.pack(value)
+        else:
+            out.append(245)
+            out += _int32.pack(value)
+    else:
+        out.append(246)
+        out += _double.pack(value)
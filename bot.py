@@ -1,11 +1,15 @@
 #!/usr/bin/python3
 
+import os
 import sys
 import json
 import socket
 import time
 from enum import Enum
 from gamestates import cache_state
+from transport import Session
+from delta import Patcher, DeltaLost
+import bitser
 import subprocess
 import random
 
@@ -60,6 +64,59 @@ class Actions(Enum):
 jsondata = {}
 
 
+class GameStalled(Exception):
+    # The game stopped sending gamestates, see Bot.idle_timeout
+    pass
+
+
+# Sections of the gamestate the game can leave out, see Utils.getGamestate
+FIELDS = (
+    "deck",
+    "hand",
+    "jokers",
+    "consumables",
+    "ante",
+    "shop",
+    "tags",
+    "current_round",
+    "pack_cards",
+)
+
+
+# Strategy hooks, named after the waitingFor they answer
+HOOKS = (
+    "skip_or_select_blind",
+    "select_cards_from_hand",
+    "select_shop_action",
+    "select_booster_action",
+    "sell_jokers",
+    "rearrange_jokers",
+    "use_or_sell_consumables",
+    "rearrange_consumables",
+    "rearrange_hand",
+    "start_run",
+)
+
+
+def uses(*fields):
+    # Declares the gamestate sections a strategy hook reads, e.g.
+    #
+    #     @uses("hand", "current_round")
+    #     def select_cards_from_hand(self): ...
+    #
+    # The game then only builds and sends those (plus the top level game data
+    # like dollars and round) when it's waiting on that hook.
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError("Unknown gamestate fields: {}".format(", ".join(sorted(unknown))))
+
+    def decorate(hook):
+        hook.fields = fields
+        return hook
+
+    return decorate
+
+
 class Bot:
     def __init__(
         self,
@@ -68,6 +125,8 @@ class Bot:
         seed: str = None,
         challenge: str = None,
         bot_port: int = 12347,
+        push: bool = False,
+        bot_host: str = "localhost",
     ):
         self.G = None
         self.deck = deck
@@ -75,16 +134,49 @@ class Bot:
         self.seed = seed
         self.challenge = challenge
 
+        self.bot_host = bot_host
         self.bot_port = bot_port
 
-        self.addr = ("localhost", self.bot_port)
+        self.addr = (self.bot_host, self.bot_port)
+        # Have the game push each new decision to us instead of polling for it
+        self.push = push
+        # Ask the game to split gamestates bigger than this into chunks
+        self.chunk_size = 8192
+        # "bitser" or "json", states come back as JSON if the mod can't do bitser
+        self.encoding = "bitser"
+        # In push mode, only have the game send what changed since the last state
+        self.delta = True
+        self.patcher = Patcher()
+        self.cache_states = True
+        # Stop once this many runs have been played, None to keep going forever
+        self.max_runs = None
+        # Give up with a GameStalled after this many seconds without a
+        # gamestate, None to wait forever
+        self.idle_timeout = None
+        self.last_state = None
         self.running = False
         self.balatro_instance = None
 
-        self.sock = None
+        self.session = None
+
+        # waitingFor -> gamestate sections its hook needs, for hooks that
+        # aren't decorated with @uses. Hooks with neither get everything.
+        self.fields = {"start_run": ()}
+
+        # The game's responses turning down our actions for the current
+        # decision. When there's one, the hooks are being asked to decide again
+        # right away and shouldn't make the same choice.
+        self.rejections = []
+        self.max_rejections = 3
 
         self.state = {}
 
+        # Per-run outcome, read by the orchestrator
+        self.runs_started = 0
+        self.decisions = 0
+        self.ante_reached = 0
+        self.rounds = 0
+
         self.prioritization_config = {
             # joker pirorities
             "flush_priority_jokers": [],
@@ -190,19 +282,29 @@ class Bot:
 
     def start_balatro_instance(self):
         balatro_exec_path = r"/Users/rhyswalsh/Library/Application Support/Steam/steamapps/common/Balatro/Balatro.app"
+        # The game binary itself rather than /usr/bin/open, which exits as soon
+        # as the app is up. That way balatro_instance is the game, and killing
+        # it stops the game and frees its port. Each call starts another
+        # instance, listening on its own port.
         self.balatro_instance = subprocess.Popen(
-            ["/usr/bin/open", balatro_exec_path, "12347"]
+            [os.path.join(balatro_exec_path, "Contents", "MacOS", "love"), str(self.bot_port)]
         )
 
     def stop_balatro_instance(self):
         if self.balatro_instance:
             self.balatro_instance.kill()
+            # Don't return until it's gone, a new game may want the port
+            self.balatro_instance.wait()
+            self.balatro_instance = None
 
     def sendcmd(self, cmd, **kwargs):
-        msg = bytes(cmd, "utf-8")
-        self.sock.sendto(msg, self.addr)
+        self.session.send(cmd)
 
     def actionToCmd(self, action):
+        if action and isinstance(action[0], (list, tuple)):
+            # A batch of actions for the game to run back to back, see Utils.parsebatch
+            return ";".join(self.actionToCmd(step) for step in action)
+
         result = []
 
         for x in action:
@@ -217,6 +319,30 @@ class Bot:
 
         return "|".join(result)
 
+    def hellocmd(self):
+        options = ["HELLO"]
+        if self.push:
+            options.append("push")
+            if self.delta:
+                options.append("delta")
+        if self.chunk_size:
+            options.append("chunk={}".format(self.chunk_size))
+        # Have the game acknowledge every action so lost ones are sent again
+        options.append("ack")
+        if self.encoding != "json":
+            options.append("encoding={}".format(self.encoding))
+        for hook, fields in self.hookfields().items():
+            options.append("fields.{}={}".format(hook, ",".join(fields)))
+        return "|".join(options)
+
+    def hookfields(self):
+        hookfields = {}
+        for hook in HOOKS:
+            fields = self.fields.get(hook, getattr(getattr(self, hook, None), "fields", None))
+            if fields is not None:
+                hookfields[hook] = fields
+        return hookfields
+
     def verifyimplemented(self):
         try:
             self.skip_or_select_blind(self, {})
@@ -239,11 +365,12 @@ class Bot:
         return "".join(random.choices("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=7))
 
     def chooseaction(self):
-        if self.G["state"] == State.GAME_OVER:
+        if self.G["state"] == State.GAME_OVER.value:
             self.running = False
 
         match self.G["waitingFor"]:
             case "start_run":
+                self.runs_started += 1
                 seed = self.seed
                 if seed is None:
                     seed = self.random_seed()
@@ -265,30 +392,119 @@ class Bot:
             case "use_or_sell_consumables":
                 return self.use_or_sell_consumables()
 
+    def updatestate(self, data):
+        # Returns True when the game is waiting on us to choose an action
+        jsondata = bitser.loads(data) if bitser.isbitser(data) else json.loads(data)
+        if "response" in jsondata:
+            print(jsondata["response"])
+            if self.session and self.session.rejected(jsondata) and self.G is not None:
+                # The game is still waiting on the decision we just got wrong
+                self.rejections.append(jsondata["response"])
+                return len(self.rejections) <= self.max_rejections
+            return False
+
+        # Patched even if we don't act on it, the next delta builds on it
+        jsondata = self.patcher.apply(jsondata)
+        if jsondata is None:
+            return False
+
+        if self.session and not self.session.isfresh(jsondata):
+            # We've already acted on this decision
+            return False
+        # Only a new decision means the game's getting anywhere
+        self.last_state = time.monotonic()
+
+        if self.G is None or jsondata.get("seq") != self.G.get("seq"):
+            self.rejections = []
+        self.G = jsondata
+        self.ante_reached = max(self.ante_reached, self.G.get("ante", {}).get("ante") or 0)
+        self.rounds = max(self.rounds, self.G.get("round") or 0)
+        if not self.G["waitingForAction"]:
+            return False
+
+        if (
+            self.G["waitingFor"] == "start_run"
+            and self.max_runs is not None
+            and self.runs_started >= self.max_runs
+        ):
+            # Back at the menu after our last run
+            self.running = False
+            return False
+
+        if self.cache_states:
+            cache_state(self.G["waitingFor"], self.G)
+        return True
+
+    def handlestate(self, data):
+        if not self.updatestate(data):
+            return None
+
+        action = self.chooseaction()
+        if action == None:
+            raise ValueError("All actions must return a value!")
+
+        self.decisions += 1
+        return self.actionToCmd(action)
+
+    def checkidle(self):
+        # The game has crashed or hung if it's gone quiet for this long
+        if self.idle_timeout is not None and time.monotonic() - self.last_state > self.idle_timeout:
+            raise GameStalled("No gamestate from {}:{} in {}s".format(self.bot_host, self.bot_port, self.idle_timeout))
+
     def run(self):
-        while True:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.settimeout(5)
-                msg = bytes("HELLO", "utf-8")
-                s.sendto(msg, self.addr)
+        self.last_state = time.monotonic()
+        if self.push:
+            return self.run_push()
+
+        self.running = True
+        with Session(self.addr) as self.session:
+            while self.running:
+                self.sendcmd(self.hellocmd())
                 try:
-                    data, _ = s.recvfrom(65536)
-                    jsondata = json.loads(data)
-                    if "response" in jsondata:
-                        print(jsondata["response"])
-                    else:
-                        self.G = jsondata
-                        if self.G["waitingForAction"]:
-                            cache_state(self.G["waitingFor"], self.G)
-                            action = self.chooseaction()
-                            if action == None:
-                                raise ValueError("All actions must return a value!")
-
-                            cmdstr = self.actionToCmd(action)
-                            msg = bytes(cmdstr, "utf-8")
-                            s.sendto(msg, self.addr)
-                            time.sleep(1.5)
+                    cmdstr = self.handlestate(self.session.recv())
+                    if cmdstr is not None:
+                        self.session.send_action(cmdstr)
+                        time.sleep(1.5)
+                except socket.timeout:
+                    # Our action may have been lost, let the next copy of this decision through
+                    self.session.expire()
+                    self.checkidle()
                 except socket.error as e:
                     print(e)
                     print("Socket error, reconnecting...")
-                    s.close()
+                    time.sleep(1)
+                    self.checkidle()
+        self.session = None
+
+    def run_push(self):
+        # The game sends us every new decision as soon as its breakpoint fires,
+        # so we only block on the socket instead of polling and sleeping.
+        self.running = True
+        with Session(self.addr) as self.session:
+            self.sendcmd(self.hellocmd())
+            while self.running:
+                try:
+                    data = self.session.recv()
+                except socket.timeout:
+                    # Nothing pushed, the game may have restarted and forgotten
+                    # us, our last action was lost, or a chunk of the state was
+                    self.session.expire()
+                    self.checkidle()
+                    self.sendcmd(self.hellocmd())
+                    continue
+                except socket.error as e:
+                    print(e)
+                    print("Socket error, resubscribing...")
+                    time.sleep(1)
+                    self.checkidle()
+                    self.sendcmd(self.hellocmd())
+                    continue
+
+                try:
+                    cmdstr = self.handlestate(data)
+                except DeltaLost:
+                    self.sendcmd(self.hellocmd())
+                    continue
+                if cmdstr is not None:
+                    self.session.send_action(cmdstr)
+        self.session = None
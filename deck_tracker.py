@@ -0,0 +1,107 @@
+import numpy as np
+
+from balatro_objects import intern_card
+
+# Keeps count of what's left in the deck (G["deck"], the draw pile) from one
+# decision to the next, instead of walking the whole list every time.
+#
+# Between two gamestates the only way a card leaves the deck is by being
+# drawn into the hand, so the cards in the new hand that weren't in the old
+# one are taken off the counts. If that doesn't add up - the deck is a
+# different size than the counts say, or a card we didn't have turns up -
+# something else happened (a new round, a spectral card, ...) and the counts
+# are rebuilt from G["deck"].
+
+
+def identity(card):
+    # Cards that are the same as far as drawing them goes
+    return card["card_key"], card.get("ability", {}).get("name")
+
+
+def multiset(cards):
+    counts = {}
+    for card in cards:
+        key = identity(card)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class DeckTracker:
+    def __init__(self):
+        self.deck = None
+        self.hand = None
+        self.cards = {}
+        self.counts = [[0] * 13 for _ in range(4)]
+        self.enhancements = {}
+        self.size = 0
+        self.updates = 0
+        self.resyncs = 0
+        self._histogram = None
+        self._arrays = None
+
+    def update(self, G):
+        deck = G.get("deck")
+        hand = G.get("hand") or []
+        if deck is None:
+            return
+        if deck is self.deck:
+            # delta.Patcher hands back the same list when the deck didn't change
+            self.hand = hand
+            return
+
+        if self.deck is not None and self._draw(hand) and self.size == len(deck):
+            self.updates += 1
+        else:
+            self.resync(deck)
+        self.deck = deck
+        self.hand = hand
+
+    def resync(self, deck):
+        self.resyncs += 1
+        self.cards = {}
+        self.counts = [[0] * 13 for _ in range(4)]
+        self.enhancements = {}
+        self.size = 0
+        self._add(multiset(deck), 1)
+
+    def _draw(self, hand):
+        # Take the newly drawn cards off, if we have them all
+        drawn = multiset(hand)
+        for key, count in multiset(self.hand).items():
+            if drawn.get(key, 0) <= count:
+                drawn.pop(key, None)
+            else:
+                drawn[key] -= count
+        if any(self.cards.get(key, 0) < count for key, count in drawn.items()):
+            return False
+        self._add(drawn, -1)
+        return True
+
+    def _add(self, cards, sign):
+        if cards:
+            self._histogram = None
+            self._arrays = None
+        for (card_key, enhancement), count in cards.items():
+            self.cards[(card_key, enhancement)] = self.cards.get((card_key, enhancement), 0) + sign * count
+            face = intern_card(card_key)
+            self.counts[face.suit_id][face.rank - 2] += sign * count
+            self.enhancements[enhancement] = self.enhancements.get(enhancement, 0) + sign * count
+            self.size += sign * count
+
+    def histogram(self):
+        # Same shape as outs.histogram, rebuilt only after the counts change
+        if self._histogram is None:
+            self._histogram = tuple(tuple(suit) for suit in self.counts)
+        return self._histogram
+
+    def arrays(self):
+        # Ranks and suit ids of every card, like discards.deck_arrays
+        if self._arrays is None:
+            counts = np.array(self.counts)
+            suits, ranks = np.nonzero(counts)
+            repeats = counts[suits, ranks]
+            self._arrays = (
+                np.repeat(ranks + 2, repeats).astype(np.int16),
+                np.repeat(suits, repeats).astype(np.int8),
+            )
+        return self._arrays
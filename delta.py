@@ -0,0 +1,66 @@
+class DeltaLost(Exception):
+    # A delta arrived for a state we never got (a datagram went missing), so
+    # the only way back is a fresh keyframe from HELLO
+    pass
+
+
+def patch(old, node):
+    # Applies one Utils.diff node (src/utils.lua) to old and returns the new
+    # value. Only the parts that changed are copied, everything else is shared
+    # with old.
+    match node["~"]:
+        case "o":
+            new = dict(old)
+            for key in node.get("del", []):
+                new.pop(key, None)
+            for key, child in node.get("patch", {}).items():
+                new[key] = patch(new[key], child)
+            new.update(node.get("set", {}))
+            return new
+        case "l":
+            new = old[: node["n"]]
+            new.extend([None] * (node["n"] - len(new)))
+            return patch_entries(new, node)
+        case "k":
+            keys = node.get("keys") or [entry["card_key"] for entry in old[: node.get("n", len(old))]]
+            # Match entries up by card_key the same way Utils.diffkeyed does
+            pool = {}
+            for entry in reversed(old):
+                pool.setdefault(entry["card_key"], []).append(entry)
+            new = [pool[key].pop() if pool.get(key) else None for key in keys]
+            return patch_entries(new, node)
+    raise ValueError("Unknown delta node {!r}".format(node["~"]))
+
+
+def patch_entries(new, node):
+    # new holds the old entry for every position, or None for new ones
+    for position, child in node.get("patch", {}).items():
+        i = int(position) - 1
+        new[i] = patch(new[i], child)
+    for position, value in node.get("set", {}).items():
+        new[int(position) - 1] = value
+    return new
+
+
+class Patcher:
+    # Rebuilds the full G from a keyframe followed by
+    # {"base": frame, "frame": frame, "delta": node} messages
+    def __init__(self):
+        self.G = None
+
+    def apply(self, jsondata):
+        # Returns the full gamestate, or None for a delta we've already applied
+        if "base" not in jsondata:
+            # Keyframe, or the game isn't sending deltas
+            self.G = jsondata if "frame" in jsondata else None
+            return jsondata
+
+        frame = self.G.get("frame") if self.G else None
+        if frame is not None and jsondata["frame"] <= frame:
+            return None
+        if frame != jsondata["base"]:
+            self.G = None
+            raise DeltaLost("Missing state {} to apply delta {} to".format(jsondata["base"], jsondata["frame"]))
+
+        self.G = patch(self.G, jsondata["delta"]) if jsondata.get("delta") else dict(self.G, frame=jsondata["frame"])
+        return self.G
@@ -0,0 +1,95 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from balatro_objects import intern_card
+from batch_eval import evaluate_batch, flush_or_better
+
+# Monte Carlo estimate of what a discard is worth, drawing the replacements
+# from what's left of the deck (G["deck"]). The policy simulated is: discard
+# the candidate cards, and if the hand still has nothing at Flush or better
+# and there are discards left, throw the newly drawn cards away again and
+# draw fresh ones, keeping the rest. The hand played is the one you end up
+# with.
+
+DiscardEstimate = namedtuple("DiscardEstimate", ["discard", "p_flush_or_better", "expected_score", "samples"])
+
+
+def deck_arrays(deck):
+    # Ranks and suit ids of G["deck"]
+    faces = [intern_card(card["card_key"]) for card in deck]
+    return (
+        np.array([face.rank for face in faces], dtype=np.int16),
+        np.array([face.suit_id for face in faces], dtype=np.int8),
+    )
+
+
+def evaluate_discards(
+    hand,
+    deck,
+    candidates,
+    discards_left=1,
+    levels=None,
+    samples=2000,
+    time_cap=0.05,
+    batch=256,
+    rng=None,
+):
+    # hand: balatro_objects.Cards, deck: (ranks, suit ids) from deck_arrays
+    # or DeckTracker.arrays(), candidates: lists of Card.index to discard.
+    # Samples are split evenly between the candidates and drawn `batch` at a
+    # time until there are `samples` per candidate or `time_cap` seconds have
+    # passed, whichever is first.
+    rng = rng or np.random.default_rng()
+    deck_ranks, deck_suits = deck
+    deadline = time.monotonic() + time_cap
+
+    setups = []
+    for discard in candidates:
+        kept = [card for card in hand if card.index not in discard]
+        setups.append(
+            (
+                discard,
+                np.array([card.rank for card in kept], dtype=np.int16),
+                np.array([card.suit_id for card in kept], dtype=np.int8),
+                min(len(hand) - len(kept), len(deck_ranks)),
+            )
+        )
+
+    hits = np.zeros(len(setups))
+    totals = np.zeros(len(setups))
+    done = np.zeros(len(setups), dtype=int)
+    while done.min() < samples and (not done.any() or time.monotonic() < deadline):
+        for i, (discard, kept_ranks, kept_suits, draws) in enumerate(setups):
+            n = min(batch, samples - done[i])
+            if n <= 0:
+                continue
+            hit, score = _simulate(kept_ranks, kept_suits, draws, deck_ranks, deck_suits, discards_left, n, levels, rng)
+            hits[i] += hit.sum()
+            totals[i] += score.sum()
+            done[i] += n
+
+    return [
+        DiscardEstimate(discard, hits[i] / done[i], totals[i] / done[i], int(done[i]))
+        for i, (discard, *_) in enumerate(setups)
+    ]
+
+
+def _simulate(kept_ranks, kept_suits, draws, deck_ranks, deck_suits, discards_left, n, levels, rng):
+    # n runs of the policy, returning whether each ended at Flush or better
+    # and the score of the best play it ended with
+    attempts = max(1, min(discards_left, len(deck_ranks) // draws if draws else 1))
+    order = np.argsort(rng.random((n, len(deck_ranks))), axis=1)[:, : attempts * draws]
+
+    hit = np.zeros(n, dtype=bool)
+    score = np.zeros(n)
+    for attempt in range(attempts):
+        drawn = order[:, attempt * draws : (attempt + 1) * draws]
+        ranks = np.concatenate([np.broadcast_to(kept_ranks, (n, len(kept_ranks))), deck_ranks[drawn]], axis=1)
+        suits = np.concatenate([np.broadcast_to(kept_suits, (n, len(kept_suits))), deck_suits[drawn]], axis=1)
+        result = evaluate_batch(ranks, suits, levels)
+        # Runs that already hit stopped discarding, so keep what they had
+        score = np.where(hit, score, result.score)
+        hit |= flush_or_better(result.present)
+    return hit, score
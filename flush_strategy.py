@@ -1,11 +1,20 @@
 import time
 import argparse
+from collections import deque
 
 from utils import delete_game_cache
-from bot import Bot, Actions
-from balatro_objects import Hand, Card
-
-
+from bot import Bot, Actions, uses
+from balatro_objects import Hand, Card, CardSuits
+from best_plays import best_plays
+from discards import evaluate_discards
+from outs import after_discard
+from deck_tracker import DeckTracker
+from joker_order import OrderSearch
+from tarot_targets import best_tarot
+from suit_canonical import state_key, positions, indices
+
+
+@uses("ante")
 def skip_or_select_blind(self, G):
     if (
         G["ante"]["blinds"]["ondeck"] == "Small"
@@ -16,6 +25,7 @@ def skip_or_select_blind(self, G):
         return [Actions.SELECT_BLIND]
 
 
+@uses("hand", "current_round", "deck", "jokers", "ante")
 def select_cards_from_hand(self, G):
     # G["hand"] is a list of cards in the hand
 
@@ -39,36 +49,26 @@ def select_cards_from_hand(self, G):
     if "hands_played" not in self.state:
         self.state["hands_played"] = 0
 
-    cards = []
-    for index, card in enumerate(G["hand"]):
-        cards.append(
-            Card(
-                suit=card['suit'],
-                label=card['label'],
-                value=card['value'],
-                name=card['name'],
-                debuff=card['debuff'],
-                card_key=card['card_key'],
-                index=index + 1
-            )
-        )
-    hand = Hand(
-        cards=cards
-    )
+    hand = current_hand(self, G)
 
     # Is there a flush or better we can play here?
+    # Seen this hand before (a rejected action, a re-poll)? Then classify()
+    # has the answer cached, otherwise every detector runs once here
+    hands = hand.classify()
     play_hand = (
-        hand.get_royal_flush() if hand.get_royal_flush() else
-        hand.get_straight_flush() if hand.get_straight_flush() else
-        hand.get_four_of_a_kind() if hand.get_four_of_a_kind() else
-        hand.get_full_house() if hand.get_full_house() else
-        hand.get_flush() if hand.get_flush() else
+        hands["royal_flush"] or
+        hands["straight_flush"] or
+        hands["four_of_a_kind"] or
+        hands["full_house"] or
+        hands["flush"] or
         None
     )
 
     if play_hand:
         # We can play a flush or better hand!
         self.state["hands_played"] += 1
+        remember_play(self, hand, play_hand)
+        self.state["leaving"] = play_hand
         print("Going to play hand: {}".format(play_hand))
         return [
             Actions.PLAY_HAND,
@@ -84,12 +84,29 @@ def select_cards_from_hand(self, G):
         least_common_suit = min(suit_count, key=suit_count.get)
         suit_count.pop(least_common_suit)
         # always attach lower valued cards first for discard
-        for card in sorted(hand.cards, key=lambda card: card.get_card_ranking()):
+        for card in hand.analysis.ascending:
             if card.suit == least_common_suit and len(discard_hand) < 5:
                 discard_hand.append(card.index)
     # If we have discards, let's go with this strategy.
     if G["current_round"]["discards_left"] > 0:
+        if G.get("deck"):
+            tracker = self.state.setdefault("deck_tracker", DeckTracker())
+            tracker.update(G)
+            # Been here before, maybe with the suits swapped around?
+            choices = self.state.setdefault("discard_choices", {})
+            key, canonical = state_key(G, hand.cards, tracker.histogram(), G["current_round"]["discards_left"])
+            if key in choices:
+                chance, picked = choices[key]
+                discard_hand = indices(canonical, hand.cards, picked)
+            else:
+                chance, discard_hand = choose_discard(hand, tracker, discard_hand, G["current_round"]["discards_left"])
+                at = positions(canonical, hand.cards)
+                choices[key] = (chance, [at[index] for index in discard_hand])
+                if len(choices) > 4096:
+                    choices.pop(next(iter(choices)))
+            print("Chance of a flush after discarding: {:.0%}".format(chance))
         print("Going to discard hand: {}".format(discard_hand))
+        self.state["leaving"] = discard_hand
         return [
             Actions.DISCARD_HAND,
             discard_hand
@@ -98,17 +115,15 @@ def select_cards_from_hand(self, G):
     # We've really screwed the pooch here.
     # We don't have a valid flush to play, but we don't have any discards left either.
     # What other basic hands could we play?
-    play_hand = (
-        hand.get_straight() if hand.get_straight() else
-        hand.get_three_of_a_kind() if hand.get_three_of_a_kind() else
-        hand.get_two_pair() if hand.get_two_pair() else
-        hand.get_pair() if hand.get_pair() else
-        []
-    )
+    # Whatever scores best, rather than the first detector that fires
+    best = best_plays(hand.cards, k=1)
+    play_hand = best[0].indices if best else []
 
     # We're going to be playing a hand now whether we like it or not.
 
     self.state["hands_played"] += 1
+    remember_play(self, hand, play_hand)
+    self.state["leaving"] = play_hand or discard_hand
     if play_hand and len(play_hand) < 5:
         # We've found an alternative hand to play
         # but we should discard some cards with it
@@ -128,12 +143,79 @@ def select_cards_from_hand(self, G):
         return [Actions.PLAY_HAND, discard_hand]
 
 
+def choose_discard(hand, tracker, discard_hand, discards_left):
+    # Weigh the discard against chasing each of the other suits instead,
+    # with what we'd actually draw from the deck
+    candidates = [discard_hand]
+    for suit in CardSuits:
+        candidate = [card.index for card in hand.analysis.ascending if card.suit != suit.value][:5]
+        if candidate and candidate not in candidates:
+            candidates.append(candidate)
+    if discards_left == 1:
+        # One draw left, the odds of the flush are exact and cheap
+        chances = [(after_discard(hand.cards, tracker.histogram(), candidate).flush, candidate) for candidate in candidates]
+        return max(chances, key=lambda chance: chance[0])
+    estimates = evaluate_discards(hand.cards, tracker.arrays(), candidates, discards_left)
+    best_discard = max(estimates, key=lambda estimate: (estimate.p_flush_or_better, estimate.expected_score))
+    return best_discard.p_flush_or_better, best_discard.discard
+
+
+def current_hand(self, G):
+    # The Hand for G["hand"]. When it's the last one less the cards we played
+    # or discarded, with the new ones dealt on the end, that one is carried
+    # over instead of being analysed from scratch.
+    previous, leaving = self.state.get("hand"), self.state.pop("leaving", None)
+    if previous is not None and leaving:
+        kept = [card for card in previous.cards if card.index not in leaving]
+        same = [(card.card_key, card.label, card.debuff) for card in kept]
+        if same == [(card["card_key"], card["label"], card["debuff"]) for card in G["hand"][: len(kept)]]:
+            removed = [card for card in previous.cards if card.index in leaving]
+            added = [Card.from_dict(card, index + 1) for index, card in enumerate(G["hand"]) if index >= len(kept)]
+            hand = previous.update(removed, added)
+            for index, card in enumerate(hand.cards):
+                card.index = index + 1
+            return hand
+
+    hand = self.state["hand"] = Hand(
+        cards=[Card.from_dict(card, index + 1) for index, card in enumerate(G["hand"])]
+    )
+    return hand
+
+
+def remember_play(self, hand, indices):
+    # The last few hands we played, what rearrange_jokers optimizes for
+    plays = self.state.setdefault("plays", deque(maxlen=20))
+    if indices:
+        plays.append([card for card in hand.cards if card.index in indices])
+
+
+@uses("shop", "jokers")
 def select_shop_action(self, G):
     if "num_shops" not in self.state:
         self.state["num_shops"] = 0
 
     self.state["num_shops"] += 1
 
+    # Plan the whole visit up front and send it as one batch. Buying things
+    # doesn't change what's on offer, so we can keep deciding on a copy of the
+    # shop with what we bought taken out, until we reroll or leave.
+    G = dict(G, shop=dict(G["shop"]), jokers=list(G["jokers"]))
+    batch = []
+    while True:
+        action = next_shop_action(self, G)
+        batch.append(action)
+        if action[0] not in (Actions.BUY_CARD, Actions.BUY_VOUCHER):
+            return batch
+
+        key = "cards" if action[0] == Actions.BUY_CARD else "vouchers"
+        G["shop"][key] = list(G["shop"][key])
+        bought = G["shop"][key].pop(action[1][0] - 1)
+        G["dollars"] -= bought["cost"]
+        if bought["ability"]["set"] == "Joker":
+            G["jokers"].append(bought)
+
+
+def next_shop_action(self, G):
     # Shop prioritization order:
     # 1 - Jokers
     # 2 - Boosters
@@ -224,6 +306,7 @@ def select_shop_action(self, G):
     return [Actions.END_SHOP]
 
 
+@uses("pack_cards", "jokers", "hand", "deck")
 def select_booster_action(self, G):
 
     if G['pack_cards'][0]['ability']['set'] == "Planet":
@@ -244,6 +327,14 @@ def select_booster_action(self, G):
             if tarot_card['label'] in self.prioritization_config['priority_tarot_cards']:
                 print("Choosing to select a priority tarot card!")
                 maybe_indexes.append(index+1)
+        if not maybe_indexes and G.get("hand"):
+            # Otherwise whichever tarot does the most for our flush odds,
+            # used on the cards it does the most with
+            choice = best_tarot(G["pack_cards"], G["hand"], G.get("deck") or [])
+            if choice:
+                print("Choosing to use {} on hand cards {} for a {:.0%} chance of a flush!".format(
+                    G["pack_cards"][choice.pack_index]["label"], [target + 1 for target in choice.targets], choice.p_flush))
+                return [Actions.SELECT_BOOSTER_CARD, [choice.pack_index + 1], [target + 1 for target in choice.targets]]
         for index, tarot_card in enumerate(G['pack_cards']):
             if tarot_card['ability'].get('max_highlighted') is None and (tarot_card['label'] == "The Fool" and len(tarot_card['ability']['consumeable']) > 1):
                 print("Choosing to select tarot that doesn't need to select cards in the deck - {} at position {}!".format(tarot_card['label'], index+1))
@@ -296,6 +387,7 @@ def select_booster_action(self, G):
     return [Actions.SKIP_BOOSTER_PACK]
 
 
+@uses("jokers")
 def sell_jokers(self, G):
     # Until I can work out how to trigger this while in the shop, its not worth using.
     # We shouldn't sell jokers at the beginning of choosing a hand.
@@ -309,14 +401,25 @@ def sell_jokers(self, G):
     return [Actions.SELL_JOKER, []]
 
 
+@uses("jokers")
 def rearrange_jokers(self, G):
     # what is the preferred order?
     # 1 - additional chips
     # 2 - additional multi (quantity)
     # 3 - additional multi (multiplier)
-    return [Actions.REARRANGE_JOKERS, []]
+    # Worked out by trying the orders against the hands we've been playing
+    plays = self.state.get("plays")
+    if not plays or len(G["jokers"]) < 2:
+        return [Actions.REARRANGE_JOKERS, []]
 
+    order, score = OrderSearch(list(plays)).best_order([joker["label"] for joker in G["jokers"]])
+    if order == sorted(order):
+        return [Actions.REARRANGE_JOKERS, []]
+    print("Rearranging jokers to {} for an average score of {}".format(order, score))
+    return [Actions.REARRANGE_JOKERS, [position + 1 for position in order]]
 
+
+@uses("consumables")
 def use_or_sell_consumables(self, G):
     for index, card in enumerate(G['consumables']):
         if card['ability'].get('max_highlighted') is None:
@@ -327,14 +430,38 @@ def use_or_sell_consumables(self, G):
     return [Actions.SELL_CONSUMABLE, []]
 
 
+@uses("consumables")
 def rearrange_consumables(self, G):
     return [Actions.REARRANGE_CONSUMABLES, []]
 
 
+@uses("hand")
 def rearrange_hand(self, G):
     return [Actions.REARRANGE_HAND, []]
 
 
+STRATEGY = {
+    "skip_or_select_blind": skip_or_select_blind,
+    "select_cards_from_hand": select_cards_from_hand,
+    "select_shop_action": select_shop_action,
+    "select_booster_action": select_booster_action,
+    "sell_jokers": sell_jokers,
+    "rearrange_jokers": rearrange_jokers,
+    "use_or_sell_consumables": use_or_sell_consumables,
+    "rearrange_consumables": rearrange_consumables,
+    "rearrange_hand": rearrange_hand,
+}
+
+
+def make_bot(**kwargs):
+    bot = Bot(**kwargs)
+    # Bot.chooseaction calls the hooks without arguments, so hand each one the bot and its current state
+    for name, hook in STRATEGY.items():
+        setattr(bot, name, lambda hook=hook: hook(bot, bot.G))
+        bot.fields[name] = hook.fields
+    return bot
+
+
 if __name__ == "__main__":
     # do we want to delete all our gamestate_cache files and start with a fresh state?
     parser = argparse.ArgumentParser(description="Game cache management script")
@@ -345,7 +472,7 @@ if __name__ == "__main__":
         delete_game_cache()
 
     # creating balatro bot
-    mybot = Bot(
+    mybot = make_bot(
         deck="Blue Deck",
         stake=1,
         seed=None,
@@ -353,18 +480,7 @@ if __name__ == "__main__":
         bot_port=12347
     )
 
-    mybot.skip_or_select_blind = skip_or_select_blind
-    mybot.select_cards_from_hand = select_cards_from_hand
-    mybot.select_shop_action = select_shop_action
-    mybot.select_booster_action = select_booster_action
-    mybot.sell_jokers = sell_jokers
-    mybot.rearrange_jokers = rearrange_jokers
-    mybot.use_or_sell_consumables = use_or_sell_consumables
-    mybot.rearrange_consumables = rearrange_consumables
-    mybot.rearrange_hand = rearrange_hand
-
     # mybot.start_balatro_instance()
     time.sleep(5)
 
-    mybot.run_step()
     mybot.run()
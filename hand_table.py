@@ -0,0 +1,188 @@
+import os
+import re
+import mmap
+import tempfile
+from math import comb
+
+from jokers import poker_hand_scoring, secret_hand_scoring
+
+# Lookup table from (ranks played, all one suit) to poker hand, for classifying
+# plays far faster than building a Hand and running its detectors.
+#
+# A play of k cards is a multiset of ranks, which the combinatorial number
+# system numbers 0 .. comb(13 + k - 1, k) - 1 with no gaps: sort the ranks
+# (0-12), add i to the ith one to make them strictly increasing, and sum
+# comb(c_i, i + 1). Plays of 1..5 cards are laid out one size after another,
+# then the whole thing again for flushes, one byte (the category) per entry.
+
+# Categories, best first, as named in jokers.poker_hand_scoring and
+# jokers.secret_hand_scoring
+CATEGORIES = (
+    "Flush Five",
+    "Flush House",
+    "Five of a Kind",
+    "Royal Flush",
+    "Straight Flush",
+    "Four of a Kind",
+    "Full House",
+    "Flush",
+    "Straight",
+    "Three of a Kind",
+    "Two Pair",
+    "Pair",
+    "High Card",
+)
+
+MAX_CARDS = 5
+RANKS = 13
+# First entry for each play size, and the number of entries without the flush flag
+OFFSETS = {}
+SIZE = 0
+for k in range(1, MAX_CARDS + 1):
+    OFFSETS[k] = SIZE
+    SIZE += comb(RANKS + k - 1, k)
+
+MAGIC = b"BALHANDS1"
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "balatrobot_hand_table.bin")
+
+# comb(c, i) for every c and i the index needs
+_COMB = [[comb(c, i) for i in range(MAX_CARDS + 1)] for c in range(RANKS + MAX_CARDS)]
+
+
+def parse_scoring(table):
+    # {"Pair": (10, 2), ...} out of a markdown table like poker_hand_scoring
+    scoring = {}
+    for line in table.splitlines():
+        match = re.match(r"\|\s*\*\*(\d+) Chips × (\d+) Mult\*\*\s*\|\s*([^|]+?)\s*\|", line)
+        if match:
+            scoring[match[3]] = (int(match[1]), int(match[2]))
+    return scoring
+
+
+BASE_SCORING = parse_scoring(poker_hand_scoring) | parse_scoring(secret_hand_scoring)
+
+
+def index(ranks, flush=False):
+    # ranks: 2-14 (CardRankings, aces high) of the 1-5 cards played
+    ranks = sorted(ranks)
+    position = OFFSETS[len(ranks)]
+    for i, rank in enumerate(ranks):
+        position += _COMB[rank - 2 + i][i + 1]
+    return position + SIZE if flush else position
+
+
+def classify(ranks, flush=False):
+    # The poker hand a set of ranks makes, worked out the slow way. Used to
+    # build the table, and what every entry in it is checked against.
+    counts = sorted((ranks.count(rank) for rank in set(ranks)), reverse=True)
+    flush = flush and len(ranks) == MAX_CARDS
+    straight = False
+    if len(ranks) == MAX_CARDS and counts[0] == 1:
+        low, high = min(ranks), max(ranks)
+        straight = high - low == 4 or sorted(ranks) == [2, 3, 4, 5, 14]
+
+    if counts[0] == 5:
+        return "Flush Five" if flush else "Five of a Kind"
+    if flush and counts[:2] == [3, 2]:
+        return "Flush House"
+    if straight and flush:
+        return "Royal Flush" if min(ranks) == 10 else "Straight Flush"
+    if counts[0] == 4:
+        return "Four of a Kind"
+    if counts[:2] == [3, 2]:
+        return "Full House"
+    if flush:
+        return "Flush"
+    if straight:
+        return "Straight"
+    if counts[0] == 3:
+        return "Three of a Kind"
+    if counts[:2] == [2, 2]:
+        return "Two Pair"
+    if counts[0] == 2:
+        return "Pair"
+    return "High Card"
+
+
+def multisets(k, low=2):
+    # Every sorted list of k ranks from low..14
+    if k == 0:
+        yield []
+        return
+    for rank in range(low, 15):
+        for rest in multisets(k - 1, rank):
+            yield [rank] + rest
+
+
+def build():
+    table = bytearray(2 * SIZE)
+    for k in range(1, MAX_CARDS + 1):
+        for ranks in multisets(k):
+            for flush in (False, True):
+                table[index(ranks, flush)] = CATEGORIES.index(classify(ranks, flush))
+    return bytes(table)
+
+
+class HandTable:
+    # The table, built the first time it's needed and kept in a file that every
+    # process (orchestrator workers, simulations) maps read-only, so it's built
+    # once per machine rather than once per process.
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.table = None
+
+    def open(self):
+        if self.table is not None:
+            return self.table
+        if not self.isvalid():
+            self.save()
+        self.file = open(self.path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.table = memoryview(self.map)[len(MAGIC) :]
+        return self.table
+
+    def close(self):
+        if self.table is not None:
+            self.table.release()
+            self.map.close()
+            self.file.close()
+            self.table = None
+
+    def isvalid(self):
+        try:
+            with open(self.path, "rb") as f:
+                return f.read(len(MAGIC)) == MAGIC and os.fstat(f.fileno()).st_size == len(MAGIC) + 2 * SIZE
+        except OSError:
+            return False
+
+    def save(self):
+        # Written to the side and renamed into place, so a process starting up
+        # meanwhile never maps half a table
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC + build())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def category(self, ranks, flush=False):
+        return CATEGORIES[self.open()[index(ranks, flush)]]
+
+    def lookup(self, ranks, flush=False):
+        # (category, base chips, base mult) at level 1
+        category = self.category(ranks, flush)
+        return (category,) + BASE_SCORING[category]
+
+    def lookup_cards(self, cards):
+        # Same for balatro_objects.Card. Four Fingers, Shortcut, Smeared Joker
+        # and the like aren't taken into account.
+        ranks = [int(card.get_card_ranking()) for card in cards]
+        flush = len({card.suit for card in cards}) == 1
+        return self.lookup(ranks, flush)
+
+
+HAND_TABLE = HandTable()
@@ -0,0 +1,170 @@
+import re
+
+import numpy as np
+
+from jokers import jokers_dict
+from scoring import JokerEffect
+from hand_table import CATEGORIES
+from balatro_objects import CardSuits, SUIT_IDS, VALUE_RANKS
+
+# jokers.jokers_dict compiled, once at import, into the effects scoring.py
+# knows how to apply. Jokers whose descriptions match none of the patterns
+# below - money, shop and deck effects, chance, jokers that scale over a run,
+# anything that looks at cards held in hand - are listed in UNMODELLED rather
+# than left to score nothing without saying so.
+
+FACES = (11, 12, 13)
+EVEN = (2, 4, 6, 8, 10)
+ODD = (14, 3, 5, 7, 9)
+
+# Suit names as descriptions have them ("Heart suit", "Club card")
+_SUITS = {suit.value[:-1]: SUIT_IDS[suit.value] for suit in CardSuits}
+
+
+def _rank(word):
+    # "Aces", "Kings", "10", "8" -> ranking
+    word = word.rstrip("s") if len(word) > 2 else word
+    return VALUE_RANKS[word.capitalize()]
+
+
+def _category(name):
+    if name not in CATEGORIES:
+        raise KeyError(name)
+    return name
+
+
+def _amounts(text):
+    # chips, mult and xmult out of "+20 Chips and +4 Mult", "X2 Mult", ...
+    chips, mult, xmult = 0, 0, 1
+    for sign, amount, kind in re.findall(r"([+X])(\d+(?:\.\d+)?) (Chips|Mult)", text):
+        if sign == "X":
+            xmult = float(amount)
+        elif kind == "Chips":
+            chips = int(amount)
+        else:
+            mult = int(amount)
+    return chips, mult, xmult
+
+
+_AMOUNT = r"[+X]\d+(?:\.\d+)? (?:Chips|Mult)(?: and [+X]\d+(?:\.\d+)? (?:Chips|Mult))?"
+
+# (pattern, scope, condition from the match). The amounts always come from
+# the group called "amount".
+PATTERNS = [
+    # Joker, Stuntman, Gros Michel, Cavendish: the effect itself is unconditional
+    (rf"^(?P<amount>[+X]\d+(?:\.\d+)? (?:Chips|Mult))(?:,? -?\d+ hand size| \d+ in \d+ chance this card is destroy(?:ed)? at (?:the )?end of (?:the )?round)?$", "hand", lambda m: None),
+    (rf"^(?P<amount>{_AMOUNT}) if played hand contains an? (?P<hand>[\w ]+?)$", "hand", lambda m: ("contains", _category(m["hand"]))),
+    (rf"^(?P<amount>{_AMOUNT}) if played hand contains (?P<n>\d) or fewer cards$", "hand", lambda m: ("max_cards", int(m["n"]))),
+    (rf"^(?P<amount>{_AMOUNT}) on final hand of round$", "hand", lambda m: ("final_hand", None)),
+    (rf"^(?P<amount>{_AMOUNT}) when (?P<n>\d+) discards remaining$", "hand", lambda m: ("discards_left", int(m["n"]))),
+    (rf"^(?P<amount>{_AMOUNT}) for each remaining discard$", "hand", lambda m: ("per_discard", None)),
+    (rf"^Played cards with (?P<suit>\w+) suit give (?P<amount>{_AMOUNT}) when scored$", "card", lambda m: ("suits", (_SUITS[m["suit"]],))),
+    (rf"^Played cards with (?P<parity>even|odd) rank give (?P<amount>{_AMOUNT}) when scored(?: \(.*\))?$", "card", lambda m: ("ranks", EVEN if m["parity"] == "even" else ODD)),
+    (rf"^Played face cards give (?P<amount>{_AMOUNT}) when scored$", "card", lambda m: ("ranks", FACES)),
+    (rf"^First played face card gives (?P<amount>{_AMOUNT}) when scored$", "hand", lambda m: ("has_ranks", FACES)),
+    (rf"^Played (?P<ranks>\w+(?: and \w+)*) (?:each )?gives? (?P<amount>{_AMOUNT}) when scored$", "card", lambda m: ("ranks", tuple(_rank(word) for word in m["ranks"].split(" and ")))),
+    (rf"^Each pla\w+ (?P<ranks>[\w ,]+?) gives (?P<amount>{_AMOUNT}) when scored$", "card", lambda m: ("ranks", tuple(_rank(word) for word in re.split(r",? (?:or )?|, ", m["ranks"]) if word))),
+]
+
+RETRIGGERS = [
+    (r"^Retrigger each played (?P<ranks>[\w ,]+)$", lambda m: ("ranks", tuple(_rank(word) for word in re.split(r",? (?:or )?|, ", m["ranks"]) if word))),
+    (r"^Retrigger all played face cards$", lambda m: ("ranks", FACES)),
+    (r"^Retrigger all played cards in final hand of round$", lambda m: ("final_hand", None)),
+    (r"^Retrigger all cards played for the next \d+ hands$", lambda m: None),
+]
+
+
+def compile_joker(name, description):
+    # The JokerEffect for one joker, or None if it isn't modelled
+    description = " ".join(description.split())
+    for pattern, scope, condition in PATTERNS:
+        match = re.match(pattern, description)
+        if match:
+            try:
+                return JokerEffect(name, scope, *_amounts(match["amount"]), condition(match))
+            except KeyError:
+                # A rank, suit or hand we don't know, e.g. a typo
+                return None
+    for pattern, condition in RETRIGGERS:
+        match = re.match(pattern, description)
+        if match:
+            try:
+                return JokerEffect(name, "card", 0, 0, 1, condition(match), retriggers=1)
+            except KeyError:
+                return None
+    return None
+
+
+EFFECTS = {}
+UNMODELLED = set()
+for _name, _description in jokers_dict.items():
+    _effect = compile_joker(_name, _description)
+    if _effect is None:
+        UNMODELLED.add(_name)
+    else:
+        EFFECTS[_name] = _effect
+
+
+# The same effects as arrays, one row per joker in jokers_dict order, for
+# code that wants to sum over jokers without going through JokerEffect:
+# scope 0 = hand, 1 = card; condition an index into CONDITIONS, with the
+# ranks, suits or categories it names as a bitmask.
+CONDITIONS = (None, "contains", "max_cards", "has_ranks", "final_hand", "discards_left", "per_discard", "suits", "ranks")
+NAMES = list(jokers_dict)
+INDEX = {name: i for i, name in enumerate(NAMES)}
+TABLE = np.zeros(
+    len(NAMES),
+    dtype=[
+        ("modelled", "?"),
+        ("scope", "i1"),
+        ("chips", "i4"),
+        ("mult", "i4"),
+        ("xmult", "f4"),
+        ("retriggers", "i1"),
+        ("condition", "i1"),
+        ("mask", "i8"),
+        ("value", "i4"),
+    ],
+)
+
+
+def _mask(condition):
+    kind, value = condition
+    if kind == "contains":
+        return 1 << CATEGORIES.index(value)
+    if kind in ("has_ranks", "ranks", "suits"):
+        return sum(1 << v for v in value)
+    return 0
+
+
+for _name, _effect in EFFECTS.items():
+    _row = TABLE[INDEX[_name]]
+    _row["modelled"] = True
+    _row["scope"] = _effect.scope == "card"
+    _row["chips"] = _effect.chips
+    _row["mult"] = _effect.mult
+    _row["xmult"] = _effect.xmult
+    _row["retriggers"] = _effect.retriggers
+    if _effect.condition is not None:
+        _row["condition"] = CONDITIONS.index(_effect.condition[0])
+        _row["mask"] = _mask(_effect.condition)
+        if isinstance(_effect.condition[1], int):
+            _row["value"] = _effect.condition[1]
+TABLE["xmult"][~TABLE["modelled"]] = 1
+
+
+def effects_for(jokers):
+    # JokerEffects for the jokers in G["jokers"] (or a list of names), in
+    # order, and the names of the ones that couldn't be modelled. Debuffed
+    # jokers do nothing.
+    effects, unmodelled = [], []
+    for joker in jokers:
+        if isinstance(joker, str):
+            name, debuff = joker, False
+        else:
+            name, debuff = joker["label"], joker.get("debuff")
+        if name not in EFFECTS:
+            unmodelled.append(name)
+        elif not debuff:
+            effects.append(EFFECTS[name])
+    return effects, unmodelled
@@ -0,0 +1,134 @@
+from itertools import permutations
+
+import numpy as np
+
+from joker_effects import EFFECTS
+from scoring import CARD_CHIPS, play_arrays, scoring_cards, base_scoring, card_mask, hand_count
+
+# Picks the order of the jokers that scores the most over the plays we
+# expect to make. Unlike scoring.score_arrays, which follows the "additive
+# first" simplification in jokers.scoring_rules, order matters here the way
+# it does in the game: each scoring card runs through the card jokers left
+# to right, then the hand jokers apply left to right, so +4 Mult after a X2
+# Mult is worth less than before it. Blueprint and Brainstorm copy the
+# joker to their right and the leftmost joker.
+#
+# Neighbouring jokers of the same class (both additive, or both
+# multiplicative) can be swapped without changing the score, so orders that
+# only differ that way, once copies are resolved, are scored once. The hand
+# phase is scored a joker at a time from memoized prefixes, which most
+# orders share.
+
+COPIERS = {"Blueprint": 1, "Brainstorm": None}
+
+
+def effective(names):
+    # The effect each joker has in this order, following copies, or None
+    effects = []
+    for i in range(len(names)):
+        j, seen = i, set()
+        while j is not None and names[j] in COPIERS and j not in seen:
+            seen.add(j)
+            step = COPIERS[names[j]]
+            j = 0 if step is None else j + step
+            if j >= len(names):
+                j = None
+        effects.append(None if j is None or names[j] in COPIERS else EFFECTS.get(names[j]))
+    return effects
+
+
+def _canonical(effects):
+    # Sort runs of the same class, the score is the same either way
+    key, run, run_kind = [], [], None
+    for effect in effects:
+        kind = effect.xmult != 1
+        if kind != run_kind and run:
+            key.extend(sorted(run))
+            run = []
+        run.append(effect.name)
+        run_kind = kind
+    key.extend(sorted(run))
+    return tuple(key)
+
+
+class OrderSearch:
+    def __init__(self, plays, levels=None, hands_left=None, discards_left=0):
+        # plays: lists of balatro_objects.Card, each one a play we expect to make
+        self.ranks, self.suits, debuffs, categories = play_arrays(plays)
+        self.live = scoring_cards(self.ranks, categories) & ~debuffs
+        self.context = (self.ranks, self.suits, categories, hands_left, discards_left)
+        base_chips, base_mult = base_scoring(levels)
+        self.base = (base_chips[categories], base_mult[categories])
+        self.card_memo = {}
+        self.hand_memo = {}
+        self.evaluated = 0
+
+    def card_phase(self, effects):
+        # (chips, mult) once every card has scored. Each card runs through
+        # every card joker, so this is memoized on the whole sequence only.
+        key = tuple(effect.name for effect in effects)
+        if key in self.card_memo:
+            return self.card_memo[key]
+
+        chips, mult = (value.copy() for value in self.base)
+        masks = [card_mask(effect, self.live, self.context) for effect in effects]
+        times = self.live.astype(np.int16)
+        for effect, mask in zip(effects, masks):
+            times += effect.retriggers * mask
+        for j in range(self.ranks.shape[1]):
+            for repeat in range(times[:, j].max(initial=0)):
+                active = times[:, j] > repeat
+                chips = chips + CARD_CHIPS[self.ranks[:, j]] * active
+                for effect, mask in zip(effects, masks):
+                    on = active & mask[:, j]
+                    chips = chips + effect.chips * on
+                    mult = (mult + effect.mult * on) * np.where(on, effect.xmult, 1)
+
+        self.card_memo[key] = (chips, mult)
+        return chips, mult
+
+    def hand_phase(self, card_key, effects):
+        # (chips, mult) after the hand jokers, built on the memoized prefix
+        key = (card_key, tuple(effect.name for effect in effects))
+        if key in self.hand_memo:
+            return self.hand_memo[key]
+        if not effects:
+            return self.card_memo[card_key]
+
+        chips, mult = self.hand_phase(card_key, effects[:-1])
+        effect = effects[-1]
+        count = hand_count(effect, self.live, self.context)
+        chips = chips + effect.chips * count
+        mult = (mult + effect.mult * count) * np.power(effect.xmult, count)
+        self.hand_memo[key] = (chips, mult)
+        return chips, mult
+
+    def score(self, names):
+        # Mean score of the plays with the jokers in this order
+        effects = [effect for effect in effective(names) if effect is not None]
+        cards = [effect for effect in effects if effect.scope == "card"]
+        hands = [effect for effect in effects if effect.scope == "hand"]
+        self.card_phase(cards)
+        chips, mult = self.hand_phase(tuple(effect.name for effect in cards), hands)
+        self.evaluated += 1
+        return float(np.floor(chips * mult).mean())
+
+    def best_order(self, names):
+        # (positions in their new order, mean score). The current order wins
+        # ties, so we don't shuffle jokers for nothing.
+        best, best_score = tuple(range(len(names))), None
+        seen = set()
+        for order in permutations(range(len(names))):
+            ordered = [names[i] for i in order]
+            effects = [effect for effect in effective(ordered) if effect is not None]
+            key = (
+                _canonical([effect for effect in effects if effect.scope == "card"]),
+                _canonical([effect for effect in effects if effect.scope == "hand"]),
+            )
+            if key in seen:
+                continue
+            seen.add(key)
+            score = self.score(ordered)
+            if best_score is None or score > best_score:
+                best, best_score = order, score
+        return list(best), best_score
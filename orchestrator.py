@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+import json
+import time
+import socket
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+def load_strategy(spec):
+    # "flush_strategy:make_bot" or "llm_strategy:LLMBot", anything that takes
+    # Bot's keyword arguments and returns a bot
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def port_is_free(port, host="127.0.0.1"):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.bind((host, port))
+        except OSError:
+            return False
+    return True
+
+
+def allocate_ports(count, base_port=12347, host="127.0.0.1"):
+    # The game binds its port itself (arg[1] in src/api.lua), so only hand out
+    # ports nothing else is listening on yet
+    ports = []
+    port = base_port
+    while len(ports) < count:
+        if port > 65535:
+            raise RuntimeError("Ran out of ports to allocate from {}".format(base_port))
+        if port_is_free(port, host):
+            ports.append(port)
+        port += 1
+    return ports
+
+
+def launch_game(strategy, port, deck="Blue Deck", stake=1):
+    # Starts a Balatro instance on `port` from the orchestrator itself, so
+    # it's still there to stop when a worker dies without cleaning up.
+    # Returns the bot holding the process, for stop_balatro_instance().
+    bot = load_strategy(strategy)(
+        deck=deck, stake=stake, seed=None, challenge=None, bot_port=port, push=True
+    )
+    bot.start_balatro_instance()
+    return bot
+
+
+def run_instance(strategy, port, seed=None, runs=1, deck="Blue Deck", stake=1, idle_timeout=120):
+    # Runs in a worker process: play `runs` runs on one game and report how
+    # they went. A game that goes quiet for `idle_timeout` seconds has crashed
+    # or hung, and fails the worker like any other crash.
+    bot = load_strategy(strategy)(
+        deck=deck, stake=stake, seed=seed, challenge=None, bot_port=port, push=True
+    )
+    bot.cache_states = False
+    bot.max_runs = runs
+    bot.idle_timeout = idle_timeout
+
+    start = time.perf_counter()
+    bot.run()
+
+    return {
+        "port": port,
+        "seed": seed,
+        "ante_reached": bot.ante_reached,
+        "rounds": bot.rounds,
+        "decisions": bot.decisions,
+        "wall_time": time.perf_counter() - start,
+    }
+
+
+def summarize(outcomes):
+    finished = [outcome for outcome in outcomes if "error" not in outcome]
+    summary = {
+        "instances": len(outcomes),
+        "finished": len(finished),
+        "failed": len(outcomes) - len(finished),
+        "restarts": sum(outcome["restarts"] for outcome in outcomes),
+    }
+    if finished:
+        antes = [outcome["ante_reached"] for outcome in finished]
+        decisions = sum(outcome["decisions"] for outcome in finished)
+        wall_time = sum(outcome["wall_time"] for outcome in finished)
+        summary.update(
+            {
+                "best_ante": max(antes),
+                "mean_ante": sum(antes) / len(antes),
+                "mean_rounds": sum(outcome["rounds"] for outcome in finished) / len(finished),
+                "decisions": decisions,
+                "wall_time": wall_time,
+                "decisions_per_second": decisions / wall_time if wall_time else 0.0,
+            }
+        )
+    summary["runs"] = outcomes
+    return summary
+
+
+def orchestrate(strategy, instances, base_port=12347, runs=1, seeds=None, launch=False, max_restarts=2, deck="Blue Deck", stake=1, idle_timeout=120):
+    ports = allocate_ports(instances, base_port) if launch else list(range(base_port, base_port + instances))
+    seeds = seeds or [None] * instances
+    restarts = [0] * instances
+    outcomes = [None] * instances
+
+    pool = ProcessPoolExecutor(max_workers=instances)
+    pending = {}
+    # Instance -> the bot holding its game, with --launch. A worker that's
+    # restarted gets a fresh game, the old one may be what crashed.
+    games = {}
+
+    def stop_game(i):
+        if i in games:
+            games.pop(i).stop_balatro_instance()
+
+    def submit(i):
+        if launch:
+            stop_game(i)
+            games[i] = launch_game(strategy, ports[i], deck, stake)
+        pending[pool.submit(run_instance, strategy, ports[i], seeds[i], runs, deck, stake, idle_timeout)] = i
+
+    for i in range(instances):
+        submit(i)
+
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            failed = []
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    outcomes[i] = dict(future.result(), restarts=restarts[i])
+                    stop_game(i)
+                except Exception as e:
+                    print("Worker for port {} failed: {!r}".format(ports[i], e))
+                    failed.append((i, e))
+
+            if any(isinstance(e, BrokenProcessPool) for _, e in failed):
+                # A worker died outright and took the pool with it. We can't tell
+                # which one, so every interrupted instance counts it as a restart
+                # and anything that hadn't reported yet is simply resubmitted.
+                pool.shutdown(cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=instances)
+                failed.extend((i, None) for i in pending.values())
+                pending.clear()
+
+            for i, e in failed:
+                if e is None:
+                    submit(i)
+                elif restarts[i] < max_restarts:
+                    restarts[i] += 1
+                    print("Restarting worker for port {} ({}/{})".format(ports[i], restarts[i], max_restarts))
+                    submit(i)
+                else:
+                    outcomes[i] = {"port": ports[i], "seed": seeds[i], "error": repr(e), "restarts": restarts[i]}
+                    stop_game(i)
+    finally:
+        pool.shutdown()
+        for i in list(games):
+            stop_game(i)
+
+    return summarize(outcomes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a strategy across several Balatro instances")
+    parser.add_argument("--strategy", default="flush_strategy:make_bot", help="module:callable returning a Bot")
+    parser.add_argument("--instances", type=int, default=2)
+    parser.add_argument("--base-port", type=int, default=12347)
+    parser.add_argument("--runs", type=int, default=1, help="Runs to play on each instance")
+    parser.add_argument("--seeds", nargs="*", help="One seed per instance, random if omitted")
+    parser.add_argument("--launch", action="store_true", help="Start a Balatro instance per worker")
+    parser.add_argument("--max-restarts", type=int, default=2)
+    parser.add_argument("--idle-timeout", type=float, default=120, help="Seconds without a gamestate before a game counts as crashed")
+    parser.add_argument("--deck", default="Blue Deck")
+    parser.add_argument("--stake", type=int, default=1)
+    args = parser.parse_args()
+
+    summary = orchestrate(
+        args.strategy,
+        args.instances,
+        base_port=args.base_port,
+        runs=args.runs,
+        seeds=args.seeds,
+        launch=args.launch,
+        max_restarts=args.max_restarts,
+        idle_timeout=args.idle_timeout,
+        deck=args.deck,
+        stake=args.stake,
+    )
+    print(json.dumps(summary, indent=4))
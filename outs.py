@@ -0,0 +1,124 @@
+from math import comb
+from functools import lru_cache
+from collections import namedtuple
+
+from balatro_objects import intern_card
+
+# Exact odds of completing a draw, for when Monte Carlo (discards.py) is
+# more than the question needs. Drawing n cards from the deck is
+# hypergeometric: every n-card draw is equally likely, so the odds are the
+# number of draws that complete the hand over comb(deck size, n). Draws are
+# counted a suit or rank at a time, so it's exact without listing them.
+#
+# Every probability is memoized on (deck histogram, kept cards, draws), all
+# plain tuples, so asking again within a round is a dictionary lookup. The
+# deck changes every draw, so only the most recent CACHE_SIZE are kept.
+
+Outs = namedtuple("Outs", ["flush", "straight", "three_of_a_kind"])
+
+CACHE_SIZE = 4096
+
+# Aces also set this bit in straight masks, for 5-high straights
+_ACE_LOW = 1
+
+
+def histogram(deck):
+    # ((count of each rank 2-14) for each suit) of G["deck"]
+    counts = [[0] * 13 for _ in range(4)]
+    for card in deck:
+        face = intern_card(card["card_key"])
+        counts[face.suit_id][face.rank - 2] += 1
+    return tuple(tuple(suit) for suit in counts)
+
+
+def kept_codes(cards):
+    # Card.code of the cards kept, in a canonical order
+    return tuple(sorted(card.code for card in cards))
+
+
+def after_discard(hand, hist, discard):
+    # Outs for discarding the cards at Card.index in discard and drawing
+    # as many back, from a deck histogram (histogram(G["deck"]) or
+    # DeckTracker.histogram())
+    kept = [card for card in hand if card.index not in discard]
+    codes = kept_codes(kept)
+    draws = min(len(hand) - len(kept), sum(map(sum, hist)))
+    return Outs(p_flush(hist, codes, draws), p_straight(hist, codes, draws), p_three_of_a_kind(hist, codes, draws))
+
+
+def _count(groups, draws, step, start):
+    # Ways of drawing `draws` cards spread over groups of (cards in the deck,
+    # group id), as {status: ways}, where step(status, group id, drawn from
+    # it) is the status afterwards
+    states = {(0, start): 1}
+    for available, group in groups:
+        after = {}
+        for (used, status), ways in states.items():
+            for drawn in range(min(available, draws - used) + 1):
+                key = (used + drawn, step(status, group, drawn))
+                after[key] = after.get(key, 0) + ways * comb(available, drawn)
+        states = after
+    return {status: ways for (used, status), ways in states.items() if used == draws}
+
+
+def _probability(hist, draws, ways):
+    total = comb(sum(map(sum, hist)), draws)
+    return ways / total if total else 0.0
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def p_flush(hist, kept, draws):
+    suited = [0] * 4
+    for code in kept:
+        suited[code % 4] += 1
+    if max(suited, default=0) >= 5:
+        return 1.0
+
+    def step(done, suit, drawn):
+        return done or suited[suit] + drawn >= 5
+
+    outcomes = _count([(sum(hist[suit]), suit) for suit in range(4)], draws, step, False)
+    return _probability(hist, draws, outcomes.get(True, 0))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def p_three_of_a_kind(hist, kept, draws):
+    ranked = [0] * 15
+    for code in kept:
+        ranked[code // 4] += 1
+    if max(ranked) >= 3:
+        return 1.0
+
+    def step(done, rank, drawn):
+        return done or ranked[rank] + drawn >= 3
+
+    groups = [(sum(hist[suit][rank - 2] for suit in range(4)), rank) for rank in range(2, 15)]
+    outcomes = _count(groups, draws, step, False)
+    return _probability(hist, draws, outcomes.get(True, 0))
+
+
+def _straight(mask):
+    return any(mask >> low & 0b11111 == 0b11111 for low in range(1, 11))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def p_straight(hist, kept, draws):
+    mask = 0
+    for code in kept:
+        mask |= 1 << (code // 4)
+    if mask >> 14 & 1:
+        mask |= 1 << _ACE_LOW
+    if _straight(mask):
+        return 1.0
+
+    def step(status, rank, drawn):
+        if not drawn:
+            return status
+        status |= 1 << rank
+        if rank == 14:
+            status |= 1 << _ACE_LOW
+        return status
+
+    groups = [(sum(hist[suit][rank - 2] for suit in range(4)), rank) for rank in range(2, 15)]
+    outcomes = _count(groups, draws, step, mask)
+    return _probability(hist, draws, sum(ways for status, ways in outcomes.items() if _straight(status)))
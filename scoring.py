@@ -0,0 +1,200 @@
+from collections import namedtuple
+
+import numpy as np
+
+from hand_table import HAND_TABLE, CATEGORIES, BASE_SCORING
+
+# Works out what plays will score, many at once. Follows the steps of
+# jokers.scoring_rules: find the poker hand and the cards that score in it,
+# take its base chips and mult at its level, add chips (cards, then jokers),
+# add mult, then multiply mult. Enhancements, editions and seals aren't
+# modelled.
+
+# Chips and mult each level after the first adds
+LEVEL_UPS = {
+    "High Card": (10, 1),
+    "Pair": (15, 1),
+    "Two Pair": (20, 1),
+    "Three of a Kind": (20, 2),
+    "Straight": (30, 3),
+    "Flush": (15, 2),
+    "Full House": (25, 2),
+    "Four of a Kind": (30, 3),
+    "Straight Flush": (40, 4),
+    "Royal Flush": (40, 4),
+    "Five of a Kind": (35, 3),
+    "Flush House": (40, 4),
+    "Flush Five": (50, 3),
+}
+
+# Hands sharing a level, a Royal Flush is just the best Straight Flush
+LEVEL_OF = {"Royal Flush": "Straight Flush"}
+
+# CONTAINS[a, b]: a hand of category a "contains a" b, as jokers mean it
+_CONTAINED = {
+    "Flush Five": ("Flush", "Five of a Kind", "Four of a Kind", "Three of a Kind", "Pair"),
+    "Flush House": ("Flush", "Full House", "Three of a Kind", "Two Pair", "Pair"),
+    "Five of a Kind": ("Four of a Kind", "Three of a Kind", "Pair"),
+    "Royal Flush": ("Straight Flush", "Flush", "Straight"),
+    "Straight Flush": ("Flush", "Straight"),
+    "Four of a Kind": ("Three of a Kind", "Pair"),
+    "Full House": ("Three of a Kind", "Two Pair", "Pair"),
+    "Three of a Kind": ("Pair",),
+    "Two Pair": ("Pair",),
+}
+CONTAINS = np.eye(len(CATEGORIES), dtype=bool)
+for _category, _contained in _CONTAINED.items():
+    for _other in _contained:
+        CONTAINS[CATEGORIES.index(_category), CATEGORIES.index(_other)] = True
+CONTAINS[:, CATEGORIES.index("High Card")] = True
+
+# In these only the cards of repeated ranks score, in High Card only the
+# highest card, in the rest every card played
+_GROUPED = np.array([category in ("Pair", "Two Pair", "Three of a Kind", "Four of a Kind") for category in CATEGORIES])
+_HIGH_CARD = np.array([category == "High Card" for category in CATEGORIES])
+
+# Chips a scoring card adds, by rank (0 for an empty slot)
+CARD_CHIPS = np.array([0, 0, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11])
+
+# One joker's effect. scope is "hand" (once per play) or "card" (once per
+# scoring card, including retriggers). condition is None (always) or one of
+#   ("contains", category)   hand: the play contains that poker hand
+#   ("max_cards", n)         hand: n or fewer cards played
+#   ("has_ranks", ranks)     hand: a scoring card has one of the ranks
+#   ("final_hand", None)     either: it's the last hand of the round
+#   ("discards_left", n)     hand: exactly n discards remaining
+#   ("per_discard", None)    hand: once per remaining discard
+#   ("suits", suit ids)      card: cards of these suits
+#   ("ranks", ranks)         card: cards of these ranks
+# retriggers is how many extra times the matching cards score.
+JokerEffect = namedtuple("JokerEffect", ["name", "scope", "chips", "mult", "xmult", "condition", "retriggers"], defaults=(0,))
+
+
+def play_arrays(plays):
+    # ranks, suit ids, debuffs and categories of plays (lists of
+    # balatro_objects.Card), padded to 5 cards with rank 0
+    n = len(plays)
+    ranks = np.zeros((n, 5), dtype=np.int16)
+    suits = np.full((n, 5), -1, dtype=np.int8)
+    debuffs = np.zeros((n, 5), dtype=bool)
+    categories = np.empty(n, dtype=np.int16)
+    for i, play in enumerate(plays):
+        ranks[i, : len(play)] = [card.rank for card in play]
+        suits[i, : len(play)] = [card.suit_id for card in play]
+        debuffs[i, : len(play)] = [bool(card.debuff) for card in play]
+        flush = len(play) == 5 and len({card.suit_id for card in play}) == 1
+        categories[i] = CATEGORIES.index(HAND_TABLE.category([card.rank for card in play], flush))
+    return ranks, suits, debuffs, categories
+
+
+def scoring_cards(ranks, categories):
+    # (N, 5) mask of the cards that score in each play
+    present = ranks > 0
+    repeated = ((ranks[:, :, None] == ranks[:, None, :]) & present[:, None, :]).sum(axis=2) > 1
+    highest = np.zeros_like(present)
+    highest[np.arange(len(ranks)), ranks.argmax(axis=1)] = True
+
+    grouped = _GROUPED[categories][:, None]
+    high_card = _HIGH_CARD[categories][:, None]
+    return present & np.where(grouped, repeated, np.where(high_card, highest, True))
+
+
+def base_scoring(levels=None, blind=None):
+    # (chips, mult) arrays indexed by category at the given levels
+    levels = levels or {}
+    chips = np.empty(len(CATEGORIES))
+    mult = np.empty(len(CATEGORIES))
+    for i, category in enumerate(CATEGORIES):
+        level = levels.get(LEVEL_OF.get(category, category), 1)
+        chips[i] = BASE_SCORING[category][0] + LEVEL_UPS[category][0] * (level - 1)
+        mult[i] = BASE_SCORING[category][1] + LEVEL_UPS[category][1] * (level - 1)
+    if blind == "The Flint":
+        chips = np.maximum(np.floor(chips / 2 + 0.5), 1)
+        mult = np.maximum(np.floor(mult / 2 + 0.5), 1)
+    return chips, mult
+
+
+def score_arrays(ranks, suits, debuffs, categories, levels=None, jokers=(), blind=None, hands_left=None, discards_left=0):
+    # (chips, mult) of every play, before they're multiplied together
+    scoring = scoring_cards(ranks, categories)
+    live = scoring & ~debuffs
+    context = (ranks, suits, categories, hands_left, discards_left)
+
+    # How many times each card scores, counting retriggers
+    times = live.astype(np.int16)
+    for joker in jokers:
+        if joker.retriggers:
+            times += joker.retriggers * card_mask(joker, live, context)
+
+    # 2. Base chips and mult for the hand at its level
+    base_chips, base_mult = base_scoring(levels, blind)
+    chips = base_chips[categories]
+    mult = base_mult[categories]
+
+    # 3. Chips from the scoring cards, then jokers in order. Jokers' +mult and
+    # xmult are collected as we go and applied in steps 4 and 5.
+    chips = chips + (CARD_CHIPS[ranks] * times).sum(axis=1)
+    add_mult = np.zeros(len(ranks))
+    x_mult = np.ones(len(ranks))
+    for joker in jokers:
+        if joker.scope == "card":
+            count = (times * card_mask(joker, live, context)).sum(axis=1)
+        else:
+            count = hand_count(joker, live, context)
+        if joker.chips:
+            chips = chips + joker.chips * count
+        if joker.mult:
+            add_mult += joker.mult * count
+        if joker.xmult != 1:
+            x_mult *= np.power(joker.xmult, count)
+
+    # 4. Additive mult, then 5. multiplicative mult
+    mult = (mult + add_mult) * x_mult
+    return chips, mult
+
+
+def card_mask(joker, live, context):
+    # (N, 5) mask of the scoring cards a card scope joker applies to
+    ranks, suits, categories, hands_left, discards_left = context
+    kind, value = joker.condition or (None, None)
+    if kind == "suits":
+        return live & np.isin(suits, value)
+    if kind == "ranks":
+        return live & np.isin(ranks, value)
+    if kind == "final_hand":
+        return live & (hands_left == 1)
+    return live
+
+
+def hand_count(joker, live, context):
+    # How many times a hand scope joker applies to each play
+    ranks, suits, categories, hands_left, discards_left = context
+    kind, value = joker.condition or (None, None)
+    if kind == "contains":
+        applies = CONTAINS[categories, CATEGORIES.index(value)]
+    elif kind == "max_cards":
+        applies = (ranks > 0).sum(axis=1) <= value
+    elif kind == "has_ranks":
+        applies = (live & np.isin(ranks, value)).any(axis=1)
+    elif kind == "final_hand":
+        applies = np.full(len(ranks), hands_left == 1)
+    elif kind == "discards_left":
+        applies = np.full(len(ranks), discards_left == value)
+    elif kind == "per_discard":
+        return np.full(len(ranks), discards_left, dtype=np.int16)
+    else:
+        applies = np.ones(len(ranks), dtype=bool)
+    return applies.astype(np.int16)
+
+
+def score_plays(plays, levels=None, jokers=(), blind=None, hands_left=None, discards_left=0):
+    # 6. Final score of each play, chips x mult
+    chips, mult = score_arrays(
+        *play_arrays(plays),
+        levels=levels,
+        jokers=jokers,
+        blind=blind,
+        hands_left=hands_left,
+        discards_left=discards_left,
+    )
+    return np.floor(chips * mult)
@@ -8,72 +8,234 @@ BalatrobotAPI.socket = nil
 BalatrobotAPI.waitingFor = nil
 BalatrobotAPI.waitingForAction = true
 
-function BalatrobotAPI.notifyapiclient()
+-- Client that asked (with HELLO|push) to be sent every new decision point
+-- as soon as it happens, instead of polling for it
+BalatrobotAPI.subscriber = nil
+BalatrobotAPI.pushpending = false
+
+-- Bumped every time the game starts waiting on a new decision. Sent with each
+-- gamestate and echoed back as a SEQ: prefix on actions, so duplicated or late
+-- datagrams can't be acted on twice by either side.
+BalatrobotAPI.stateseq = 0
+
+-- When this game started, also sent with each gamestate. A restarted game
+-- counts decisions from 0 again, and this tells the client it's a new game
+-- rather than stale states of the old one.
+BalatrobotAPI.epoch = os.time()
+
+-- Options from the client's last HELLO, see Utils.parsehello
+BalatrobotAPI.options = {}
+
+-- Gamestate sections the client wants for each waitingFor, see Utils.parsefields
+BalatrobotAPI.fields = {}
+
+-- Gamestates bigger than options.chunk bytes are split into numbered
+-- CHUNK|msgid|index|count|payload datagrams for the client to reassemble
+BalatrobotAPI.msgid = 0
+
+-- With options.delta the subscriber gets a full keyframe on HELLO and after
+-- that only Utils.diff deltas against the last state it was sent
+BalatrobotAPI.frame = 0
+BalatrobotAPI.lastsent = nil
+
+function BalatrobotAPI.notifyapiclient(ip, port, delta)
+    ip = ip or msg_or_ip
+    port = port or port_or_nil
+
     -- TODO Generate gamestate json object
-    local _gamestate = Utils.getGamestate()
+    local _gamestate = Utils.getGamestate(BalatrobotAPI.fields[BalatrobotAPI.waitingFor] or BalatrobotAPI.fields.default)
     _gamestate.waitingFor = BalatrobotAPI.waitingFor
     sendDebugMessage('WaitingFor ' .. tostring(BalatrobotAPI.waitingFor))
     _gamestate.waitingForAction = BalatrobotAPI.waitingFor ~= nil and BalatrobotAPI.waitingForAction or false
-    local _gamestateJsonString = json.encode(_gamestate)
+    _gamestate.seq = BalatrobotAPI.stateseq
+    _gamestate.epoch = BalatrobotAPI.epoch
 
-    if BalatrobotAPI.socket and port_or_nil ~= nil then
+    local _payload
+    local _subscriber = BalatrobotAPI.subscriber
+    if BalatrobotAPI.options.delta and _subscriber and _subscriber.ip == ip and _subscriber.port == port then
+        BalatrobotAPI.frame = BalatrobotAPI.frame + 1
+        _gamestate.frame = BalatrobotAPI.frame
+
+        if delta and BalatrobotAPI.lastsent then
+            local _delta = {}
+            _delta.base = BalatrobotAPI.lastsent.frame
+            _delta.frame = _gamestate.frame
+            _delta.delta = Utils.diff(BalatrobotAPI.lastsent, _gamestate)
+            _payload = BalatrobotAPI.encode(_delta)
+        else
+            _payload = BalatrobotAPI.encode(_gamestate)
+        end
+        BalatrobotAPI.lastsent = _gamestate
+    else
+        _payload = BalatrobotAPI.encode(_gamestate)
+    end
+
+    if BalatrobotAPI.socket and port ~= nil then
         sendDebugMessage(_gamestate.waitingFor)
-        BalatrobotAPI.socket:sendto(string.format("%s", _gamestateJsonString), msg_or_ip, port_or_nil)
+        BalatrobotAPI.sendpayload(_payload, ip, port)
     else
         sendDebugMessage('No socket or port_or_nil is nil')
     end
 end
 
+-- options.encoding = 'bitser' swaps json for the much smaller and faster
+-- lib/bitser.lua format, decoded by bitser.py on the Python side
+function BalatrobotAPI.encode(value)
+    if BalatrobotAPI.options.encoding == 'bitser' then
+        return bitser.dumps(value)
+    end
+    return json.encode(value)
+end
+
+function BalatrobotAPI.sendpayload(payload, ip, port)
+    local _size = tonumber(BalatrobotAPI.options.chunk)
+    if not _size or #payload <= _size then
+        BalatrobotAPI.socket:sendto(payload, ip, port)
+        return
+    end
+
+    BalatrobotAPI.msgid = BalatrobotAPI.msgid + 1
+    local _count = math.ceil(#payload / _size)
+    for i = 1, _count do
+        local _chunk = payload:sub((i - 1) * _size + 1, i * _size)
+        -- Concatenated, not string.format: a bitser payload can hold NUL bytes
+        -- and LuaJIT 2.0's %s stops copying at the first one
+        BalatrobotAPI.socket:sendto("CHUNK|" .. BalatrobotAPI.msgid .. "|" .. i .. "|" .. _count .. "|" .. _chunk, ip, port)
+    end
+end
+
+-- Called by every Middleware breakpoint when the game starts waiting on a new decision
+function BalatrobotAPI.setwaitingfor(waitingFor)
+    -- A breakpoint firing again before we've acted is still the same decision
+    if BalatrobotAPI.waitingForAction and BalatrobotAPI.waitingFor == waitingFor then return end
+    -- The client already sent this decision's action as part of a batch
+    if not List.isempty(Botlogger['q_' .. waitingFor]) then return end
+
+    BalatrobotAPI.waitingFor = waitingFor
+    BalatrobotAPI.waitingForAction = true
+    BalatrobotAPI.stateseq = BalatrobotAPI.stateseq + 1
+    BalatrobotAPI.pushpending = true
+end
+
+function BalatrobotAPI.pushtosubscriber()
+    if not BalatrobotAPI.pushpending or not BalatrobotAPI.subscriber then return end
+    if not BalatrobotAPI.waitingForAction then return end
+
+    BalatrobotAPI.pushpending = false
+    BalatrobotAPI.notifyapiclient(BalatrobotAPI.subscriber.ip, BalatrobotAPI.subscriber.port, true)
+end
+
 function BalatrobotAPI.respond(str)
     sendDebugMessage('respond')
     if BalatrobotAPI.socket and port_or_nil ~= nil then
         response = {}
         response.response = str
+        response.seq = BalatrobotAPI.stateseq
+        response.epoch = BalatrobotAPI.epoch
         str = json.encode(response)
         BalatrobotAPI.socket:sendto(string.format("%s\n", str), msg_or_ip, port_or_nil)
     end
 end
 
+-- With options.ack every accepted action is acknowledged, so the client can
+-- tell a lost action from one the game is still busy carrying out
+function BalatrobotAPI.ack(seq)
+    if BalatrobotAPI.options.ack and seq and BalatrobotAPI.socket and port_or_nil ~= nil then
+        BalatrobotAPI.socket:sendto(json.encode({ ack = seq }), msg_or_ip, port_or_nil)
+    end
+end
+
 function BalatrobotAPI.queueaction(action)
     local _params = Bot.ACTIONPARAMS[action[1]]
     List.pushleft(Botlogger['q_' .. _params.func], { 0, action })
 end
 
+-- Called by Botlogger when the next action of a batch is no longer valid by
+-- the time the game gets to it. The rest of the batch is dropped and the
+-- client is asked for a new decision.
+function BalatrobotAPI.abortbatch(func, action)
+    for k, v in pairs(Botlogger) do
+        if type(k) == 'string' and k:match('^q_') then
+            Botlogger[k] = List.new()
+        end
+    end
+
+    -- Ask again first, so the error carries the new decision's seq and the
+    -- client waits for it instead of retrying the old one
+    BalatrobotAPI.setwaitingfor(func)
+    BalatrobotAPI.respond("Error: Action invalid for action " .. action[1] .. ", dropping the rest of the batch")
+    sendDebugMessage('Error: Action invalid for action ' .. action[1] .. ', dropping the rest of the batch')
+end
+
+function BalatrobotAPI.handleaction(data)
+    local _seq, _data = Utils.parseseq(data)
+
+    -- Untagged actions are always accepted, like before sequence numbers existed
+    if _seq and _seq ~= BalatrobotAPI.stateseq then
+        BalatrobotAPI.respond("Error: Stale action for decision " .. _seq)
+        sendDebugMessage('Error: Stale action for decision ' .. _seq)
+        return
+    elseif _seq and not BalatrobotAPI.waitingForAction then
+        -- Duplicate of the action we've already queued for this decision,
+        -- most likely resent because our ack went missing
+        sendDebugMessage('Dropping duplicate action for decision ' .. _seq)
+        BalatrobotAPI.ack(_seq)
+        return
+    end
+
+    local _batch = Utils.parsebatch(_data) or { nil }
+    local _action = _batch[1]
+    local _err = Utils.validateBatch(_batch)
+
+    if _err == Utils.ERROR.NUMPARAMS then
+        BalatrobotAPI.respond("Error: Incorrect number of params for action " .. _action[1])
+        sendDebugMessage('Error: Incorrect number of params for action ' .. _action[1])
+    elseif _err == Utils.ERROR.MSGFORMAT then
+        BalatrobotAPI.respond("Error: Incorrect message format. Should be ACTION|arg1|arg2")
+        sendDebugMessage('Error: Incorrect message format. Should be ACTION|arg1|arg2')
+    elseif _err == Utils.ERROR.INVALIDACTION then
+        BalatrobotAPI.respond("Error: Action invalid for action " .. _action[1])
+        sendDebugMessage('Error: Action invalid for action ' .. _action[1])
+    else
+        BalatrobotAPI.waitingForAction = false
+        for i = 1, #_batch do
+            BalatrobotAPI.queueaction(_batch[i])
+        end
+        BalatrobotAPI.ack(_seq)
+    end
+end
+
 function BalatrobotAPI.update(dt)
     if not BalatrobotAPI.socket then
         sendDebugMessage('new socket')
         BalatrobotAPI.socket = socket.udp()
         BalatrobotAPI.socket:settimeout(0)
         local port = arg[1] or BALATRO_BOT_CONFIG.port
-        BalatrobotAPI.socket:setsockname('127.0.0.1', tonumber('12347'))
+        BalatrobotAPI.socket:setsockname('127.0.0.1', tonumber(port))
     end
 
     data, msg_or_ip, port_or_nil = BalatrobotAPI.socket:receivefrom()
     if data then
-        if data == 'HELLO\n' or data == 'HELLO' then
+        if data:match('^HELLO') then
+            local _options = Utils.parsehello(data)
+            BalatrobotAPI.options = _options
+            BalatrobotAPI.fields = Utils.parsefields(_options)
+            if _options.push then
+                BalatrobotAPI.subscriber = { ip = msg_or_ip, port = port_or_nil }
+                BalatrobotAPI.pushpending = false
+            end
+            -- Whatever the client had, it's starting over from a keyframe
+            BalatrobotAPI.lastsent = nil
             BalatrobotAPI.notifyapiclient()
         else
-            local _action = Utils.parseaction(data)
-            local _err = Utils.validateAction(_action)
-
-            if _err == Utils.ERROR.NUMPARAMS then
-                BalatrobotAPI.respond("Error: Incorrect number of params for action " .. _action[1])
-                sendDebugMessage('Error: Incorrect number of params for action ' .. _action[1])
-            elseif _err == Utils.ERROR.MSGFORMAT then
-                BalatrobotAPI.respond("Error: Incorrect message format. Should be ACTION|arg1|arg2")
-                sendDebugMessage('Error: Incorrect message format. Should be ACTION|arg1|arg2')
-            elseif _err == Utils.ERROR.INVALIDACTION then
-                BalatrobotAPI.respond("Error: Action invalid for action " .. _action[1])
-                sendDebugMessage('Error: Action invalid for action ' .. _action[1])
-            else
-                BalatrobotAPI.waitingForAction = false
-                BalatrobotAPI.queueaction(_action)
-            end
+            BalatrobotAPI.handleaction(data)
         end
     elseif msg_or_ip ~= 'timeout' then
         sendDebugMessage("Unknown network error: " .. tostring(msg))
     end
 
+    BalatrobotAPI.pushtosubscriber()
+
     -- No idea if this is necessary
     -- Without this being commented out, FPS capped out at ~80 for me
     -- socket.sleep(0.01)
@@ -135,44 +297,34 @@ function BalatrobotAPI.init()
     sendDebugMessage('init api')
     if Bot.SETTINGS.api == true then
         Middleware.c_play_hand = Hook.addbreakpoint(Middleware.c_play_hand, function()
-            BalatrobotAPI.waitingFor = 'select_cards_from_hand'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('select_cards_from_hand')
         end)
         Middleware.c_select_blind = Hook.addbreakpoint(Middleware.c_select_blind, function()
-            BalatrobotAPI.waitingFor = 'skip_or_select_blind'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('skip_or_select_blind')
         end)
         Middleware.c_choose_booster_cards = Hook.addbreakpoint(Middleware.c_choose_booster_cards, function()
-            BalatrobotAPI.waitingFor = 'select_booster_action'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('select_booster_action')
         end)
         Middleware.c_shop = Hook.addbreakpoint(Middleware.c_shop, function()
-            BalatrobotAPI.waitingFor = 'select_shop_action'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('select_shop_action')
         end)
         -- Middleware.c_rearrange_hand = Hook.addbreakpoint(Middleware.c_rearrange_hand, function()
-        --     BalatrobotAPI.waitingFor = 'rearrange_hand'
-        --     BalatrobotAPI.waitingForAction = true
+        --     BalatrobotAPI.setwaitingfor('rearrange_hand')
         -- end)
         Middleware.c_rearrange_consumables = Hook.addbreakpoint(Middleware.c_rearrange_consumables, function()
-            BalatrobotAPI.waitingFor = 'rearrange_consumables'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('rearrange_consumables')
         end)
         Middleware.c_use_or_sell_consumables = Hook.addbreakpoint(Middleware.c_use_or_sell_consumables, function()
-            BalatrobotAPI.waitingFor = 'use_or_sell_consumables'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('use_or_sell_consumables')
         end)
         -- Middleware.c_rearrange_jokers = Hook.addbreakpoint(Middleware.c_rearrange_jokers, function()
-        --     BalatrobotAPI.waitingFor = 'rearrange_jokers'
-        --     BalatrobotAPI.waitingForAction = true
+        --     BalatrobotAPI.setwaitingfor('rearrange_jokers')
         -- end)
         -- Middleware.c_sell_jokers = Hook.addbreakpoint(Middleware.c_sell_jokers, function()
-        --     BalatrobotAPI.waitingFor = 'sell_jokers'
-        --     BalatrobotAPI.waitingForAction = true
+        --     BalatrobotAPI.setwaitingfor('sell_jokers')
         -- end)
         Middleware.c_start_run = Hook.addbreakpoint(Middleware.c_start_run, function()
-            BalatrobotAPI.waitingFor = 'start_run'
-            BalatrobotAPI.waitingForAction = true
+            BalatrobotAPI.setwaitingfor('start_run')
         end)
     end
 end
@@ -119,6 +119,12 @@ function Botlogger.init()
                             -- We don't care about action order for the API.
                             -- When the queue is populated, return the choice.
                         elseif Bot.SETTINGS.api == true then
+                            -- Anything after the first action of a batch was queued
+                            -- before the game got to it, so check it's still valid
+                            if not Bot.ACTIONPARAMS[_action[2][1]].isvalid(_action[2]) then
+                                BalatrobotAPI.abortbatch(k, _action[2])
+                                return
+                            end
                             return unpack(_action[2])
                         end
                     else
@@ -12,12 +12,42 @@ function Utils.getCardData(card)
     _card.card_key = card.config.card_key
 
     if card.ability then
-        -- _card.ability = card.ability
+        _card.ability = Utils.getAbilityData(card.ability)
     end
 
     return _card
 end
 
+-- Copies the plain data out of a card's ability table so it can be json encoded.
+-- Large gamestates are chunked by BalatrobotAPI.sendpayload, so there is no
+-- need to trim it down to just the set any more.
+function Utils.getAbilityData(ability, depth)
+    depth = depth or 0
+    local _ability = {}
+    if type(ability) ~= 'table' or depth > 3 then return _ability end
+
+    local _n = 0
+    for _ in pairs(ability) do _n = _n + 1 end
+    local _isarray = _n > 0 and _n == #ability
+
+    for k, v in pairs(ability) do
+        local _key = _isarray and k or tostring(k)
+        local _type = type(v)
+        if _type == 'table' then
+            _ability[_key] = Utils.getAbilityData(v, depth + 1)
+        elseif _type == 'number' then
+            -- json.encode can't represent NaN or inf
+            if v == v and v > -math.huge and v < math.huge then
+                _ability[_key] = v
+            end
+        elseif _type == 'string' or _type == 'boolean' then
+            _ability[_key] = v
+        end
+    end
+
+    return _ability
+end
+
 function Utils.getDeckData()
     local _deck = {}
 
@@ -28,7 +58,8 @@ function Utils.getDeckData()
             _card.name = G.deck.cards[i].config.card.name
             _card.suit = G.deck.cards[i].config.card.suit
             _card.value = G.deck.cards[i].config.card.value
-            _card.card_key = G.deck.cards[i].config.card.card_key
+            _card.card_key = G.deck.cards[i].config.card_key
+            _card.ability = Utils.getAbilityData(G.deck.cards[i].ability)
             _deck[i] = _card
         end
     end
@@ -49,6 +80,7 @@ function Utils.getHandData()
             _hand_card.suit = G.hand.cards[i].config.card.suit
             _hand_card.value = G.hand.cards[i].config.card.value
             _hand_card.card_key = G.hand.cards[i].config.card_key
+            _hand_card.ability = Utils.getAbilityData(G.hand.cards[i].ability)
             _hand[i] = _hand_card
         end
     end
@@ -62,17 +94,11 @@ function Utils.getPackCardsData()
     if G and G.pack_cards and G.pack_cards.cards then
         for i = 1, #G.pack_cards.cards do
             local _pack_card = {}
-            local _ability = {}
             _pack_card.label = G.pack_cards.cards[i].label
             _pack_card.name = G.pack_cards.cards[i].config.card.name
 
             -- this will allow us to determine if it is a tarot/planet/spectral card
-            -- we don't want the full ability data because that causes socket connection issues
-            if G.pack_cards.cards[i].ability then
-                _ability.set = G.pack_cards.cards[i].ability.set
-                _ability.max_highlighted = G.pack_cards.cards[i].ability.max_highlighted
-            end
-            _pack_card.ability = _ability
+            _pack_card.ability = Utils.getAbilityData(G.pack_cards.cards[i].ability)
             _pack[i] = _pack_card
         end
     end
@@ -91,6 +117,7 @@ function Utils.getJokersData()
             _card.cost = G.jokers.cards[i].cost
             _card.debuff = G.jokers.cards[i].debuff
             _card.name = G.jokers.cards[i].config.card.name
+            _card.ability = Utils.getAbilityData(G.jokers.cards[i].ability)
 
             _jokers[i] = _card
         end
@@ -105,17 +132,11 @@ function Utils.getConsumablesData()
     if G and G.consumeables and G.consumeables.cards then
         for i = 1, #G.consumeables.cards do
             local _consumable = {}
-            local _ability = {}
             _consumable.label = G.consumeables.cards[i].label
             _consumable.name = G.consumeables.cards[i].config.card.name
 
             -- this will allow us to determine if it is a tarot/planet/spectral card
-            -- we don't want the full ability data because that causes socket connection issues
-            if G.consumeables.cards[i].ability then
-                _ability.set = G.consumeables.cards[i].ability.set
-                _ability.max_highlighted = G.consumeables.cards[i].ability.max_highlighted
-            end
-            _consumable.ability = _ability
+            _consumable.ability = Utils.getAbilityData(G.consumeables.cards[i].ability)
             _consumables[i] = _consumable
         end
     end
@@ -158,6 +179,10 @@ function Utils.getAnteData()
     local _ante = {}
     _ante.blinds = Utils.getBlindData()
 
+    if G and G.GAME and G.GAME.round_resets then
+        _ante.ante = G.GAME.round_resets.ante
+    end
+
     return _ante
 end
 
@@ -254,27 +279,48 @@ function Utils.getTag(tag)
     return _tag
 end
 
-function Utils.getGamestate()
+-- fields is a set of the sections below to build, nil for all of them.
+-- The top level game data is always sent.
+function Utils.getGamestate(fields)
     -- TODO
     local _gamestate = {}
 
     _gamestate = Utils.getGameData()
 
     -- _gamestate.deckback = Utils.getBackData()
-    _gamestate.deck = Utils.getDeckData()
-    _gamestate.hand = Utils.getHandData()
-    _gamestate.jokers = Utils.getJokersData()
-    _gamestate.consumables = Utils.getConsumablesData()
-    _gamestate.ante = Utils.getAnteData()
-    _gamestate.shop = Utils.getShopData() -- Empty if not in shop phase
+    if not fields or fields.deck then _gamestate.deck = Utils.getDeckData() end
+    if not fields or fields.hand then _gamestate.hand = Utils.getHandData() end
+    if not fields or fields.jokers then _gamestate.jokers = Utils.getJokersData() end
+    if not fields or fields.consumables then _gamestate.consumables = Utils.getConsumablesData() end
+    if not fields or fields.ante then _gamestate.ante = Utils.getAnteData() end
+    if not fields or fields.shop then _gamestate.shop = Utils.getShopData() end -- Empty if not in shop phase
     -- _gamestate.handscores = Utils.getHandScoreData()
-    _gamestate.tags = Utils.getTagsData()
-    _gamestate.current_round = Utils.getRoundData()
-    _gamestate.pack_cards = Utils.getPackCardsData()
+    if not fields or fields.tags then _gamestate.tags = Utils.getTagsData() end
+    if not fields or fields.current_round then _gamestate.current_round = Utils.getRoundData() end
+    if not fields or fields.pack_cards then _gamestate.pack_cards = Utils.getPackCardsData() end
 
     return _gamestate
 end
 
+function Utils.parsefields(options)
+    -- HELLO|fields=hand,jokers sets the sections sent for every decision and
+    -- HELLO|fields.select_shop_action=shop,jokers the ones for one waitingFor
+    local _profile = {}
+
+    for k, v in pairs(options) do
+        local _waitingfor = k == 'fields' and 'default' or k:match('^fields%.(.+)$')
+        if _waitingfor then
+            local _fields = {}
+            for _field in tostring(v):gmatch('[^,]+') do
+                _fields[_field] = true
+            end
+            _profile[_waitingfor] = _fields
+        end
+    end
+
+    return _profile
+end
+
 function Utils.parseaction(data)
     -- Protocol is ACTION|arg1|arg2
     action = data:match("^([%a%u_]*)")
@@ -308,6 +354,178 @@ function Utils.parseaction(data)
     end
 end
 
+function Utils.parsebatch(data)
+    -- Several actions can be sent at once, ACTION|arg1|arg2;ACTION|arg1
+    local _batch = {}
+    for _data in data:gmatch("[^;]+") do
+        local _action = Utils.parseaction(_data)
+        if not _action then return nil end
+        _batch[#_batch + 1] = _action
+    end
+    if #_batch == 0 then return nil end
+    return _batch
+end
+
+function Utils.parseseq(data)
+    -- Actions may be tagged with the decision they answer, SEQ:ACTION|arg1|arg2
+    local _seq, _rest = data:match("^(%d+):(.*)$")
+    if _seq then
+        return tonumber(_seq), _rest
+    end
+    return nil, data
+end
+
+function Utils.parsehello(data)
+    -- Protocol is HELLO|option|key=value
+    local _options = {}
+    local params = data:match("|(.*)")
+
+    if params then
+        for _opt in params:gmatch("[^|%s]+") do
+            local _key, _value = _opt:match("^([%w_%.]+)=(.*)$")
+            if _key then
+                _options[_key] = tonumber(_value) or _value
+            else
+                _options[_opt] = true
+            end
+        end
+    end
+
+    return _options
+end
+
+-- Field-level delta between two gamestates, applied by delta.py on the Python
+-- side. Returns nil when nothing changed, otherwise a node that is one of
+--   { ["~"] = "o", set = {}, patch = {}, del = {} }  object fields
+--   { ["~"] = "l", n = len, set = {}, patch = {} }   list entries by position
+--   { ["~"] = "k", keys = {}, set = {}, patch = {} } card lists by card_key
+-- (a card list that was only cut short sends n = len instead of its keys)
+-- set holds replaced values and patch nested deltas. List positions are
+-- 1-based and sent as strings so json.encode doesn't see a sparse array.
+function Utils.diff(old, new)
+    local _oldkind = Utils.tablekind(old)
+    local _newkind = Utils.tablekind(new)
+
+    if _oldkind == 'o' and _newkind == 'o' then
+        return Utils.diffobject(old, new)
+    elseif _oldkind == 'k' and _newkind == 'k' then
+        return Utils.diffkeyed(old, new)
+    elseif _oldkind ~= 'o' and _newkind ~= 'o' then
+        return Utils.difflist(old, new)
+    end
+end
+
+function Utils.tablekind(t)
+    -- json.encode sends empty tables and tables with a [1] as arrays
+    if next(t) ~= nil and rawget(t, 1) == nil then return 'o' end
+    if #t == 0 then return 'l' end
+
+    for i = 1, #t do
+        if type(t[i]) ~= 'table' or type(t[i].card_key) ~= 'string' then return 'l' end
+    end
+    return 'k'
+end
+
+-- Sets _node.set[key] or _node.patch[key] if new differs from old.
+-- Returns true if it did.
+function Utils.diffvalue(_node, key, old, new)
+    if type(old) == 'table' and type(new) == 'table' and (Utils.tablekind(old) == 'o') == (Utils.tablekind(new) == 'o') then
+        local _delta = Utils.diff(old, new)
+        if not _delta then return false end
+        _node.patch[key] = _delta
+        return true
+    elseif old ~= new then
+        _node.set[key] = new
+        return true
+    end
+    return false
+end
+
+function Utils.diffnode(kind)
+    return { ['~'] = kind, set = {}, patch = {} }
+end
+
+-- json.encode would send an empty set or patch as [], drop them instead
+function Utils.trimnode(_node)
+    if next(_node.set) == nil then _node.set = nil end
+    if next(_node.patch) == nil then _node.patch = nil end
+    return _node
+end
+
+function Utils.diffobject(old, new)
+    local _node = Utils.diffnode('o')
+    local _changed = false
+
+    for k, v in pairs(new) do
+        _changed = Utils.diffvalue(_node, k, old[k], v) or _changed
+    end
+
+    for k, _ in pairs(old) do
+        if new[k] == nil then
+            _node.del = _node.del or {}
+            _node.del[#_node.del + 1] = k
+            _changed = true
+        end
+    end
+
+    if _changed then return Utils.trimnode(_node) end
+end
+
+function Utils.difflist(old, new)
+    local _node = Utils.diffnode('l')
+    _node.n = #new
+    local _changed = #old ~= #new
+
+    for i = 1, #new do
+        _changed = Utils.diffvalue(_node, tostring(i), old[i], new[i]) or _changed
+    end
+
+    if _changed then return Utils.trimnode(_node) end
+end
+
+function Utils.diffkeyed(old, new)
+    -- Entries are matched by card_key, duplicates in the order they appear,
+    -- so drawing or discarding only sends the new card order
+    local _node = Utils.diffnode('k')
+
+    -- Cards only drawn off the end of the list keep their order
+    local _truncated = #new < #old
+    local _reordered = #new > #old
+    local _keys = {}
+    for i = 1, #new do
+        _keys[i] = new[i].card_key
+        _reordered = _reordered or old[i].card_key ~= _keys[i]
+    end
+
+    local _pool = {}
+    for i = 1, #old do
+        local _key = old[i].card_key
+        _pool[_key] = _pool[_key] or { next = 1 }
+        table.insert(_pool[_key], old[i])
+    end
+
+    local _changed = false
+    for i = 1, #new do
+        local _matches = _pool[_keys[i]]
+        local _old = nil
+        if _matches and _matches.next <= #_matches then
+            _old = _matches[_matches.next]
+            _matches.next = _matches.next + 1
+        end
+        _changed = Utils.diffvalue(_node, tostring(i), _old, new[i]) or _changed
+    end
+
+    if not _reordered and not _truncated and not _changed then return nil end
+
+    -- Leave the order out when it's the same as before
+    if _reordered then
+        _node.keys = _keys
+    elseif _truncated then
+        _node.n = #new
+    end
+    return Utils.trimnode(_node)
+end
+
 Utils.ERROR = {
     NOERROR = 1,
     NUMPARAMS = 2,
@@ -329,6 +547,18 @@ function Utils.validateAction(action)
     return Utils.ERROR.NOERROR
 end
 
+function Utils.validateBatch(batch)
+    -- Only the first action can be checked against the game as it is now,
+    -- Botlogger checks the rest as the game gets to them
+    for i = 2, #batch do
+        if #batch[i] > 1 and #batch[i] > Bot.ACTIONPARAMS[batch[i][1]].num_args then
+            return Utils.ERROR.NUMPARAMS
+        end
+    end
+
+    return Utils.validateAction(batch[1])
+end
+
 function Utils.isTableUnique(table)
     if table == nil then return true end
 
@@ -0,0 +1,49 @@
+import re
+
+from jokers import jokers_dict, blinds_dict
+from balatro_objects import Canonical, CardSuits, canonical_form
+
+# Whether suits can be relabelled (balatro_objects.canonical_form) for the
+# caches of decisions, which unlike classifying a hand also depend on the
+# jokers and the blind. That's safe unless one of them names a suit: Greedy
+# Joker only pays for Diamonds, The Head debuffs Hearts, and so on.
+
+_SUIT_WORDS = re.compile(r"\b(Heart|Diamond|Spade|Club)s?\b")
+
+# Jokers that name every suit alike
+SYMMETRIC = {"Flower Pot"}
+
+SUIT_JOKERS = frozenset(name for name, description in jokers_dict.items() if _SUIT_WORDS.search(description)) - SYMMETRIC
+SUIT_BLINDS = frozenset(name for name, blind in blinds_dict.items() if _SUIT_WORDS.search(blind["description"]))
+
+
+def is_safe(G):
+    # Whether which suit is which doesn't matter with G's jokers and blind
+    blind = (G.get("ante") or {}).get("blinds", {}).get("name")
+    if blind in SUIT_BLINDS:
+        return False
+    return not any(joker["label"] in SUIT_JOKERS for joker in G.get("jokers") or [])
+
+
+def state_key(G, cards, hist=None, *extra):
+    # A cache key for a decision on the hand `cards` (and deck histogram),
+    # shared by suit-swapped states when that's safe, and the
+    # balatro_objects.Canonical to map positions in a cached answer back with
+    if is_safe(G):
+        canonical = canonical_form(cards, hist)
+    else:
+        # The cards as they are, only sorted
+        keys = [(card.card_key, bool(card.debuff)) for card in cards]
+        order = sorted(range(len(cards)), key=keys.__getitem__)
+        canonical = Canonical((tuple(keys[i] for i in order), hist), order, {suit.value: suit.value for suit in CardSuits})
+    return (canonical.key,) + extra, canonical
+
+
+def positions(canonical, cards):
+    # Card.index -> position in the canonical hand
+    return {cards[i].index: position for position, i in enumerate(canonical.order)}
+
+
+def indices(canonical, cards, picked):
+    # Positions in the canonical hand -> Card.index
+    return [cards[canonical.order[position]].index for position in picked]
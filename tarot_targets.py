@@ -0,0 +1,167 @@
+import time
+from itertools import combinations
+from collections import OrderedDict, namedtuple
+
+from balatro_objects import SUIT_IDS, intern_card
+from outs import histogram, p_flush
+
+# Picks the hand cards to use a tarot from a pack on. Every set of targets
+# the tarot allows is tried on the whole deck (G["hand"] plus G["deck"]),
+# and the result scored by the odds of a flush in a fresh hand drawn from
+# it (outs.p_flush, memoized on the histogram). Enhancements don't change
+# those odds, so they break ties by roughly what they add to a flush.
+#
+# Searches are cached on the hand signature (tarot, hand, rest of the deck),
+# so a pack with the same tarot twice, or a re-poll, doesn't search again.
+# Only the most recent SEARCH_CACHE_SIZE are kept.
+
+TarotEffect = namedtuple("TarotEffect", ["kind", "value", "min_targets", "max_targets"])
+TarotChoice = namedtuple("TarotChoice", ["pack_index", "targets", "p_flush", "gain"])
+
+# Roughly what each enhancement adds to a level 1 flush (about 80 chips x 4
+# mult) with the card in it. Steel only counts while held. Wild cards are
+# moved to the deck's biggest suit instead, as that's the flush they'll make.
+ENHANCEMENT_VALUE = {
+    "m_bonus": 120,
+    "m_mult": 320,
+    "m_glass": 240,
+    "m_lucky": 64,
+    "m_steel": 160,
+    "m_gold": 0,
+    "m_stone": 0,
+    "m_wild": 0,
+}
+
+# Tarots whose effect isn't in their consumeable data
+NAMED = {
+    "Strength": TarotEffect("rank_up", 1, 1, 2),
+    "Death": TarotEffect("copy", None, 2, 2),
+    "The Hanged Man": TarotEffect("destroy", None, 1, 2),
+}
+
+SEARCH_CACHE_SIZE = 1024
+
+_SEARCHES = OrderedDict()
+
+
+def tarot_effect(pack_card):
+    # What a tarot in G["pack_cards"] does to the cards it's used on, None
+    # if it doesn't take any
+    consumeable = pack_card.get("ability", {}).get("consumeable", {})
+    most = consumeable.get("max_highlighted")
+    if not most:
+        return None
+    # Strength and Death have a mod_conv too ("up_rank" and "card"), but
+    # it isn't an enhancement
+    if pack_card.get("label") in NAMED:
+        return NAMED[pack_card["label"]]
+    least = consumeable.get("min_highlighted", 1)
+    if consumeable.get("suit_conv"):
+        return TarotEffect("suit", consumeable["suit_conv"], least, most)
+    if consumeable.get("mod_conv"):
+        return TarotEffect("enhance", consumeable["mod_conv"], least, most)
+    if consumeable.get("remove_card"):
+        return TarotEffect("destroy", None, least, most)
+    return None
+
+
+def _apply(effect, hist, codes, targets):
+    # The deck histogram after using the tarot on hand positions `targets`
+    counts = [list(suit) for suit in hist]
+    if effect.kind == "copy":
+        # The left card becomes a copy of the right one
+        left, right = codes[targets[0]], codes[targets[-1]]
+        counts[left % 4][left // 4 - 2] -= 1
+        counts[right % 4][right // 4 - 2] += 1
+        return tuple(tuple(suit) for suit in counts)
+
+    biggest = max(range(4), key=lambda suit: sum(hist[suit]))
+    for target in targets:
+        code = codes[target]
+        suit, rank = code % 4, code // 4
+        counts[suit][rank - 2] -= 1
+        if effect.kind == "suit":
+            suit = SUIT_IDS[effect.value]
+        elif effect.kind == "enhance" and effect.value == "m_wild":
+            suit = biggest
+        elif effect.kind == "rank_up":
+            rank = 2 if rank == 14 else rank + 1
+        elif effect.kind == "destroy":
+            continue
+        counts[suit][rank - 2] += 1
+    return tuple(tuple(suit) for suit in counts)
+
+
+def _bonus(effect, hist, codes, targets):
+    # What an enhancement is worth on these cards, more so in the big suits
+    value = ENHANCEMENT_VALUE.get(effect.value, 0) if effect.kind == "enhance" else 0
+    if not value:
+        return 0
+    sizes = [sum(suit) for suit in hist]
+    bonus = 0
+    for target in targets:
+        share = sizes[codes[target] % 4] / max(sizes)
+        bonus += value * (1 - share if effect.value == "m_steel" else share)
+    return bonus
+
+
+def search(effect, codes, hist, hand_size, deadline=None):
+    # (best hand positions, p_flush, tie break) for the tarot, over every
+    # set of targets it allows, hist being the whole deck. Stops early at
+    # `deadline` (time.monotonic()), keeping the best found so far.
+    key = (effect, codes, hist, hand_size)
+    if key in _SEARCHES:
+        _SEARCHES.move_to_end(key)
+        return _SEARCHES[key]
+
+    best = None
+    seen = set()
+    complete = True
+    for size in range(effect.min_targets, min(effect.max_targets, len(codes)) + 1):
+        for targets in combinations(range(len(codes)), size):
+            if deadline is not None and time.monotonic() > deadline:
+                complete = False
+                break
+            # The same cards in other spots come to the same deck, except
+            # for Death, where which one is on the left matters
+            same = tuple(codes[target] for target in targets)
+            if effect.kind != "copy":
+                same = tuple(sorted(same))
+            if same in seen:
+                continue
+            seen.add(same)
+            after = _apply(effect, hist, codes, targets)
+            score = (p_flush(after, (), hand_size), _bonus(effect, hist, codes, targets))
+            if best is None or score > best[1:]:
+                best = (targets, *score)
+        if not complete:
+            break
+
+    if complete:
+        _SEARCHES[key] = best
+        if len(_SEARCHES) > SEARCH_CACHE_SIZE:
+            _SEARCHES.popitem(last=False)
+    return best
+
+
+def best_tarot(pack_cards, hand, deck, time_cap=0.05):
+    # The tarot in the pack, and the cards in G["hand"] to use it on, that
+    # improves the deck most. None if none of them help.
+    deadline = time.monotonic() + time_cap
+    codes = tuple(intern_card(card["card_key"]).code for card in hand)
+    hist = histogram(list(hand) + list(deck))
+    hand_size = len(hand)
+    before = p_flush(hist, (), hand_size)
+
+    choice, best = None, (0, 0)
+    for index, pack_card in enumerate(pack_cards):
+        effect = tarot_effect(pack_card)
+        if effect is None:
+            continue
+        found = search(effect, codes, hist, hand_size, deadline)
+        if found is None:
+            continue
+        targets, chance, bonus = found
+        if (chance - before, bonus) > best:
+            choice, best = TarotChoice(index, list(targets), chance, chance - before), (chance - before, bonus)
+    return choice
@@ -1,7 +1,47 @@
 import unittest
-from balatro_objects import Hand, Card
+import asyncio
+import json
+import os
+import sys
+import subprocess
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+from balatro_objects import Hand, HandAnalysis, Card, CardSuits, RANKINGS, HandCache, intern_card, card_codes, canonical_form
+from suit_canonical import state_key, indices, is_safe
+from best_plays import best_plays
+from scoring import score_plays, JokerEffect
+from batch_eval import evaluate_batch, classify_batch, DETECTORS
+from discards import evaluate_discards, deck_arrays
+from outs import CACHE_SIZE, after_discard, histogram, p_flush
+from deck_tracker import DeckTracker
+import tarot_targets
+from tarot_targets import best_tarot, tarot_effect
+from joker_order import OrderSearch, effective
+from joker_effects import EFFECTS, UNMODELLED, TABLE, INDEX, effects_for
+from hand_table import HandTable, classify, multisets
+from bot import Bot, Actions, FIELDS, GameStalled
+from transport import Reassembler, Sequencer, Session
+from delta import DeltaLost, Patcher, patch
+import bitser
+from bench import StandInServer, BenchBot
+from async_bot import AsyncBot
 
-class TestHandValidationMethods(unittest.TestCase):
+class CardsTestCase(unittest.TestCase):
+    # Tests that need a hand of Base Cards
+
+    def cards(self, values, suits, start=1):
+        return [
+            Card(suit=suit, label='Base Card', value=value, name=value + ' of ' + suit, debuff=False, card_key=suit[0] + '_' + value[0], index=index)
+            for index, (value, suit) in enumerate(zip(values, suits), start)
+        ]
+
+    def flush_draw(self):
+        # Four hearts and four clubs, nothing made yet
+        return self.cards(['2', '5', '9', 'King', '3', '4', '7', '8'], ['Hearts'] * 4 + ['Clubs'] * 4)
+
+class TestHandValidationMethods(CardsTestCase):
 
     def test_confirm_pair(self):
         card_1 = Card(suit='Hearts', label='Base Card', value='Ace', name='Ace of Hearts', debuff=False, card_key='H_A', index=0)
@@ -37,6 +77,27 @@ class TestHandValidationMethods(unittest.TestCase):
         hand = Hand(cards=[card_1, card_2, card_3, card_4, card_5, card_6])
         self.assertEqual(hand.get_straight(), [0,1,3,4,5])
 
+    def test_straight_ace_low(self):
+        card_1 = Card(suit='Hearts', label='Base Card', value='Ace', name='Ace of Hearts', debuff=False, card_key='H_A', index=0)
+        card_2 = Card(suit='Clubs', label='Base Card', value='2', name='2 of Clubs', debuff=False, card_key='C_2', index=1)
+        card_3 = Card(suit='Clubs', label='Base Card', value='3', name='3 of Clubs', debuff=False, card_key='C_3', index=2)
+        card_4 = Card(suit='Hearts', label='Base Card', value='4', name='4 of Hearts', debuff=False, card_key='H_4', index=3)
+        card_5 = Card(suit='Spades', label='Base Card', value='King', name='King of Spades', debuff=False, card_key='S_K', index=4)
+        card_6 = Card(suit='Diamonds', label='Base Card', value='5', name='5 of Diamonds', debuff=False, card_key='D_5', index=5)
+        hand = Hand(cards=[card_1, card_2, card_3, card_4, card_5, card_6])
+        self.assertEqual(hand.get_straight(), [0,1,2,3,5])
+
+    def test_straight_highest(self):
+        card_1 = Card(suit='Hearts', label='Base Card', value='5', name='5 of Hearts', debuff=False, card_key='H_5', index=0)
+        card_2 = Card(suit='Clubs', label='Base Card', value='6', name='6 of Clubs', debuff=False, card_key='C_6', index=1)
+        card_3 = Card(suit='Clubs', label='Base Card', value='7', name='7 of Clubs', debuff=False, card_key='C_7', index=2)
+        card_4 = Card(suit='Hearts', label='Base Card', value='8', name='8 of Hearts', debuff=False, card_key='H_8', index=3)
+        card_5 = Card(suit='Spades', label='Base Card', value='9', name='9 of Spades', debuff=False, card_key='S_9', index=4)
+        card_6 = Card(suit='Diamonds', label='Base Card', value='10', name='10 of Diamonds', debuff=False, card_key='D_10', index=5)
+        card_7 = Card(suit='Diamonds', label='Base Card', value='6', name='6 of Diamonds', debuff=False, card_key='D_6', index=6)
+        hand = Hand(cards=[card_1, card_2, card_3, card_4, card_5, card_6, card_7])
+        self.assertEqual(hand.get_straight(), [1,2,3,4,5])
+
     def test_flush(self):
         card_1 = Card(suit='Hearts', label='Base Card', value='Five', name='Five of Hearts', debuff=False, card_key='H_5', index=0)
         card_2 = Card(suit='Hearts', label='Base Card', value='Queen', name='Queen of Hearts', debuff=False, card_key='H_Q', index=1)
@@ -96,5 +157,700 @@ class TestHandValidationMethods(unittest.TestCase):
         hand = Hand(cards=[card_1, card_2, card_3, card_4, card_5, card_6, card_7])
         self.assertEqual(hand.get_royal_flush(), [0,1,2,3,4])
 
+    def test_hand_analysis(self):
+        card_1 = Card(suit='Hearts', label='Base Card', value='5', name='5 of Hearts', debuff=False, card_key='H_5', index=0)
+        card_2 = Card(suit='Clubs', label='Base Card', value='King', name='King of Clubs', debuff=True, card_key='C_K', index=1)
+        card_3 = Card(suit='Hearts', label='Base Card', value='King', name='King of Hearts', debuff=False, card_key='H_K', index=2)
+        hand = Hand(cards=[card_1, card_2, card_3])
+        self.assertEqual(hand.analysis.suit_counts, {'Hearts': 2, 'Clubs': 1})
+        self.assertEqual(hand.analysis.live_suit_counts, {'Hearts': 2})
+        self.assertEqual(hand.analysis.live_value_counts, {'5': 1, 'King': 1})
+        self.assertEqual([card.index for card in hand.analysis.cards_by_suit['Hearts']], [2, 0])
+        self.assertEqual([card.index for card in hand.analysis.cards_by_value['King']], [1, 2])
+        self.assertEqual(hand.suit_check(), {'Hearts': 2, 'Clubs': 0, 'Spades': 0, 'Diamonds': 0})
+
+    def test_hand_update(self):
+        values = ['5', 'King', 'King', '9', 'Ace', '2', '7', '3']
+        suits = ['Hearts', 'Clubs', 'Hearts', 'Spades', 'Clubs', 'Hearts', 'Diamonds', 'Clubs']
+        cards = self.cards(values, suits, start=0)
+        cards[3].debuff = True
+        hand = Hand(cards=cards[:6])
+        hand.analysis
+        # Discard the first King and the 5, draw the 7 and 3
+        hand.update([cards[1]], [cards[6]])
+        hand.update([cards[0]], [cards[7]])
+        fresh = HandAnalysis(cards[2:8])
+        self.assertEqual(hand.cards, cards[2:8])
+        self.assertEqual(list(hand.analysis.suit_counts.items()), list(fresh.suit_counts.items()))
+        self.assertEqual(list(hand.analysis.live_value_counts.items()), list(fresh.live_value_counts.items()))
+        self.assertEqual(hand.analysis.cards_by_suit, fresh.cards_by_suit)
+        self.assertEqual(hand.analysis.ascending, fresh.ascending)
+        self.assertEqual(list(hand.analysis.suit_rank_masks.items()), list(fresh.suit_rank_masks.items()))
+        self.assertEqual(hand.analysis.rank_mask, fresh.rank_mask)
+        self.assertEqual(hand.get_straight(), [])
+        # Changing most of the hand at once analyses it again
+        hand.update(cards[2:6], cards[:4])
+        self.assertEqual(hand.analysis.cards_by_value, HandAnalysis(cards[6:8] + cards[:4]).cards_by_value)
+
+    def test_hand_cache(self):
+        card_1 = Card(suit='Hearts', label='Base Card', value='Ace', name='Ace of Hearts', debuff=False, card_key='H_A', index=0)
+        card_2 = Card(suit='Clubs', label='Base Card', value='King', name='King of Clubs', debuff=False, card_key='C_K', index=1)
+        card_3 = Card(suit='Clubs', label='Base Card', value='Ace', name='Ace of Clubs', debuff=False, card_key='C_A', index=2)
+        cache = HandCache(capacity=1)
+        self.assertEqual(Hand(cards=[card_1, card_2, card_3]).classify(cache)['pair'], [0, 2])
+        # Same cards in another order and at other indexes come from the cache
+        card_1.index, card_3.index = 5, 4
+        hands = Hand(cards=[card_3, card_2, card_1]).classify(cache)
+        self.assertEqual(hands['pair'], [4, 5])
+        self.assertEqual(hands['flush'], [])
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 1, 0))
+        # A debuffed card is a different hand, and pushes the first one out
+        card_2.debuff = True
+        Hand(cards=[card_1, card_2, card_3]).classify(cache)
+        self.assertEqual(cache.stats(), {'size': 1, 'capacity': 1, 'hits': 1, 'misses': 2, 'evictions': 1})
+
+    def test_canonical_form(self):
+        hearts = [
+            Card(suit='Hearts', label='Base Card', value=value, name=value + ' of Hearts', debuff=False, card_key='H_' + value[0], index=index)
+            for index, value in enumerate(['King', '9', '4'])
+        ]
+        clubs = [
+            Card(suit='Clubs', label='Base Card', value=value, name=value + ' of Clubs', debuff=False, card_key='C_' + value[0], index=index)
+            for index, value in enumerate(['4', 'King', '9'])
+        ]
+        spade = Card(suit='Spades', label='Base Card', value='2', name='2 of Spades', debuff=False, card_key='S_2', index=3)
+        diamond = Card(suit='Diamonds', label='Base Card', value='2', name='2 of Diamonds', debuff=False, card_key='D_2', index=3)
+        first, second = canonical_form(hearts + [spade]), canonical_form(clubs + [diamond])
+        self.assertEqual(first.key, second.key)
+        self.assertEqual(first.suits['Hearts'], second.suits['Clubs'])
+        # The same hand with the suits swapped comes from the cache, with the
+        # indexes of its own cards
+        cache = HandCache()
+        Hand(cards=hearts + [spade]).classify(cache)
+        self.assertEqual(Hand(cards=clubs + [diamond]).classify(cache)['pair'], [])
+        self.assertEqual(cache.hits, 1)
+        # Kings at position 0 of one hand and 1 of the other
+        picked = [first.order.index(0)]
+        self.assertEqual(indices(second, clubs + [diamond], picked), [1])
+        # A deck with more spades than diamonds tells the 2s apart
+        hist = ((0,) * 13, (1,) * 13, (0,) * 13, (0,) * 13)
+        self.assertNotEqual(canonical_form(hearts + [spade], hist).key, canonical_form(hearts + [diamond], hist).key)
+        # Not with a joker that cares about Hearts
+        key, _ = state_key({'jokers': []}, hearts)
+        self.assertEqual(key, state_key({'jokers': []}, clubs)[0])
+        self.assertNotEqual(state_key({'jokers': [{'label': 'Lusty Joker'}]}, hearts)[0], state_key({'jokers': [{'label': 'Lusty Joker'}]}, clubs)[0])
+        self.assertFalse(is_safe({'ante': {'blinds': {'name': 'The Head'}}}))
+        self.assertTrue(is_safe({'jokers': [{'label': 'Flower Pot'}]}))
+
+    def test_card_codes(self):
+        card = Card(suit='Hearts', label='Base Card', value='10', name='10 of Hearts', debuff=False, card_key='H_T', index=1)
+        self.assertEqual((card.rank, card.suit_id, card.code), (10, 2, 42))
+        self.assertIs(intern_card('H_T'), intern_card('H_T'))
+        self.assertEqual(intern_card('H_T').code, card.code)
+        self.assertEqual(list(card_codes([{'card_key': 'H_T'}, {'card_key': 'C_A'}])), [42, 56])
+
+class TestBestPlays(CardsTestCase):
+
+    def test_best_plays(self):
+        values = ['Ace', 'Ace', '10', '9', '8', '7', '6', '2']
+        suits = ['Clubs', 'Spades', 'Hearts', 'Hearts', 'Hearts', 'Hearts', 'Spades', 'Hearts']
+        cards = self.cards(values, suits)
+        plays = best_plays(cards, k=3)
+        # Flush 35 + 10 + 9 + 8 + 7 + 2 chips x 4 beats the straight and the pair of aces
+        self.assertEqual(plays[0], (284, 'Flush', 71, 4, [3, 4, 5, 6, 8]))
+        self.assertEqual(plays[1], (280, 'Straight', 70, 4, [3, 4, 5, 6, 7]))
+        self.assertEqual(plays[2].category, 'Pair')
+
+class TestScoring(unittest.TestCase):
+
+    def test_score_plays(self):
+        card_1 = Card(suit='Hearts', label='Base Card', value='King', name='King of Hearts', debuff=False, card_key='H_K', index=1)
+        card_2 = Card(suit='Clubs', label='Base Card', value='King', name='King of Clubs', debuff=False, card_key='C_K', index=2)
+        card_3 = Card(suit='Hearts', label='Base Card', value='4', name='4 of Hearts', debuff=False, card_key='H_4', index=3)
+        jokers = [
+            JokerEffect('Jolly Joker', 'hand', 0, 8, 1, ('contains', 'Pair')),
+            JokerEffect('Lusty Joker', 'card', 0, 3, 1, ('suits', (2,))),
+            JokerEffect('Cavendish', 'hand', 0, 0, 3, None),
+        ]
+        scores = score_plays([[card_1, card_2, card_3], [card_3]], levels={'Pair': 2}, jokers=jokers)
+        # Pair at level 2 is 25 chips x 3 mult, the 4 doesn't score
+        # (25 + 10 + 10) x (3 + 8 + 3) x 3
+        self.assertEqual(scores[0], 45 * 14 * 3)
+        # (5 + 4) x (1 + 3) x 3
+        self.assertEqual(scores[1], 9 * 4 * 3)
+        card_2.debuff = True
+        self.assertEqual(score_plays([[card_1, card_2]])[0], (10 + 10) * 2)
+
+    def test_joker_effects(self):
+        self.assertEqual(EFFECTS['Jolly Joker'], ('Jolly Joker', 'hand', 0, 8, 1, ('contains', 'Pair'), 0))
+        self.assertEqual(EFFECTS['Scholar'], ('Scholar', 'card', 20, 4, 1, ('ranks', (14,)), 0))
+        self.assertEqual(EFFECTS['Hack'].retriggers, 1)
+        self.assertIn('Blueprint', UNMODELLED)
+        self.assertFalse(TABLE[INDEX['Blueprint']]['modelled'])
+        self.assertEqual(TABLE[INDEX['The Duo']]['xmult'], 2)
+
+        effects, unmodelled = effects_for([{'label': 'Sock and Buskin'}, {'label': 'Blueprint'}, {'label': 'Joker', 'debuff': True}])
+        self.assertEqual([effect.name for effect in effects], ['Sock and Buskin'])
+        self.assertEqual(unmodelled, ['Blueprint'])
+        king = Card(suit='Hearts', label='Base Card', value='King', name='King of Hearts', debuff=False, card_key='H_K', index=1)
+        # The King scores twice: (5 + 10 + 10) x 1
+        self.assertEqual(score_plays([[king]], jokers=effects)[0], 25)
+
+class TestBatchEval(unittest.TestCase):
+
+    def test_evaluate_batch(self):
+        # A 5-high straight scores more chips than a 6-high one
+        ranks = np.array([[14, 2, 3, 4, 5, 6, 13, 13], [9, 9, 9, 4, 4, 2, 0, 0]])
+        suits = np.array([[0, 1, 2, 3, 0, 1, 2, 3], [0, 1, 2, 3, 0, 1, -1, -1]])
+        result = evaluate_batch(ranks, suits)
+        self.assertEqual(list(result.score), [(30 + 11 + 2 + 3 + 4 + 5) * 4, (40 + 27 + 8) * 4])
+
+    def test_classify_batch(self):
+        rng = np.random.default_rng(3)
+        # Two decks' worth, so there are fives of a kind and flush houses too
+        codes = np.stack([rng.choice(np.repeat(np.arange(8, 60), 2), 8, replace=False) for _ in range(200)])
+        result = classify_batch(codes)
+        for row, picks in zip(codes, result.picks):
+            suits = [suit.value for suit in CardSuits]
+            cards = [
+                Card(suits[code % 4], 'Base Card', RANKINGS[code // 4].name.capitalize(), str(code), False, str(code), index)
+                for index, code in enumerate(map(int, row))
+            ]
+            hand = Hand(cards)
+            for detector, picked in zip(DETECTORS[:-1], picks):
+                self.assertEqual(sorted(getattr(hand, 'get_' + detector)()), list(np.nonzero(picked)[0]))
+        # A pair of Kings with an Ace: 10 + 20 chips x 2 mult
+        result = classify_batch([[13 * 4, 13 * 4 + 1, 14 * 4, 0, 0]])
+        self.assertEqual(DETECTORS[result.category[0]], 'pair')
+        self.assertEqual(list(result.best[0]), [True, True, False, False, False])
+        self.assertEqual(result.score[0], 60)
+
+class TestDiscards(CardsTestCase):
+
+    def test_evaluate_discards(self):
+        hand = self.flush_draw()
+        # Only hearts left to draw, so keeping the hearts always makes a flush
+        deck = [{'card_key': 'H_' + key} for key in 'TJQA6']
+        keep_hearts, keep_clubs = evaluate_discards(hand, deck_arrays(deck), [[5, 6, 7, 8], [1, 2, 3, 4]], samples=100, rng=np.random.default_rng(1))
+        self.assertEqual((keep_hearts.p_flush_or_better, keep_hearts.samples), (1.0, 100))
+        self.assertEqual(keep_clubs.p_flush_or_better, 0.0)
+        # One heart in eight: one discard finds it half the time, a second
+        # always does, however many hands are left to play
+        deck = [{'card_key': 'H_T'}] + [{'card_key': 'S_' + key} for key in '2345678']
+        once, = evaluate_discards(hand, deck_arrays(deck), [[5, 6, 7, 8]], discards_left=1, samples=400, rng=np.random.default_rng(1))
+        self.assertAlmostEqual(once.p_flush_or_better, 0.5, delta=0.1)
+        twice, = evaluate_discards(hand, deck_arrays(deck), [[5, 6, 7, 8]], discards_left=2, samples=100, rng=np.random.default_rng(1))
+        self.assertEqual(twice.p_flush_or_better, 1.0)
+
+class TestOuts(CardsTestCase):
+
+    def test_outs(self):
+        hand = self.flush_draw()
+        deck = [{'card_key': key} for key in ('D_5', 'S_6', 'D_Q', 'H_T')]
+        # Keeping the hearts and drawing the whole deck always finds the 10
+        self.assertEqual(after_discard(hand, histogram(deck), [5, 6, 7, 8]).flush, 1.0)
+        # Keeping 3 4 7 8 and drawing the whole deck always finds the 5 and 6
+        self.assertEqual(after_discard(hand, histogram(deck), [1, 2, 3, 4]), (0.0, 1.0, 0.0))
+        # Throwing the King away for one card, only the 6 makes a straight
+        self.assertEqual(after_discard(hand, histogram(deck), [4]).straight, 1 / 4)
+        # Asking again is answered from the memo table
+        hits = p_flush.cache_info().hits
+        after_discard(hand, histogram(deck), [4])
+        self.assertEqual(p_flush.cache_info().hits, hits + 1)
+        self.assertEqual(p_flush.cache_info().maxsize, CACHE_SIZE)
+
+class TestDeckTracker(unittest.TestCase):
+
+    def test_deck_tracker(self):
+        cards = [{'card_key': key, 'ability': {'name': 'Default Base'}} for key in ('H_2', 'H_3', 'S_4', 'C_5', 'D_6', 'D_7')]
+        cards[0]['ability'] = {'name': 'Glass Card'}
+        tracker = DeckTracker()
+        tracker.update({'deck': cards[2:], 'hand': cards[:2]})
+        self.assertEqual(tracker.histogram(), histogram(cards[2:]))
+        # Play the hand and draw two, the counts follow without a resync
+        tracker.update({'deck': cards[4:], 'hand': cards[2:4]})
+        self.assertEqual(tracker.histogram(), histogram(cards[4:]))
+        self.assertEqual((tracker.updates, tracker.resyncs), (1, 1))
+        # A new round puts everything back in the deck
+        tracker.update({'deck': cards[1:], 'hand': cards[:1]})
+        self.assertEqual(tracker.resyncs, 2)
+        self.assertEqual(tracker.enhancements, {'Default Base': 5})
+        self.assertEqual(sorted(tracker.arrays()[0]), [3, 4, 5, 6, 7])
+
+class TestJokerOrder(unittest.TestCase):
+
+    def test_joker_order(self):
+        card_1 = Card(suit='Spades', label='Base Card', value='Queen', name='Queen of Spades', debuff=False, card_key='S_Q', index=1)
+        card_2 = Card(suit='Clubs', label='Base Card', value='Queen', name='Queen of Clubs', debuff=False, card_key='C_Q', index=2)
+        search = OrderSearch([[card_1, card_2]])
+        # +4 Mult before X3: (10 + 20) x (2 + 4) x 3
+        self.assertEqual(search.best_order(['Cavendish', 'Joker']), ([1, 0], 540))
+        self.assertEqual(search.score(['Cavendish', 'Joker']), 30 * (2 * 3 + 4))
+        # Blueprint is only worth something to the left of Cavendish
+        order, score = search.best_order(['Blueprint', 'Joker', 'Cavendish'])
+        self.assertEqual((order, score), ([1, 0, 2], 30 * 6 * 9))
+        self.assertEqual([effect.name for effect in effective(['Cavendish', 'Brainstorm'])], ['Cavendish', 'Cavendish'])
+
+class TestTarotTargets(unittest.TestCase):
+
+    def test_best_tarot(self):
+        hand = [{'card_key': key} for key in ('H_2', 'H_5', 'H_9', 'H_K', 'S_3', 'C_7', 'D_J', 'S_Q')]
+        deck = [{'card_key': suit + '_' + value} for suit in 'HSCD' for value in '234' if suit + '_' + value not in ('H_2', 'S_3')]
+        sun = {'label': 'The Sun', 'ability': {'set': 'Tarot', 'consumeable': {'suit_conv': 'Hearts', 'max_highlighted': 3}}}
+        empress = {'label': 'The Empress', 'ability': {'set': 'Tarot', 'consumeable': {'mod_conv': 'm_mult', 'max_highlighted': 2}}}
+        hermit = {'label': 'The Hermit', 'ability': {'set': 'Tarot', 'consumeable': {'extra': 20}}}
+        self.assertIsNone(tarot_effect(hermit))
+        choice = best_tarot([hermit, empress, sun], hand, deck)
+        # Three more hearts, whichever three
+        self.assertEqual(choice.pack_index, 2)
+        self.assertEqual(len(choice.targets), 3)
+        self.assertTrue(all(not hand[target]['card_key'].startswith('H') for target in choice.targets))
+        self.assertGreater(choice.gain, 0)
+        # The Empress goes on the hearts, and searches are cached
+        choice = best_tarot([empress], hand, deck)
+        self.assertTrue(all(hand[target]['card_key'].startswith('H') for target in choice.targets))
+        self.assertEqual(best_tarot([empress], hand, deck, time_cap=0), choice)
+        # Consumeable data as the game has it for the ones that aren't what
+        # they look like
+        strength = {'label': 'Strength', 'ability': {'set': 'Tarot', 'consumeable': {'mod_conv': 'up_rank', 'max_highlighted': 2}}}
+        death = {'label': 'Death', 'ability': {'set': 'Tarot', 'consumeable': {'mod_conv': 'card', 'max_highlighted': 2, 'min_highlighted': 2}}}
+        hanged_man = {'label': 'The Hanged Man', 'ability': {'set': 'Tarot', 'consumeable': {'remove_card': True, 'max_highlighted': 2}}}
+        self.assertEqual(tarot_effect(strength).kind, 'rank_up')
+        self.assertEqual(tarot_effect(death).kind, 'copy')
+        self.assertEqual(tarot_effect(hanged_man).kind, 'destroy')
+        # Only the most recent searches are kept
+        with mock.patch.object(tarot_targets, 'SEARCH_CACHE_SIZE', 2):
+            for tarot in (sun, strength, hanged_man):
+                best_tarot([tarot], hand, deck)
+            self.assertEqual([key[0].kind for key in tarot_targets._SEARCHES], ['rank_up', 'destroy'])
+        # Death turns a card of another suit into a copy of a heart to its right
+        hand = hand[::-1]
+        left, right = best_tarot([death], hand, deck).targets
+        self.assertFalse(hand[left]['card_key'].startswith('H'))
+        self.assertTrue(hand[right]['card_key'].startswith('H'))
+
+class TestHandTable(unittest.TestCase):
+
+    def test_lookup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            table = HandTable(os.path.join(directory, 'hands.bin'))
+            self.assertEqual(table.lookup([14, 13, 12, 11, 10], flush=True), ('Royal Flush', 100, 8))
+            self.assertEqual(table.lookup([5, 14, 3, 2, 4]), ('Straight', 30, 4))
+            self.assertEqual(table.lookup([9, 4, 9]), ('Pair', 10, 2))
+            # Every entry agrees with classify, and a second table loads the same file
+            for k in range(1, 6):
+                for ranks in multisets(k):
+                    self.assertEqual(table.category(ranks, flush=True), classify(ranks, flush=True))
+                    self.assertEqual(table.category(ranks), classify(ranks))
+            table.close()
+            other = HandTable(table.path)
+            self.assertEqual(other.lookup([7, 7, 4, 4, 7], flush=True), ('Flush House', 140, 14))
+            other.close()
+
+class TestSequencer(unittest.TestCase):
+
+    def test_duplicate_decisions(self):
+        sequencer = Sequencer()
+        self.assertTrue(sequencer.isfresh({'seq': 3}))
+        self.assertEqual(sequencer.tag('PLAY_HAND|1,2'), '3:PLAY_HAND|1,2')
+        # The same decision again (a HELLO reply racing the push) is dropped,
+        # the next one isn't
+        self.assertFalse(sequencer.isfresh({'seq': 3}))
+        self.assertFalse(sequencer.isfresh({'seq': 2}))
+        self.assertTrue(sequencer.isfresh({'seq': 4}))
+        # Without sequence numbers everything is fresh and nothing is tagged
+        sequencer = Sequencer()
+        self.assertTrue(sequencer.isfresh({}))
+        self.assertEqual(sequencer.tag('END_SHOP'), 'END_SHOP')
+        self.assertTrue(sequencer.isfresh({}))
+
+    def test_rejection_expiry(self):
+        sequencer = Sequencer()
+        sequencer.isfresh({'seq': 7})
+        sequencer.tag('DISCARD_HAND|1')
+        # Someone else's decision turned down isn't ours to retry
+        self.assertFalse(sequencer.rejected({'response': 'Error', 'seq': 6}))
+        self.assertFalse(sequencer.isfresh({'seq': 7}))
+        # Ours is, and the same decision can be acted on again
+        self.assertTrue(sequencer.rejected({'response': 'Error', 'seq': 7}))
+        self.assertIsNone(sequencer.unacked)
+        self.assertTrue(sequencer.isfresh({'seq': 7}))
+        self.assertEqual(sequencer.tag('DISCARD_HAND|2'), '7:DISCARD_HAND|2')
+        # A timeout expires it the same way
+        sequencer.expire()
+        self.assertTrue(sequencer.isfresh({'seq': 7}))
+
+    def test_game_restart(self):
+        sequencer = Sequencer()
+        sequencer.isfresh({'seq': 40, 'epoch': 100})
+        sequencer.tag('PLAY_HAND|1')
+        self.assertFalse(sequencer.isfresh({'seq': 40, 'epoch': 100}))
+        # The restarted game counts from 0 again
+        self.assertTrue(sequencer.isfresh({'seq': 1, 'epoch': 250}))
+        self.assertIsNone(sequencer.unacked)
+        self.assertEqual(sequencer.tag('START_RUN|1'), '1:START_RUN|1')
+        self.assertFalse(sequencer.isfresh({'seq': 1, 'epoch': 250}))
+        # An error from the old game isn't about this decision
+        self.assertFalse(sequencer.rejected({'response': 'Error', 'seq': 1, 'epoch': 100}))
+        self.assertTrue(sequencer.rejected({'response': 'Error', 'seq': 1, 'epoch': 250}))
+
+    def test_retransmit_schedule(self):
+        now = [0.0]
+        sequencer = Sequencer(retries=3, backoff=0.25, clock=lambda: now[0])
+        sequencer.isfresh({'seq': 1})
+        sequencer.tag('PLAY_HAND|1')
+        self.assertIsNone(sequencer.retransmit())
+        self.assertEqual(sequencer.until_retransmit(), 0.25)
+        # Sent again after 0.25s, then 0.5s, then 1s after that, then given up
+        sent = []
+        for step in range(40):
+            now[0] = step * 0.125
+            if sequencer.retransmit() is not None:
+                sent.append(now[0])
+        self.assertEqual(sent, [0.25, 0.75, 1.75])
+        self.assertIsNone(sequencer.unacked)
+
+    def test_ack(self):
+        now = [0.0]
+        sequencer = Sequencer(clock=lambda: now[0])
+        sequencer.isfresh({'seq': 2})
+        sequencer.tag('DISCARD_HAND|1')
+        self.assertTrue(sequencer.isack(b'{"ack":2}'))
+        self.assertFalse(sequencer.isack(b'{"hand":[]}'))
+        # An ack for an older action doesn't count
+        sequencer.acked(b'{"ack":1}')
+        now[0] = 0.25
+        self.assertEqual(sequencer.retransmit(), '2:DISCARD_HAND|1')
+        sequencer.acked(b'{"ack":2}')
+        now[0] = 10
+        self.assertIsNone(sequencer.retransmit())
+        # The game moving on to the next decision counts as an ack too
+        sequencer.isfresh({'seq': 3})
+        sequencer.tag('END_SHOP')
+        sequencer.isfresh({'seq': 4})
+        now[0] = 20
+        self.assertIsNone(sequencer.retransmit())
+
+
+class TestReassembler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.reassembler = Reassembler(timeout=0.5, clock=lambda: self.now)
+
+    def test_out_of_order_and_duplicates(self):
+        self.assertTrue(self.reassembler.ischunk(b'CHUNK|1|2|3|b'))
+        self.assertFalse(self.reassembler.ischunk(b'{"hand": []}'))
+        self.assertIsNone(self.reassembler.add(b'CHUNK|1|2|3|"b|'))
+        self.assertTrue(self.reassembler.pending)
+        # A repeated chunk is only counted once
+        self.assertIsNone(self.reassembler.add(b'CHUNK|1|2|3|"b|'))
+        self.assertIsNone(self.reassembler.add(b'CHUNK|1|1|3|{"a":'))
+        self.assertEqual(self.reassembler.add(b'CHUNK|1|3|3|"}'), b'{"a":"b|"}')
+        self.assertFalse(self.reassembler.pending)
+
+    def test_chunk_timeout(self):
+        self.reassembler.add(b'CHUNK|4|1|2|{"a":')
+        self.now = 0.3
+        self.assertAlmostEqual(self.reassembler.remaining(), 0.2)
+        self.assertFalse(self.reassembler.expired())
+        self.now = 0.5
+        self.assertTrue(self.reassembler.expired())
+        self.assertFalse(self.reassembler.pending)
+        # The rest turning up late starts over rather than completing
+        self.assertIsNone(self.reassembler.add(b'CHUNK|4|2|2|1}'))
+        self.assertTrue(self.reassembler.pending)
+
+    def test_newer_message(self):
+        # A newer msgid means a chunk of the one in flight was lost
+        self.reassembler.add(b'CHUNK|5|1|2|{"a":')
+        self.assertIsNone(self.reassembler.add(b'CHUNK|6|2|2|2}'))
+        self.assertEqual(self.reassembler.add(b'CHUNK|6|1|2|{"b":'), b'{"b":2}')
+
+
+class TestDelta(unittest.TestCase):
+    # Nodes as Utils.diff in src/utils.lua builds them
+
+    def card(self, card_key, **fields):
+        return dict({'card_key': card_key, 'debuff': False}, **fields)
+
+    def test_keyed_duplicates(self):
+        old = [self.card('H_2', seal='Red'), self.card('S_K'), self.card('H_2')]
+        # The King moves to the end and is debuffed. Duplicates are matched in
+        # the order they appear, so the 2 of Hearts with the seal stays first.
+        node = {'~': 'k', 'keys': ['H_2', 'H_2', 'S_K'], 'patch': {'3': {'~': 'o', 'set': {'debuff': True}}}}
+        new = patch(old, node)
+        self.assertEqual(new, [self.card('H_2', seal='Red'), self.card('H_2'), self.card('S_K', debuff=True)])
+        self.assertIs(new[0], old[0])
+        self.assertIs(new[1], old[2])
+        self.assertEqual(old[1], self.card('S_K'))
+        # A new copy of a card already there is sent whole
+        node = {'~': 'k', 'keys': ['H_2', 'H_2', 'H_2'], 'set': {'3': self.card('H_2', edition='Foil')}}
+        new = patch(old, node)
+        self.assertEqual(new[2], self.card('H_2', edition='Foil'))
+        self.assertIs(new[1], old[2])
+
+    def test_keyed_truncation(self):
+        old = [self.card('H_2'), self.card('S_K'), self.card('D_A')]
+        new = patch(old, {'~': 'k', 'n': 1})
+        self.assertEqual(new, [self.card('H_2')])
+        self.assertIs(new[0], old[0])
+        # Only a change, the order is left out
+        new = patch(old, {'~': 'k', 'patch': {'2': {'~': 'o', 'del': ['debuff']}}})
+        self.assertEqual(new, [self.card('H_2'), {'card_key': 'S_K'}, self.card('D_A')])
+
+    def test_list_and_object(self):
+        old = {'hand': [1, 2, 3], 'round': {'hands_left': 4, 'discards_left': 3}, 'shop': {'jokers': []}}
+        node = {'~': 'o',
+                'patch': {'hand': {'~': 'l', 'n': 4, 'set': {'2': 5, '4': 6}}},
+                'set': {'round': [], 'blind': {'chips': 300}},
+                'del': ['shop']}
+        new = patch(old, node)
+        self.assertEqual(new, {'hand': [1, 5, 3, 6], 'round': [], 'blind': {'chips': 300}})
+        self.assertEqual(old['hand'], [1, 2, 3])
+        # A list turning into an object and back is set whole, not patched
+        new = patch(new, {'~': 'o', 'set': {'round': {'hands_left': 3}}})
+        self.assertEqual(new['round'], {'hands_left': 3})
+        new = patch(new, {'~': 'o', 'patch': {'hand': {'~': 'l', 'n': 2}}})
+        self.assertEqual(new['hand'], [1, 5])
+        with self.assertRaises(ValueError):
+            patch(old, {'~': 'x'})
+
+    def test_patcher(self):
+        patcher = Patcher()
+        G = patcher.apply({'frame': 1, 'dollars': 4, 'hand': [self.card('H_2')]})
+        self.assertEqual(G['dollars'], 4)
+        G = patcher.apply({'base': 1, 'frame': 2, 'delta': {'~': 'o', 'set': {'dollars': 9, 'frame': 2}}})
+        self.assertEqual(G, {'frame': 2, 'dollars': 9, 'hand': [self.card('H_2')]})
+        # Nothing changed but the frame
+        G = patcher.apply({'base': 2, 'frame': 3})
+        self.assertEqual(G['frame'], 3)
+        # A duplicated or late delta is dropped
+        self.assertIsNone(patcher.apply({'base': 2, 'frame': 3, 'delta': {'~': 'o', 'set': {'dollars': 0}}}))
+        self.assertEqual(patcher.G['dollars'], 9)
+        # A gap means a delta was lost, and nothing applies until a keyframe
+        with self.assertRaises(DeltaLost):
+            patcher.apply({'base': 4, 'frame': 5, 'delta': {'~': 'o', 'set': {'dollars': 1}}})
+        with self.assertRaises(DeltaLost):
+            patcher.apply({'base': 5, 'frame': 6, 'delta': {'~': 'o', 'set': {'dollars': 2}}})
+        patcher.apply({'frame': 6, 'dollars': 2})
+        self.assertEqual(patcher.apply({'base': 6, 'frame': 7, 'delta': {'~': 'o', 'set': {'dollars': 3}}})['dollars'], 3)
+
+
+class TestBitser(unittest.TestCase):
+
+    def test_round_trip(self):
+        card = {'card_key': 'H_A', 'debuff': False, 'chips': 11.5}
+        G = {'hand': [card, card, {'card_key': 'H_A', 'debuff': True}],
+             'dollars': -3, 'ante': None, 'blind': {'chips': 300, 'mult': 2}}
+        data = bitser.dumps(G)
+        self.assertTrue(bitser.isbitser(data))
+        self.assertFalse(bitser.isbitser(b'{"hand": []}'))
+        loaded = bitser.loads(data)
+        self.assertEqual(loaded, G)
+        # A table sent twice is sent once and referenced, and comes back shared
+        self.assertIs(loaded['hand'][0], loaded['hand'][1])
+        self.assertIsNot(loaded['hand'][0], loaded['hand'][2])
+        self.assertEqual(data.count(b'card_key'), 1)
+        self.assertEqual(bitser.loads(bitser.dumps([[], {}])), [[], []])
+
+    def test_numbers(self):
+        for value, tag in [(-27, 0), (0, 27), (100, 127), (101, 250), (-28, 250), (-32768, 250),
+                           (32768, 245), (-2147483648, 245), (2147483648, 246), (0.5, 246), (3.0, 30)]:
+            data = bitser.dumps(value)
+            self.assertEqual(data[0], tag, value)
+            self.assertEqual(bitser.loads(data), value)
+        self.assertIs(bitser.loads(bitser.dumps(True)), True)
+        self.assertIs(bitser.loads(bitser.dumps(False)), False)
+
+    def test_references(self):
+        # Past 64 strings and tables seen, references need the long form
+        values = ['s{}'.format(i) for i in range(70)]
+        data = bitser.dumps(values + values)
+        self.assertEqual(bitser.loads(data), values + values)
+        self.assertIn(bytes([128 + 1]), data)
+        self.assertIn(bytes([243, 64 + 27]), data)
+        # Strings from 32 bytes on are long strings
+        text = 'x' * 40
+        data = bitser.dumps([text, text])
+        self.assertEqual(data[2], 244)
+        self.assertEqual(bitser.loads(data), [text, text])
+
+    def test_malformed(self):
+        with self.assertRaises(bitser.BitserError):
+            bitser.loads(bitser.dumps({'a': 1}) + b'\x1b')
+        with self.assertRaises(bitser.BitserError):
+            bitser.loads(bytes([bitser.TABLE, 28]))
+        with self.assertRaises(bitser.BitserError):
+            bitser.loads(bytes([200, 65]))
+        with self.assertRaises(bitser.BitserError):
+            bitser.loads(bytes([129]))
+        with self.assertRaises(bitser.BitserError):
+            bitser.dumps({'a': object()})
+
+
+class TestStandIn(unittest.TestCase):
+    # Round trips against bench.StandInServer, which speaks src/api.lua's
+    # protocol, each on a port of its own
+    port = 12460
+
+    def serve(self, **kwargs):
+        TestStandIn.port += 1
+        server = StandInServer(TestStandIn.port, animation=0.01, **kwargs)
+        server.start()
+        self.addCleanup(server.join)
+        self.addCleanup(server.stop)
+        return server
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('Timed out waiting on the stand-in game')
+            time.sleep(0.005)
+
+    def test_push(self):
+        server = self.serve()
+        bot = BenchBot(5, deck='Blue Deck', bot_port=server.addr[1], push=True)
+        bot.run()
+        # Subscribed once with HELLO|push, then every decision was pushed
+        self.assertIsNotNone(server.subscriber)
+        self.assertEqual(server.hellos, 1)
+        self.assertEqual(bot.decisions, 5)
+        self.wait_for(lambda: server.actions == 5)
+
+    def test_async_bot(self):
+        servers = [self.serve(seed=seed) for seed in range(3)]
+        runner = AsyncBot()
+        bots = [runner.add_bot(BenchBot(4, deck='Blue Deck', bot_port=server.addr[1], push=True)) for server in servers]
+        asyncio.run(runner.run())
+        # One event loop played every game through
+        self.assertEqual([bot.decisions for bot in bots], [4, 4, 4])
+        for server in servers:
+            self.wait_for(lambda: server.actions == 4)
+
+    def test_game_restart(self):
+        server = self.serve()
+        bot = BenchBot(10, deck='Blue Deck', bot_port=server.addr[1], push=True)
+        with Session(server.addr, timeout=1) as bot.session:
+            bot.sendcmd(bot.hellocmd())
+            for _ in range(3):
+                bot.session.send_action(bot.handlestate(bot.session.recv()))
+            self.wait_for(lambda: server.actions == 3)
+            # Counting from 1 again, which the bot has long since acted on
+            server.restart()
+            bot.sendcmd(bot.hellocmd())
+            cmdstr = bot.handlestate(bot.session.recv())
+            self.assertEqual(cmdstr, 'PLAY_HAND|1')
+            bot.session.send_action(cmdstr)
+            self.wait_for(lambda: server.actions == 4)
+
+    def test_chunk_loss(self):
+        server = self.serve(chunk_losses=2)
+        bot = BenchBot(4, deck='Blue Deck', bot_port=server.addr[1], push=True)
+        bot.chunk_size = 1000
+        bot.run()
+        self.assertEqual(server.chunk, 1000)
+        self.assertEqual(bot.decisions, 4)
+        # Each state missing a chunk was given up on and asked for again
+        self.assertEqual(server.hellos, 3)
+        self.wait_for(lambda: server.actions == 4)
+
+    def test_batch(self):
+        server = self.serve()
+        bot = BenchBot(1, deck='Blue Deck', bot_port=server.addr[1])
+        cmdstr = bot.actionToCmd([[Actions.PLAY_HAND, [1, 2]], [Actions.DISCARD_HAND, [3]]])
+        self.assertEqual(cmdstr, 'PLAY_HAND|1,2;DISCARD_HAND|3')
+        with Session(server.addr, timeout=1) as session:
+            session.send('HELLO|push')
+            self.assertTrue(session.isfresh(json.loads(session.recv())))
+            session.send_action(cmdstr)
+            # The next decision is pushed once the batch has been played
+            self.assertEqual(json.loads(session.recv())['seq'], 2)
+            self.assertEqual(server.received, [(1, [b'PLAY_HAND|1,2', b'DISCARD_HAND|3'])])
+            # A batch for a decision that's been and gone is turned down
+            session.send('1:' + cmdstr)
+            response = json.loads(session.recv())
+            self.assertEqual((response['response'], response['seq']), ('Error: Stale action for decision 1', 2))
+            self.assertEqual(len(server.received), 1)
+
+    def test_hello_options(self):
+        server = self.serve()
+        bot = BenchBot(2, deck='Blue Deck', bot_port=server.addr[1], push=True)
+        bot.fields['select_cards_from_hand'] = ('hand', 'current_round')
+        bot.run()
+        self.assertEqual((server.encoding, server.chunk, server.ack), ('bitser', 8192, True))
+        self.assertEqual(server.fields, {'start_run': set(), 'select_cards_from_hand': {'hand', 'current_round'}})
+        # Only the sections the hook uses, and the top level game data
+        self.assertEqual(set(bot.G) & set(FIELDS), {'hand', 'current_round'})
+        self.assertEqual(bot.G['dollars'], 4)
+
+        with Session(server.addr, timeout=1) as session:
+            # Sections for one waitingFor win over the default, even none at all
+            session.send('HELLO|encoding=bitser|fields=hand,deck|fields.select_shop_action=shop|fields.select_cards_from_hand=')
+            data = session.recv()
+            self.assertTrue(bitser.isbitser(data))
+            self.assertEqual(set(bitser.loads(data)) & set(FIELDS), set())
+            self.assertEqual(server.fields, {'default': {'hand', 'deck'}, 'select_shop_action': {'shop'}, 'select_cards_from_hand': set()})
+            # A plain HELLO goes back to everything, as JSON
+            session.send('HELLO')
+            self.assertEqual(set(json.loads(session.recv())) & set(FIELDS), set(FIELDS))
+
+    def test_lost_actions(self):
+        server = self.serve(loss=0.3, seed=2)
+        bot = BenchBot(6, deck='Blue Deck', bot_port=server.addr[1], push=True)
+        bot.run()
+        self.assertEqual(server.ack, True)
+        # Lost actions were sent again until acknowledged, and each decision
+        # was only acted on once
+        self.wait_for(lambda: server.actions == 6)
+        self.assertEqual([seq for seq, _ in server.received], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(server.hellos, 1)
+
+class TestBot(unittest.TestCase):
+
+    def test_idle_timeout(self):
+        bot = Bot(deck='Blue Deck')
+        bot.last_state = time.monotonic()
+        bot.checkidle()
+        bot.idle_timeout = 30
+        bot.checkidle()
+        # A game that's been quiet for longer has crashed or hung
+        bot.last_state -= 60
+        with self.assertRaises(GameStalled):
+            bot.checkidle()
+
+    def test_stop_balatro_instance(self):
+        bot = Bot(deck='Blue Deck', bot_port=12350)
+        # The game itself is launched, not a launcher that exits straight away
+        with mock.patch('subprocess.Popen') as popen:
+            bot.start_balatro_instance()
+        command = popen.call_args[0][0]
+        self.assertTrue(command[0].endswith(os.path.join('Balatro.app', 'Contents', 'MacOS', 'love')))
+        self.assertEqual(command[1:], ['12350'])
+        # So stopping it stops the game
+        game = bot.balatro_instance = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+        bot.stop_balatro_instance()
+        self.assertIsNotNone(game.poll())
+        self.assertIsNone(bot.balatro_instance)
+        bot.stop_balatro_instance()
+
+    def test_stale_states_are_not_activity(self):
+        bot = Bot(deck='Blue Deck')
+        bot.session = Sequencer()
+        bot.idle_timeout = 30
+        G = {'seq': 3, 'epoch': 100, 'waitingFor': 'select_shop_action', 'waitingForAction': False}
+        self.assertFalse(bot.updatestate(json.dumps(G)))
+        bot.session.tag('END_SHOP')
+        # The same decision over and over is a game that isn't getting anywhere
+        bot.last_state -= 60
+        self.assertFalse(bot.updatestate(json.dumps(G)))
+        with self.assertRaises(GameStalled):
+            bot.checkidle()
+        # A restarted game's decisions are new ones, even with a lower seq
+        self.assertFalse(bot.updatestate(json.dumps(dict(G, seq=1, epoch=250))))
+        bot.checkidle()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
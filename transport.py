@@ -0,0 +1,224 @@
+import json
+import time
+import socket
+
+
+class ChunkLost(TimeoutError):
+    # Raised when a chunked gamestate doesn't finish arriving in time. It's a
+    # timeout like any other, so callers just ask for the state again.
+    pass
+
+
+class Reassembler:
+    # Puts CHUNK|msgid|index|count|payload datagrams (BalatrobotAPI.sendpayload
+    # in src/api.lua) back together. Only one message is in flight at a time:
+    # a newer msgid, or `timeout` seconds without completing, means a chunk of
+    # the current one was lost and it's dropped.
+    PREFIX = b"CHUNK|"
+
+    def __init__(self, timeout: float = 0.5, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.msgid = None
+        self.parts = None
+        self.missing = 0
+        self.deadline = None
+
+    @property
+    def pending(self):
+        return self.msgid is not None
+
+    def ischunk(self, data):
+        return data[: len(self.PREFIX)] == self.PREFIX
+
+    def remaining(self):
+        return self.deadline - self.clock()
+
+    def expired(self):
+        if self.pending and self.clock() >= self.deadline:
+            self.reset()
+            return True
+        return False
+
+    def add(self, data):
+        # Returns the whole payload once the last chunk is in, otherwise None
+        fields = bytes(data[:64]).split(b"|", 4)
+        header_end = sum(len(field) for field in fields[:4]) + 4
+        msgid, index, count = (int(field) for field in fields[1:4])
+
+        if msgid != self.msgid:
+            self.msgid = msgid
+            self.parts = [None] * count
+            self.missing = count
+            self.deadline = self.clock() + self.timeout
+
+        if self.parts[index - 1] is None:
+            self.parts[index - 1] = bytes(data[header_end:])
+            self.missing -= 1
+
+        if self.missing:
+            return None
+
+        payload = b"".join(self.parts)
+        self.reset()
+        return payload
+
+
+class Sequencer:
+    # Tracks which decision (the "seq" the game sends with every gamestate) we
+    # last acted on, so the same decision arriving twice - a HELLO reply racing a
+    # push, a duplicated datagram - is dropped instead of acted on again.
+    #
+    # The game restarting starts the count again, which its "epoch" (when it
+    # started) changing tells us.
+    #
+    # It also keeps the last action until the game acknowledges it (HELLO|ack),
+    # sending it again after `backoff`, 2 * `backoff`, ... seconds, up to
+    # `retries` times, so one lost datagram doesn't cost a whole timeout.
+    ACK_PREFIX = b'{"ack":'
+
+    def __init__(self, retries: int = 4, backoff: float = 0.25, clock=time.monotonic):
+        self.acted_seq = -1
+        self.current_seq = None
+        self.epoch = None
+        self.retries = retries
+        self.backoff = backoff
+        self.clock = clock
+        self.unacked = None
+        self.attempts = 0
+        self.retransmit_at = None
+
+    def isfresh(self, G):
+        if G.get("epoch") != self.epoch:
+            # A new game, nothing we did in the old one counts
+            self.epoch = G.get("epoch")
+            self.acted_seq = -1
+            self.unacked = None
+        seq = G.get("seq")
+        if seq is None:
+            # The mod predates sequence numbers, nothing to compare against
+            self.current_seq = None
+            return True
+        if seq <= self.acted_seq:
+            return False
+        # The game has moved on, so it got our last action
+        self.unacked = None
+        self.current_seq = seq
+        return True
+
+    def tag(self, cmdstr):
+        # SEQ:ACTION|arg1|arg2, see Utils.parseseq in src/utils.lua
+        if self.current_seq is None:
+            return cmdstr
+        self.acted_seq = self.current_seq
+        cmdstr = "{}:{}".format(self.current_seq, cmdstr)
+
+        self.unacked = cmdstr
+        self.attempts = 0
+        self.retransmit_at = self.clock() + self.backoff
+        return cmdstr
+
+    def isack(self, data):
+        return data[: len(self.ACK_PREFIX)] == self.ACK_PREFIX
+
+    def acked(self, data):
+        if json.loads(bytes(data))["ack"] == self.acted_seq:
+            self.unacked = None
+
+    def retransmit(self):
+        # Returns the action to send again if it's gone unacknowledged too long
+        if self.unacked is None or self.clock() < self.retransmit_at:
+            return None
+        if self.attempts >= self.retries:
+            # Give up, the usual timeout and HELLO will sort it out
+            self.unacked = None
+            return None
+
+        self.attempts += 1
+        self.retransmit_at = self.clock() + self.backoff * 2**self.attempts
+        return self.unacked
+
+    def until_retransmit(self):
+        return self.retransmit_at - self.clock()
+
+    def rejected(self, response):
+        # The game turned down our action for this decision, so it's worth
+        # deciding on again. Returns True if it was ours.
+        if response.get("seq") != self.acted_seq or response.get("epoch") != self.epoch:
+            return False
+        self.expire()
+        return True
+
+    def expire(self):
+        self.unacked = None
+        self.acted_seq = -1 if self.current_seq is None else self.current_seq - 1
+
+
+class Session(Sequencer):
+    # One UDP socket to the game for the lifetime of the bot. Datagrams are
+    # received into a preallocated buffer and decoded straight out of it.
+    def __init__(self, addr, timeout: float = 5, bufsize: int = 65536):
+        super().__init__()
+        self.addr = addr
+        self.timeout = timeout
+        self.reassembler = Reassembler()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+        self.buffer = bytearray(bufsize)
+        self.view = memoryview(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        self.sock.close()
+
+    def send(self, cmdstr):
+        self.sock.sendto(bytes(cmdstr, "utf-8"), self.addr)
+
+    def send_action(self, cmdstr):
+        self.send(self.tag(cmdstr))
+
+    def recv(self):
+        deadline = self.clock() + self.timeout
+        while True:
+            if self.reassembler.expired():
+                raise ChunkLost("Gave up waiting on the rest of a chunked gamestate")
+
+            resend = self.retransmit()
+            if resend is not None:
+                self.send(resend)
+
+            # Don't wait the full timeout on a chunked state that's missing a
+            # piece, or on an action that may need sending again
+            timeout = deadline - self.clock()
+            if self.reassembler.pending:
+                timeout = min(timeout, self.reassembler.remaining())
+            if self.unacked is not None:
+                timeout = min(timeout, self.until_retransmit())
+            self.sock.settimeout(max(timeout, 0.001))
+
+            try:
+                nbytes = self.sock.recv_into(self.buffer)
+            except socket.timeout:
+                if self.reassembler.pending or self.clock() < deadline:
+                    continue
+                raise
+
+            data = self.view[:nbytes]
+            if self.isack(data):
+                self.acked(data)
+                continue
+            if not self.reassembler.ischunk(data):
+                return bytes(data)
+
+            payload = self.reassembler.add(data)
+            if payload is not None:
+                return payload